@@ -44,11 +44,8 @@ download_scihub() {
     fi
 
     wget -q -O "$scihub_dir/$filename" "$url"
-    if [ -f "$scihub_dir/$filename" ] && [ -s "$scihub_dir/$filename" ]; then
-        if [ ! -f "$combined_dir/$filename" ]; then
-            cp "$scihub_dir/$filename" "$combined_dir/$filename"
-        fi
-    else
+    # Valider le PDF et le stocker une seule fois (lien physique dans data_pdf)
+    if ! python3 script_python/pdf_store.py add "$scihub_dir/$filename" --dest "$combined_dir" --keep-existing; then
         echo "$doi" >> "$log_file"
         rm -f "$scihub_dir/$filename"
         rm -f "$temp_page"
@@ -69,11 +66,8 @@ download_doi() {
 
     if [ -n "$pdf_link" ]; then
         wget -q "$pdf_link" -O "$doi_dir/$filename"
-        if [ -f "$doi_dir/$filename" ] && [ -s "$doi_dir/$filename" ]; then
-            if [ ! -f "$combined_dir/$filename" ]; then
-                cp "$doi_dir/$filename" "$combined_dir/$filename"
-            fi
-        else
+        # Valider le PDF et le stocker une seule fois (lien physique dans data_pdf)
+        if ! python3 script_python/pdf_store.py add "$doi_dir/$filename" --dest "$combined_dir" --keep-existing; then
             echo "$doi" >> "$log_file"
             rm -f "$doi_dir/$filename"
             return 1
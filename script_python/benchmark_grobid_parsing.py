@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the TEI parsing (grobid_parsing.py) on generated Grobid-style
+TEI files.
+
+The lxml parsing is compared with the previous path (regex removal of the
+references, grobid_tei_xml, BeautifulSoup for the figure legends, JSON
+dump and reload), which needs `pip install grobid_tei_xml beautifulsoup4`.
+Each path runs in its own process, so that the peak RSS reported is its
+own, and the JSON of the two paths is checked to be identical.
+
+With `--large MB`, a single very large TEI file (a thesis or a book) is
+generated instead, and the tree parsing is compared with the stream
+parsing (`grobid_parsing.stream_document`, `--stream-threshold`).
+
+    python script_python/benchmark_grobid_parsing.py --files 1000
+    python script_python/benchmark_grobid_parsing.py --large 50 --sections
+
+@author: amichaud
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from tei_io import list_tei, open_tei, read_tei, tei_size
+
+# Number of files generated by default
+FILES = 1000
+
+TEI_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<TEI xml:space="preserve" xmlns="http://www.tei-c.org/ns/1.0" xmlns:xlink="http://www.w3.org/1999/xlink">
+\t<teiHeader xml:lang="en">
+\t\t<fileDesc>
+\t\t\t<titleStmt><title level="a" type="main">{title}</title></titleStmt>
+\t\t\t<publicationStmt><publisher>Example Press</publisher><date type="published" when="2020-01-01">2020</date></publicationStmt>
+\t\t\t<sourceDesc><biblStruct>
+\t\t\t\t<analytic>{authors}<title level="a" type="main">{title}</title></analytic>
+\t\t\t\t<monogr><title level="j" type="main">Journal of Examples</title><imprint><biblScope unit="volume">12</biblScope><date type="published" when="2020-01-01" /></imprint></monogr>
+\t\t\t\t<idno type="DOI">10.1000/example.{number}</idno>
+\t\t\t</biblStruct></sourceDesc>
+\t\t</fileDesc>
+\t\t<encodingDesc><appInfo><application version="0.7.2" ident="GROBID" when="2023-01-01T00:00+0000"><ref target="https://github.com/kermitt2/grobid">GROBID</ref></application></appInfo></encodingDesc>
+\t\t<profileDesc><abstract><div xmlns="http://www.tei-c.org/ns/1.0"><p>{abstract}</p></div></abstract></profileDesc>
+\t</teiHeader>
+\t<text xml:lang="en">
+\t\t<body>
+"""
+
+WORDS = ("cell embryo notochord gene expression protein signal tissue stage muscle larva development "
+         "membrane analysis sequence region factor pathway transcription domain model").split()
+
+
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _author(rng, index):
+    return (f'<author><persName><forename type="first">{rng.choice("ABCDEFGH")}</forename>'
+            f'<surname>Author{index}</surname></persName><affiliation key="aff{index}">'
+            f'<orgName type="institution">University {index}</orgName>'
+            f'<address><country key="FR">France</country></address></affiliation></author>')
+
+
+def generate_tei(number=0, sections=6, paragraphs=4, figures=3, references=30, seed=None):
+    """
+    Generate a Grobid-style TEI document: header, sections of paragraphs
+    citing references and figures, figures with coordinates, a table, an
+    acknowledgement and a list of references.
+
+    Args:
+        number (int): The number of the document (used in its DOI).
+        sections (int): The number of sections of the body.
+        paragraphs (int): The number of paragraphs per section.
+        figures (int): The number of figures (a table is added).
+        references (int): The number of references.
+        seed (int): The seed of the generated text (default: `number`).
+
+    Returns:
+        str: The TEI XML document.
+    """
+    rng = random.Random(number if seed is None else seed)
+    parts = [TEI_HEADER.format(title=_sentence(rng, 8)[:-1], number=number, abstract=_sentence(rng, 40),
+                               authors="".join(_author(rng, index) for index in range(3)))]
+    for section in range(sections):
+        parts.append(f'<div xmlns="http://www.tei-c.org/ns/1.0"><head n="{section + 1}.">{_sentence(rng, 3)[:-1]}</head>')
+        for _ in range(paragraphs):
+            reference = rng.randrange(references) if references else 0
+            figure = rng.randrange(figures) if figures else 0
+            parts.append(f'<p>{_sentence(rng, 30)} <ref type="bibr" target="#b{reference}">(Author{reference}, 2010)</ref> '
+                         f'{_sentence(rng, 20)} <ref type="figure" target="#fig_{figure}">(Fig. {figure + 1}</ref>). '
+                         f'{_sentence(rng, 25)}</p>\n')
+        parts.append("</div>\n")
+    for figure in range(figures):
+        page = figure + 2
+        parts.append(f'<figure xmlns="http://www.tei-c.org/ns/1.0" xml:id="fig_{figure}" coords="{page},72.00,96.00,451.28,210.33">'
+                     f'<head>Fig. {figure + 1} .</head><label>{figure + 1}</label><figDesc>{_sentence(rng, 25)}</figDesc>'
+                     f'<graphic coords="{page},72.00,96.00,451.28,180.00" type="bitmap" /></figure>\n')
+    parts.append('<figure xmlns="http://www.tei-c.org/ns/1.0" type="table" xml:id="tab_0" coords="9,72.00,96.00,451.28,120.00">'
+                 f'<head>Table 1</head><label>1</label><figDesc>{_sentence(rng, 10)}</figDesc>'
+                 '<table><row><cell>Stage</cell><cell>Cells</cell></row></table></figure>\n')
+    parts.append('\t\t</body>\n\t\t<back>\n<div type="acknowledgement">\n<div xmlns="http://www.tei-c.org/ns/1.0">'
+                 f'<head>Acknowledgements</head><p>{_sentence(rng, 15)}</p></div>\n</div>\n'
+                 '\t\t\t<div type="references">\n\t\t\t\t<listBibl>\n')
+    for reference in range(references):
+        parts.append(f'<biblStruct xml:id="b{reference}"><analytic><title level="a" type="main">{_sentence(rng, 8)[:-1]}</title>'
+                     f'<author><persName><forename type="first">{rng.choice("ABCDEFGH")}</forename><surname>Author{reference}</surname></persName></author>'
+                     f'<idno type="DOI">10.1000/ref.{number}.{reference}</idno></analytic>'
+                     f'<monogr><title level="j">Journal {reference % 7}</title><imprint><biblScope unit="volume">{reference + 1}</biblScope>'
+                     f'<biblScope unit="page" from="{reference + 10}" to="{reference + 20}" /><date type="published" when="{1990 + reference % 30}" /></imprint></monogr>'
+                     f'<note type="raw_reference">Author{reference}. Journal {reference % 7}, {1990 + reference % 30}.</note></biblStruct>\n')
+    parts.append("\t\t\t\t</listBibl>\n\t\t\t</div>\n\t\t</back>\n\t</text>\n</TEI>\n")
+    return "".join(parts)
+
+
+def baseline_tei_to_json(xml_data):
+    """
+    Convert a TEI document the way grobid_parsing.py did before the lxml
+    parsing: regex removal of the references, grobid_tei_xml, BeautifulSoup
+    for the figure legends, then JSON dump and reload to remove the newlines.
+
+    Args:
+        xml_data (str): The TEI XML document.
+
+    Returns:
+        str: The JSON string.
+    """
+    import grobid_tei_xml
+    from bs4 import BeautifulSoup
+
+    xml_data = re.sub(r'<ref type.*?</ref>', '', xml_data, flags=re.DOTALL)
+    doc_dict = grobid_tei_xml.parse_document_xml(xml_data).to_dict()
+    legends = []
+    for fig in BeautifulSoup(xml_data, "xml").find_all("figure"):
+        desc = fig.find("figDesc")
+        if desc:
+            legends.append(desc.get_text(strip=True))
+    doc_dict["figure_legends"] = legends
+
+    data = json.loads(json.dumps(doc_dict, indent=2))
+    if 'abstract' in data and data['abstract']:
+        data['abstract'] = data['abstract'].replace('\n', '')
+    if 'body' in data and data['body']:
+        data['body'] = data['body'].replace('\n', '')
+    return json.dumps(data)
+
+
+def baseline_path(path, sections=False):
+    return baseline_tei_to_json(read_tei(path))
+
+
+def lxml_path(path, sections=False, stream=False):
+    # Imported here, like the modules of the previous path: each child process only loads its own parser
+    from grobid_parsing import tei_to_json
+    # Read from the file as grobid_parsing.convert_file does
+    with open_tei(path) as xml_file:
+        return tei_to_json(xml_file, sections, stream)
+
+
+def lxml_stream_path(path, sections=False):
+    return lxml_path(path, sections, stream=True)
+
+
+# Parsing paths compared, run in a child process each
+PATHS = {
+    "grobid_tei_xml": baseline_path,
+    "lxml": lxml_path,
+    "lxml-stream": lxml_stream_path,
+}
+
+
+def peak_rss_mib():
+    """
+    Return the peak resident memory of this process, in MiB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_path(name, tei_dir, output_file, sections=False):
+    """
+    Convert every TEI file of a directory with one path, then write the
+    throughput, the peak RSS and the sha256 of each JSON to `output_file`.
+    """
+    convert = PATHS[name]
+    files = list_tei(tei_dir)
+    size = sum(tei_size(path) for _, path in files)
+    digests = []
+    start = time.perf_counter()
+    for _, path in files:
+        digests.append(hashlib.sha256(convert(path, sections).encode("utf-8")).hexdigest())
+    elapsed = time.perf_counter() - start
+    with open(output_file, "w", encoding="utf-8") as out:
+        json.dump({"files": len(files), "mb": size / 1e6, "seconds": elapsed,
+                   "peak_rss_mib": peak_rss_mib(), "digests": digests}, out)
+
+
+def measure(name, tei_dir, work_dir, sections=False):
+    """
+    Run one path in a child process and return its measures.
+    """
+    output_file = os.path.join(work_dir, f"{name}.json")
+    command = [sys.executable, os.path.abspath(__file__), "--run", name, "--tei-dir", tei_dir, "--output", output_file]
+    subprocess.run(command + (["--sections"] if sections else []), check=True)
+    with open(output_file, "r", encoding="utf-8") as result_file:
+        return json.load(result_file)
+
+
+def generate_large_tei(path, megabytes):
+    """
+    Write a single TEI document of about `megabytes` MB (a thesis or a
+    book): sections, figures and references grow with the size.
+    """
+    # Size of a section of the generated documents
+    section_size = (len(generate_tei(sections=11, figures=0, references=0))
+                    - len(generate_tei(sections=1, figures=0, references=0))) / 10
+    sections = max(1, int(megabytes * 1e6 / section_size))
+    with open(path, "w", encoding="utf-8") as tei_file:
+        tei_file.write(generate_tei(sections=sections, figures=max(1, sections // 5),
+                                    references=max(1, sections // 2)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the TEI parsing on generated Grobid-style TEI files.")
+    parser.add_argument("--files", type=int, default=FILES,
+                        help=f"Number of TEI files generated (default: {FILES})")
+    parser.add_argument("--large", type=float, metavar="MB",
+                        help="Generate a single TEI file of this size instead, and compare the tree and "
+                             "stream parsing (default paths: lxml lxml-stream)")
+    parser.add_argument("--tei-dir", help="Directory of TEI files to use instead of generated ones")
+    parser.add_argument("--paths", nargs="+", choices=list(PATHS),
+                        help="Parsing paths compared (default: grobid_tei_xml lxml)")
+    parser.add_argument("--sections", action="store_true",
+                        help="Add the sections of the body (lxml paths only)")
+    parser.add_argument("--run", choices=list(PATHS), help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_path(args.run, args.tei_dir, args.output, args.sections)
+        return
+
+    paths = args.paths or (["lxml", "lxml-stream"] if args.large or args.sections else ["grobid_tei_xml", "lxml"])
+    if args.sections and "grobid_tei_xml" in paths:
+        parser.error("--sections is not available with the grobid_tei_xml path")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        tei_dir = args.tei_dir
+        if tei_dir is None:
+            tei_dir = os.path.join(work_dir, "tei")
+            os.makedirs(tei_dir)
+            if args.large:
+                generate_large_tei(os.path.join(tei_dir, "large.tei.xml"), args.large)
+            else:
+                for number in range(args.files):
+                    with open(os.path.join(tei_dir, f"doc{number:06d}.tei.xml"), "w", encoding="utf-8") as tei_file:
+                        tei_file.write(generate_tei(number))
+
+        results = {name: measure(name, tei_dir, work_dir, args.sections) for name in paths}
+        first = next(iter(results.values()))
+        print(f"{first['files']} TEI files, {first['mb']:.1f} MB")
+        for name, result in results.items():
+            print(f"{name:>15}: {result['files'] / result['seconds']:8.1f} files/s, "
+                  f"{result['mb'] / result['seconds']:6.1f} MB/s, peak RSS {result['peak_rss_mib']:7.1f} MiB")
+        outputs = [result["digests"] for result in results.values()]
+        print("JSON output: " + ("identical" if all(output == outputs[0] for output in outputs) else "DIFFERENT"))
+
+
+if __name__ == "__main__":
+    main()
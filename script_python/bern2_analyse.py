@@ -3,18 +3,71 @@
 """
 Script to analyse text with bern2 (regex clean of 'NaN' in response only, with figure legends support)
 
+When the JSON has the structure of the body (grobid_parsing.py --sections),
+the body is sent paragraph by paragraph instead of as one large text. The
+annotations are moved back to their position in the body, so the result
+has the same form. The results of the paragraphs are cached by content
+(cache/bern2_paragraphs.sqlite), so a paragraph already analysed, in a
+previous run or in another article, is not sent again.
+
+The articles can be read from, and the results written to, a directory
+of JSON files or a JSON Lines corpus (see json_corpus.py).
+
 @author: amichaud
 """
 
+import argparse
+import hashlib
 import os
 import json
 import re
+import sqlite3
+import time
 import requests
 
-def save_file(file_name, res_data_directory, content):
-    file_path = os.path.join(res_data_directory, file_name)
-    with open(file_path, 'w', encoding='utf-8') as file:
-        json.dump(content, file, ensure_ascii=False, indent=2)
+from json_corpus import COMPRESSIONS, iter_json_documents, open_writer
+
+# Default location of the cache of the paragraph results
+DEFAULT_CACHE = "cache/bern2_paragraphs.sqlite"
+
+
+class ParagraphCache:
+    """
+    BERN2 results of paragraphs, stored in a SQLite database and keyed by
+    the sha256 of the text.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS paragraphs (
+                   sha256 TEXT PRIMARY KEY,
+                   result TEXT NOT NULL,
+                   updated REAL NOT NULL
+               )"""
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, key):
+        row = self.connection.execute("SELECT result FROM paragraphs WHERE sha256 = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, result):
+        self.connection.execute("INSERT OR REPLACE INTO paragraphs VALUES (?, ?, ?)",
+                                (key, json.dumps(result, ensure_ascii=False), time.time()))
+        self.connection.commit()
 
 def regex_clean_nan_in_response(data):
     """
@@ -39,26 +92,95 @@ def query_plain(text, url="http://localhost:8888/plain"):
         print(f"Request error: {e}")
         return {}
 
-def process_json_files(json_directory, res_data_directory):
+def body_segments(body, sections):
+    """
+    Split the body into the titles and paragraphs of its sections, and
+    the text between them (figure legends, formulas...), so that every
+    part of the body is analysed.
+
+    Returns:
+        list: [start, end] offsets in the body, in order.
+    """
+    spans = []
+    for section in sections:
+        spans.extend(([section["head"]] if "head" in section else []) + section.get("paragraphs", []))
+    segments = []
+    last = 0
+    # The empty span at the end of the body closes the last gap
+    for start, end in spans + [[len(body), len(body)]]:
+        gap = body[last:start]
+        if gap.strip():
+            gap_start = last + len(gap) - len(gap.lstrip())
+            segments.append([gap_start, gap_start + len(gap.strip())])
+        if end > start:
+            segments.append([start, end])
+        last = end
+    return segments
+
+def query_paragraphs(body, sections, url="http://localhost:8888/plain", cache=None):
+    """
+    Analyse the body paragraph by paragraph (see `body_segments`).
+
+    Args:
+        body (str): The flat body text.
+        sections (list): The sections of the body, with the [start, end]
+            offsets of their title and paragraphs (see grobid_parsing.extract_sections).
+        url (str): The BERN2 API.
+        cache (ParagraphCache): Cache of the paragraph results, not used if None.
+
+    Returns:
+        dict: The result for the whole body: its text, and the annotations
+            of every paragraph with spans in the body.
+    """
+    annotations = []
+    timestamp = None
+    for start, end in body_segments(body, sections):
+        text = body[start:end]
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        result = cache.get(key) if cache is not None else None
+        if result is None:
+            result = query_plain(text, url)
+            # Failed requests return {} and are not cached
+            if result and cache is not None:
+                cache.put(key, result)
+        timestamp = result.get("timestamp", timestamp)
+        for annotation in result.get("annotations", []):
+            annotation = dict(annotation)
+            annotation["span"] = {"begin": annotation["span"]["begin"] + start,
+                                  "end": annotation["span"]["end"] + start}
+            annotations.append(annotation)
+    result = {"annotations": annotations, "text": body}
+    if timestamp:
+        result["timestamp"] = timestamp
+    return result
+
+def process_json_files(json_directory, res_data_directory, url="http://localhost:8888/plain", cache=None,
+                       output_format="files", compression="none"):
+    """
+    Analyse the articles of a directory of JSON files or of a JSON Lines
+    corpus, and write the results as JSON files (data_bern2_<id>.json) or
+    as a corpus (output_format "jsonl").
+    """
     directory_path = os.path.abspath(json_directory)
     if not os.path.isdir(directory_path):
         print(f"The directory {directory_path} does not exist.")
         return
 
-    for filename in os.listdir(directory_path):
-        if filename.endswith(".json"):
-            file_path = os.path.join(directory_path, filename)
-            with open(file_path, 'r', encoding='utf-8') as file:
-                data = json.load(file)
-
-            res_abstract = query_plain(data['abstract']) if 'abstract' in data and data['abstract'] else {}
-            res_body = query_plain(data['body']) if 'body' in data and data['body'] else {}
+    with open_writer(res_data_directory, output_format, compression, prefix="data_bern2_", indent=2) as writer:
+        for doc_id, data in iter_json_documents(directory_path):
+            res_abstract = query_plain(data['abstract'], url) if 'abstract' in data and data['abstract'] else {}
+            if not data.get('body'):
+                res_body = {}
+            elif data.get('sections'):
+                res_body = query_paragraphs(data['body'], data['sections'], url, cache)
+            else:
+                res_body = query_plain(data['body'], url)
 
             res_legends = []
             if 'figure_legends' in data and isinstance(data['figure_legends'], list):
                 for legend in data['figure_legends']:
                     if legend.strip():
-                        res_legends.append(query_plain(legend))
+                        res_legends.append(query_plain(legend, url))
 
             json_final = {
                 "abstract": res_abstract,
@@ -66,15 +188,32 @@ def process_json_files(json_directory, res_data_directory):
                 "figure_legends": res_legends
             }
 
-            result_filename = "data_bern2_" + filename
-            print(f"File {filename} processed successfully.")
-            save_file(result_filename, res_data_directory, json_final)
+            print(f"File {doc_id}.json processed successfully.")
+            writer.write(doc_id, json_final)
 
 def main():
-    json_directory = "./data_json"
-    res_data_directory = "./data_bern2"
+    parser = argparse.ArgumentParser(description="Analyse the JSON of the articles with BERN2.")
+    parser.add_argument("--json-dir", default="./data_json",
+                        help="Directory of the JSON files, or JSON Lines corpus (default: ./data_json)")
+    parser.add_argument("--output-dir", default="./data_bern2", help="Directory of the results (default: ./data_bern2)")
+    parser.add_argument("--url", default="http://localhost:8888/plain", help="BERN2 API (default: http://localhost:8888/plain)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE,
+                        help=f"Cache of the paragraph results (default: {DEFAULT_CACHE}), an empty value disables it")
+    parser.add_argument("--format", choices=["files", "jsonl"], default="files",
+                        help="One JSON file per article (files, default), or a JSON Lines corpus (jsonl)")
+    parser.add_argument("--compress", choices=list(COMPRESSIONS), default="none",
+                        help="Compression of the JSON Lines shards (default: none)")
+    args = parser.parse_args()
+
+    json_directory = args.json_dir
+    res_data_directory = args.output_dir
     os.makedirs(res_data_directory, exist_ok=True)
-    process_json_files(json_directory, res_data_directory)
+    if args.cache:
+        with ParagraphCache(args.cache) as cache:
+            process_json_files(json_directory, res_data_directory, args.url, cache, args.format, args.compress)
+    else:
+        process_json_files(json_directory, res_data_directory, args.url, None, args.format, args.compress)
 
-main()
+if __name__ == "__main__":
+    main()
 
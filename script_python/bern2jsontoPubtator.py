@@ -1,15 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
+Convert the BERN2 results (JSON files or JSON Lines corpus) into PubTator format.
+
 Created on Mon Jun  3 15:49:34 2024
 
 @author: amichaud
 """
 
+import argparse
 import json
-import sys
 import os
 
+from json_corpus import is_corpus, iter_json_documents
+
 def read_json_file(file_path):
     """Read JSON data from a file."""
     with open(file_path, 'r') as file:
@@ -53,52 +57,83 @@ def process_file(json_file_path):
     file_name = os.path.basename(json_file_path).split('.json')[0]  # Get the base name of the file without extension
     
     try:
-        pubtator_content = ""
         json_data = read_json_file(json_file_path)  # Read JSON data from file
-        
-        # Check if 'abstract' part exists and generate content
-        if 'title' in json_data:
-            pubtator_content = generate_pubtator_format(json_data, file_name, 'title')
-            
-        # Check if 'abstract' part exists and generate content
-        if 'abstract' in json_data:
-            pubtator_content = generate_pubtator_format(json_data, file_name, 'abstract')
-        
-        # Check if 'data' part exists and append generated content
-        if 'data' in json_data :
-            if pubtator_content:  # Add a new line if there is already content
-                pubtator_content += '\n'
-            pubtator_content += generate_pubtator_format(json_data, file_name, 'data')
-        
-        # Check if 'body' part exists and append generated content
-        if 'body' in json_data :
-            if pubtator_content:  # Add a new line if there is already content
-                pubtator_content += '\n'
-            pubtator_content += generate_pubtator_format(json_data, file_name, 'body')
-        
-        return pubtator_content
+        return process_data(json_data, file_name)
     
     except Exception as e:
         print(f"An error occurred while processing {json_file_path}: {e}")
 
+def process_data(json_data, file_name):
+    """Generate the PubTator content of a BERN2 result."""
+    pubtator_content = ""
+    # Check if 'abstract' part exists and generate content
+    if 'title' in json_data:
+        pubtator_content = generate_pubtator_format(json_data, file_name, 'title')
+        
+    # Check if 'abstract' part exists and generate content
+    if 'abstract' in json_data:
+        pubtator_content = generate_pubtator_format(json_data, file_name, 'abstract')
+    
+    # Check if 'data' part exists and append generated content
+    if 'data' in json_data :
+        if pubtator_content:  # Add a new line if there is already content
+            pubtator_content += '\n'
+        pubtator_content += generate_pubtator_format(json_data, file_name, 'data')
+    
+    # Check if 'body' part exists and append generated content
+    if 'body' in json_data :
+        if pubtator_content:  # Add a new line if there is already content
+            pubtator_content += '\n'
+        pubtator_content += generate_pubtator_format(json_data, file_name, 'body')
+    
+    return pubtator_content
+
+def process_corpus(input_path, output_path, output_file=None):
+    """Process the BERN2 results of a JSON Lines corpus (or of a directory of JSON files),
+    into a PubTator file per document, or into a single PubTator file if output_file is given."""
+    single = open(output_file, 'w') if output_file else None
+    try:
+        count = 0
+        for doc_id, json_data in iter_json_documents(input_path):
+            try:
+                pubtator_content = process_data(json_data, doc_id)
+            except Exception as e:
+                print(f"An error occurred while processing {doc_id}: {e}")
+                continue
+            if single is not None:
+                single.write(("\n\n" if count else "") + pubtator_content)
+            else:
+                save_to_file(pubtator_content, os.path.join(output_path, f"{doc_id}.pubtator"))
+            count += 1
+    finally:
+        if single is not None:
+            single.close()
+    print(f"{count} documents of {input_path} saved to {output_file or output_path}")
+
 def main():
     """Main function to handle input arguments and process files or directories."""
-    if len(sys.argv) != 3:
-        print("Usage: python script.py <json_file_path_or_directory> <output_directory>")
-        return
+    parser = argparse.ArgumentParser(description="Convert BERN2 results into PubTator format.")
+    parser.add_argument("input_path", help="JSON file, directory of JSON files, or JSON Lines corpus")
+    parser.add_argument("output_path", help="Output directory of the PubTator files")
+    parser.add_argument("--output-file", help="Write all the documents to this single PubTator file instead")
+    args = parser.parse_args()
         
-    input_path = sys.argv[1]
-    output_path = sys.argv[2]
+    input_path = args.input_path
+    output_path = args.output_path
     
     # Create the output directory if it does not exist
     if not os.path.exists(output_path):
         os.makedirs(output_path)
         print(f"Created output directory: {output_path}")
     
-        
-    if os.path.isfile(input_path):
+    if is_corpus(input_path) or (args.output_file and os.path.isdir(input_path)):
+        process_corpus(input_path, output_path, args.output_file)
+
+    elif os.path.isfile(input_path):
         # Process single file
         pubtator_content = process_file(input_path)
+        if pubtator_content is None:
+            return
         file_name = os.path.basename(input_path).split('.json')[0]
         output_file_path = os.path.join(output_path, f"{file_name}.pubtator")
         save_to_file(pubtator_content, output_file_path)
@@ -110,6 +145,8 @@ def main():
             if filename.endswith('.json'):
                 file_path = os.path.join(input_path, filename)
                 pubtator_content = process_file(file_path)
+                if pubtator_content is None:
+                    continue
                 output_file_path = os.path.join(output_path, f"{filename.split('.json')[0]}.pubtator")
                 save_to_file(pubtator_content, output_file_path)
                 print(f"Output saved to {output_file_path}")
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent ledger of the PDF downloads, shared by the fetchers
+(extract_publi_PMC.py, extract_publi_directaccess.py, extract_publi_PMC_oa.py).
+
+Each article identifier (DOI or PMID) has, for each source (fetcher), a
+state (pending, downloaded or failed), the reason of the last failure,
+the number of attempts and, once downloaded, the path, sha256 and size
+of the PDF. The attempts and failures are counted per source, so that a
+source does not skip the articles that only failed with another one,
+while an article downloaded by any source is skipped by all of them.
+Every update is a single SQLite transaction, so an interrupted run can be
+restarted and only the articles that are not finished are fetched again.
+
+@author: amichaud
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+# Default location of the ledger database
+DEFAULT_LEDGER = "cache/downloads.sqlite"
+# Failed articles are not retried after this number of attempts
+MAX_ATTEMPTS = 3
+
+PENDING = "pending"
+DOWNLOADED = "downloaded"
+FAILED = "failed"
+
+CREATE_DOWNLOADS = """CREATE TABLE IF NOT EXISTS downloads (
+                          identifier TEXT NOT NULL,
+                          source TEXT NOT NULL,
+                          state TEXT NOT NULL,
+                          reason TEXT,
+                          attempts INTEGER NOT NULL DEFAULT 0,
+                          path TEXT,
+                          sha256 TEXT,
+                          bytes INTEGER,
+                          updated REAL NOT NULL,
+                          PRIMARY KEY (identifier, source)
+                      )"""
+COLUMNS = "identifier, source, state, reason, attempts, path, sha256, bytes, updated"
+
+
+class DownloadLedger:
+    """
+    Download states stored in a SQLite database, as seen by one source
+    (e.g. "pmc"). The ledger can be updated from several worker threads.
+    """
+
+    def __init__(self, path=DEFAULT_LEDGER, max_attempts=MAX_ATTEMPTS, source=""):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_attempts = max_attempts
+        self.source = source
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        keys = [row[1] for row in self.connection.execute("PRAGMA table_info(downloads)") if row[5]]
+        if keys == ["identifier"]:
+            # Ledger written when the attempts were not counted per source
+            self.connection.execute("ALTER TABLE downloads RENAME TO downloads_old")
+            self.connection.execute(CREATE_DOWNLOADS)
+            self.connection.execute(
+                f"INSERT INTO downloads ({COLUMNS}) SELECT identifier, COALESCE(source, ''), state, reason, "
+                f"attempts, path, sha256, bytes, updated FROM downloads_old")
+            self.connection.execute("DROP TABLE downloads_old")
+        else:
+            self.connection.execute(CREATE_DOWNLOADS)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, identifier):
+        """
+        Return the ledger entry of an article: the entry of the source that
+        downloaded it if any, otherwise the entry of this source.
+
+        Args:
+            identifier (str): The DOI or PMID of the article.
+
+        Returns:
+            dict: The entry, or None if the article is unknown to this source.
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                f"SELECT {COLUMNS} FROM downloads WHERE identifier = ? AND (state = ? OR source = ?) "
+                f"ORDER BY state = ? DESC LIMIT 1", (identifier, DOWNLOADED, self.source, DOWNLOADED))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def should_skip(self, identifier, retry_failed=False):
+        """
+        Tell whether an article must not be fetched again: it is already
+        downloaded by any source (and its file still exists), or it failed
+        too many times with this source.
+
+        Args:
+            identifier (str): The DOI or PMID of the article.
+            retry_failed (bool): Retry failed articles whatever their number of attempts.
+
+        Returns:
+            bool: True if the article must be skipped.
+        """
+        entry = self.get(identifier)
+        if entry is None:
+            return False
+        if entry["state"] == DOWNLOADED:
+            return bool(entry["path"]) and os.path.exists(entry["path"])
+        if entry["state"] == FAILED and not retry_failed:
+            return entry["attempts"] >= self.max_attempts
+        return False
+
+    def start(self, identifier):
+        """
+        Mark an article as pending for this source and count a new attempt.
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO downloads (identifier, source, state, attempts, updated) VALUES (?, ?, ?, 1, ?) "
+                "ON CONFLICT(identifier, source) DO UPDATE SET state = excluded.state, attempts = attempts + 1, "
+                "updated = excluded.updated",
+                (identifier, self.source, PENDING, time.time()))
+
+    def mark_downloaded(self, identifier, path, sha256, size):
+        """
+        Mark an article as downloaded.
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE downloads SET state = ?, reason = NULL, path = ?, sha256 = ?, bytes = ?, updated = ? "
+                "WHERE identifier = ? AND source = ?",
+                (DOWNLOADED, path, sha256, size, time.time(), identifier, self.source))
+
+    def mark_failed(self, identifier, reason):
+        """
+        Mark an article as failed.
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE downloads SET state = ?, reason = ?, updated = ? WHERE identifier = ? AND source = ?",
+                (FAILED, reason, time.time(), identifier, self.source))
+
+    def record(self, identifier, result, path):
+        """
+        Store the result of a download.
+
+        Args:
+            identifier (str): The DOI or PMID of the article.
+            result (DownloadResult): The result returned by the download manager.
+            path (str): The path of the downloaded file.
+        """
+        if result.success:
+            self.mark_downloaded(identifier, path, result.sha256, result.size)
+        else:
+            self.mark_failed(identifier, result.error)
+
+
+def add_ledger_arguments(parser):
+    """
+    Add the download ledger options to an argument parser.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser to extend.
+    """
+    parser.add_argument("--ledger", default=DEFAULT_LEDGER,
+                        help=f"SQLite download ledger (default: {DEFAULT_LEDGER})")
+    parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS,
+                        help="Number of attempts after which a failed article is skipped")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Retry the failed articles whatever their number of attempts")
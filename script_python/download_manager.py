@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Concurrent download manager shared by the PDF fetchers
+(extract_publi_PMC.py, extract_publi_directaccess.py).
+
+Downloads run in a bounded pool of worker threads sharing one pooled
+keep-alive HTTP session. A per-host limit keeps a single server from
+receiving too many simultaneous requests, and responses are streamed
+to a `.part` file that is atomically renamed once complete.
+
+@author: amichaud
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+# Number of downloads running at the same time
+DEFAULT_WORKERS = 16
+# Number of simultaneous requests sent to the same host
+DEFAULT_PER_HOST = 4
+# Size of the blocks written to disk (in bytes)
+CHUNK_SIZE = 64 * 1024
+# Connection and read timeouts (in seconds)
+TIMEOUT = (10, 60)
+# Suffix of the file keeping, next to a .part file, the validator of the response it comes from
+VALIDATOR_SUFFIX = ".validator"
+
+# Result of a download: sha256 and size are set when it succeeded
+DownloadResult = namedtuple("DownloadResult", ["success", "error", "sha256", "size"])
+
+
+def transform_doi(doi):
+    """
+    Transform a DOI into a valid file name.
+
+    Args:
+        doi (str): The DOI.
+
+    Returns:
+        str: The DOI with '<', '>', ':', ';' and '/' URL-encoded.
+    """
+    return re.sub(r'[<>:;/]', lambda x: f"%{ord(x.group(0)):02X}", doi)
+
+
+def resumed_at(response):
+    """
+    Return the offset at which a partial response (206) starts.
+
+    Args:
+        response (requests.Response): The response to a Range request.
+
+    Returns:
+        int: The first byte position, or None if the response is not partial.
+    """
+    if response.status_code != 206:
+        return None
+    match = re.match(r'bytes (\d+)-', response.headers.get("Content-Range", ""))
+    return int(match.group(1)) if match else None
+
+
+def response_validator(response):
+    """
+    Return the validator identifying the version of a resource, to send in
+    If-Range when resuming it.
+
+    Args:
+        response (requests.Response): The response the data comes from.
+
+    Returns:
+        str: The strong ETag, else the Last-Modified date, or None
+        (a weak ETag cannot be used with If-Range).
+    """
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+def remove_part(part_path):
+    """
+    Remove a .part file and its validator.
+    """
+    for path in (part_path, part_path + VALIDATOR_SUFFIX):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def hash_file(path, sha256, chunk_size=CHUNK_SIZE):
+    """
+    Feed the content of a file to a hash object.
+
+    Args:
+        path (str): The file to read.
+        sha256 (hashlib object): The hash to update.
+        chunk_size (int): The size of the blocks read.
+    """
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(chunk_size), b""):
+            sha256.update(block)
+
+
+class DownloadManager:
+    """
+    Bounded pool of download workers with per-host concurrency limits.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST,
+                 timeout=TIMEOUT, chunk_size=CHUNK_SIZE, store=None):
+        self.workers = workers
+        self.store = store
+        self.per_host = per_host
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.host_slots = {}
+        self.host_lock = threading.Lock()
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def host_slot(self, url):
+        """
+        Return the semaphore limiting the requests sent to the host of a URL.
+        """
+        host = urlsplit(url).netloc.lower()
+        with self.host_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_slots[host]
+
+    def fetch_text(self, url):
+        """
+        Download a page and return its text.
+
+        The redirects are followed one at a time, so that the per-host limit
+        applies to every host contacted (e.g. the publisher site a doi.org
+        link redirects to) and not only to the first one.
+
+        Args:
+            url (str): The URL of the page.
+
+        Returns:
+            tuple: (text of the page or None, final URL after redirects or error message)
+        """
+        try:
+            with self._stream(url) as response:
+                response.raise_for_status()
+                return response.text, response.url
+        except requests.RequestException as e:
+            return None, str(e)
+
+    def download(self, url, dest_path):
+        """
+        Stream a URL to a file, computing its sha256 on the fly.
+
+        The data is written to `<dest_path>.part`, which is renamed to
+        `dest_path` only once complete, so an interrupted download never
+        leaves a truncated file behind. A `.part` file left by a previous
+        attempt is resumed with a Range request when the server supports it,
+        conditioned by If-Range on the ETag or Last-Modified date saved with
+        it: if the resource changed since, the server sends it whole. As in
+        fetch_text, the redirects are followed one at a time under the
+        per-host limit of each host.
+        When the manager has a PDF store, the file is validated and stored
+        by content instead of being renamed.
+
+        Args:
+            url (str): The URL to download.
+            dest_path (str): The path of the destination file.
+
+        Returns:
+            DownloadResult: The outcome of the download.
+        """
+        os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+        part_path = dest_path + ".part"
+        validator_path = part_path + VALIDATOR_SUFFIX
+        try:
+            validator = None
+            if os.path.exists(validator_path):
+                with open(validator_path, "r") as validator_file:
+                    validator = validator_file.read().strip() or None
+            # Without validator, the partial file cannot be checked against the resource: it is not resumed
+            offset = os.path.getsize(part_path) if validator and os.path.exists(part_path) else 0
+            fetched = self._fetch(url, part_path, offset, validator)
+            if fetched is None:
+                # The partial file does not match the resource anymore
+                remove_part(part_path)
+                fetched = self._fetch(url, part_path, 0)
+                if fetched is None:
+                    return DownloadResult(False, "Partial response to a request without Range", None, None)
+        except (requests.RequestException, OSError) as e:
+            # The .part file is kept so that the next attempt can resume it
+            return DownloadResult(False, str(e), None, None)
+        sha256, size = fetched
+        if size == 0:
+            remove_part(part_path)
+            return DownloadResult(False, "Empty file", None, None)
+        if self.store is None:
+            os.replace(part_path, dest_path)
+            remove_part(part_path)
+            return DownloadResult(True, None, sha256, size)
+        # Validate the PDF and store it once by content
+        stored, reason = self.store.add(part_path, dest_path, sha256)
+        remove_part(part_path)
+        if not stored:
+            return DownloadResult(False, f"Invalid PDF: {reason}", None, None)
+        return DownloadResult(True, None, sha256, size)
+
+    @contextmanager
+    def _stream(self, url, headers=None):
+        """
+        Send a streamed GET request, following the redirects one at a time,
+        and yield the final response while holding the slot of its host:
+        the per-host limit applies to every host contacted, including the
+        one the content is read from. The headers (e.g. Range and If-Range)
+        are sent at every hop, so the final request carries them.
+        """
+        for _ in range(self.session.max_redirects + 1):
+            with self.host_slot(url):
+                with self.session.get(url, stream=True, timeout=self.timeout, headers=headers,
+                                      allow_redirects=False) as response:
+                    location = self.session.get_redirect_target(response)
+                    if location is None:
+                        yield response
+                        return
+            url = urljoin(response.url, location)
+        raise requests.TooManyRedirects(f"Exceeded {self.session.max_redirects} redirects")
+
+    def _fetch(self, url, part_path, offset, validator=None):
+        """
+        Write a URL to a .part file, resuming after `offset` bytes if the
+        resource still matches `validator`. The validator of a new download
+        is saved next to the .part file.
+
+        Returns:
+            tuple: (sha256, size) of the complete file, or None if the server
+            rejected the requested range (416) or sent another one.
+        """
+        headers = {"Range": f"bytes={offset}-", "If-Range": validator} if offset else {}
+        sha256 = hashlib.sha256()
+        with self._stream(url, headers) as response:
+            if offset and response.status_code == 416:
+                return None
+            response.raise_for_status()
+            if response.status_code == 206 and resumed_at(response) != offset:
+                # Not the part that follows the .part file: it cannot be appended
+                return None
+            if offset and resumed_at(response) == offset:
+                hash_file(part_path, sha256, self.chunk_size)
+                mode = "ab"
+            else:
+                # A 200 reply: the resource is sent whole (e.g. it changed since the .part was written)
+                offset = 0
+                mode = "wb"
+                validator = response_validator(response)
+                validator_path = part_path + VALIDATOR_SUFFIX
+                if validator:
+                    with open(validator_path, "w") as validator_file:
+                        validator_file.write(validator)
+                elif os.path.exists(validator_path):
+                    os.remove(validator_path)
+            size = offset
+            with open(part_path, mode) as dest:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    dest.write(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+        return sha256.hexdigest(), size
+
+    def run(self, function, items):
+        """
+        Apply a function to every item in the worker pool.
+
+        Args:
+            function (callable): The function called with each item.
+            items (iterable): The items to process.
+
+        Returns:
+            generator: (item, result) pairs, in the order of the items.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            items = list(items)
+            for item, result in zip(items, executor.map(function, items)):
+                yield item, result
+
+
+def add_download_arguments(parser):
+    """
+    Add the download manager options to an argument parser.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser to extend.
+    """
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Number of downloads running at the same time")
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST,
+                        help="Number of simultaneous requests sent to the same host")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="Size in bytes of the blocks written to disk")
@@ -6,27 +6,11 @@ Created on Mon Mar 25 11:30:37 2024
 @author: amichaud
 """
 
-import requests
 import json
 import argparse
-import os
-
-
-
-def get_doi_from_pmid(pmid):
-    base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
-    params = {
-        "db": "pubmed",
-        "id": pmid,
-        "retmode": "json"
-    }
-    response = requests.get(base_url, params=params)
-    data = response.json()
-    article_ids = data["result"][pmid]["articleids"]
-    doi = next((article_id["value"] for article_id in article_ids if article_id["idtype"] == "doi"), None)
-    return doi
-
 
+from id_cache import add_cache_arguments, open_cache
+from ncbi_utils import DEFAULT_BATCH_SIZE, add_client_arguments, write_dois
 
 
 if __name__ == "__main__":
@@ -34,6 +18,10 @@ if __name__ == "__main__":
     
     parser.add_argument("Json_input_file", help="Json input file containing PMID list")
     parser.add_argument("DOI_output_file", help="Txt output file containing DOI list")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Number of PMIDs sent per NCBI request")
+    add_client_arguments(parser)
+    add_cache_arguments(parser)
 
     args = parser.parse_args()
     Json_input_file = args.Json_input_file
@@ -47,21 +35,13 @@ if __name__ == "__main__":
         print("The file doesn't exist")
 
     
-    erreurs = []    
     # retrieve DOIs and write them to a text file
     # or in an error file if not found
-    with open(DOI_output_file, "w") as f:
-        for publication in publications:
-            pmid = publication["value"]
-            doi = get_doi_from_pmid(pmid)
-            if doi:
-                f.write(doi + "\n")
-            else:
-                erreurs.append(f"DOI not found for PMID {pmid}")
-    if erreurs:
-       os.makedirs('logs', exist_ok=True)
-       with open("logs/errors_extract_doi_from_pmid.txt", "w") as f_err:
-           for erreur in erreurs:
-               f_err.write(erreur + "\n")     
-
-
+    cache = open_cache(args)
+    pmids = [str(publication["value"]) for publication in publications]
+    try:
+        write_dois(pmids, DOI_output_file, batch_size=args.batch_size,
+                   api_key=args.api_key, concurrency=args.concurrency, cache=cache)
+    finally:
+        if cache:
+            cache.close()
@@ -3,33 +3,62 @@
 """
 Created on Tue Jul  2 15:36:48 2024
 
+Extract the figures of the PDFs (cropped from the coordinates given by
+Grobid, and the images embedded in the PDF) into one HTML page per PDF.
+
+By default the embedded images of each PDF are written to its own
+folder, so a page only depends on its PDF. With `--shared-images`, they
+are stored once for the corpus in `_images` (see image_index.py), and an
+image found in `--boilerplate-papers` papers is left out of the pages
+created after it reaches the threshold. The result then depends on the
+order in which the PDFs are processed: the pages created before an image
+is blocklisted still show it, and the copy of a group of near-duplicates
+that is stored is the first one met. With `--workers` above 1, that
+order depends on the scheduling of the processes, so two runs can give
+different pages.
+
 @author: amichaud
 """
 
+import argparse
 import fitz  # PyMuPDF
+import hashlib
+import html
+import io
 import os
 import re
 import shutil
 from collections import defaultdict
 
-def extract_figures_and_coords(text):
-    pattern = re.compile(
-        r'<figure(?![^>]*\btype="table")[^>]*>\s*'
-        r'<head>[^<]*</head>\s*'
-        r'<label>[^<]*</label>\s*'
-        r'<figDesc>(.*?)</figDesc>\s*'
-        r'(<graphic[^>]*coords="([^"]+)"[^>]*type="bitmap"[^>]*/>)?',
-        re.DOTALL
-    )
-    matches = pattern.findall(text)
-    results = []
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from grobid_parsing import load_figures
+from image_index import BOILERPLATE_PAPERS, SHARED_DIR, ImageIndex
+from process_pool import run_tasks
+from tei_io import find_tei
+
+# Output formats of the figures (extension of the files); WebP needs Pillow
+IMAGE_FORMATS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+IMAGE_QUALITY = 85
 
-    for match in matches:
-        figDesc = match[0].strip()
-        coords = match[2].strip() if match[1] else None
-        results.append((figDesc, coords))
+# Image index of each output directory, opened once per process (see shared_image_index)
+_image_indexes = {}
 
-    return results
+def extract_figures_and_coords(tei_file_path):
+    """
+    Read the figures of a TEI file (tables excluded), from the figure file
+    written by grobid_parsing.py next to it if it is up to date, else from
+    the TEI file (see `grobid_parsing.load_figures`).
+
+    Returns:
+        list: (legend, Grobid coordinates or None) pairs, in document order.
+    """
+    return [(figure.get("legend", ""), figure.get("coords"))
+            for figure in load_figures(tei_file_path)
+            if figure["type"] != "table" and (figure.get("legend") or figure.get("coords"))]
 
 def extract_figure_number(figDesc):
     pattern = re.compile(
@@ -43,86 +72,184 @@ def extract_figure_number(figDesc):
     else:
         raise ValueError(f"No figure number found in description: {figDesc}")
 
-def extract_images_from_coords(pdf_path, coords_list, output_dir, zoom=2.0):
-    doc = fitz.open(pdf_path)
+def parse_coords(coords):
+    """
+    Read the Grobid coordinates of a figure: `page,x,y,w,h`, or several
+    boxes separated by `;` when the figure is made of several regions.
+
+    Returns:
+        tuple: (page number, fitz.Rect of the figure). The boxes of a
+            figure are merged into their union, on the page of the first box.
+    """
+    page_num = rect = None
+    for box in coords.split(';'):
+        if not box.strip():
+            continue
+        box_page, x, y, w, h = map(float, box.split(','))
+        if page_num is None:
+            page_num, rect = int(box_page), fitz.Rect(x, y, x + w, y + h)
+        elif int(box_page) == page_num:
+            rect |= fitz.Rect(x, y, x + w, y + h)
+    if page_num is None:
+        raise ValueError(f"No box in the coordinates: {coords}")
+    return page_num, rect
+
+def save_pixmap(pix, path, image_format="png", quality=IMAGE_QUALITY):
+    """
+    Save a pixmap as PNG, JPEG or WebP (with Pillow).
+    """
+    if image_format == "webp":
+        if Image is None:
+            raise ImportError("The Pillow package is needed for WebP images: pip install Pillow")
+        Image.frombytes("RGB", (pix.width, pix.height), pix.samples).save(path, "WEBP", quality=quality)
+    elif image_format == "jpeg":
+        pix.save(path, jpg_quality=quality)
+    else:
+        pix.save(path)
+
+def extract_images_from_coords(pdf_path, coords_list, output_dir, zoom=2.0, image_format="png", quality=IMAGE_QUALITY):
+    """
+    Render the regions of the figures given by their Grobid coordinates.
+
+    The figures are grouped by page: each page is loaded and interpreted
+    once, and all its figures are rendered from it.
 
+    Args:
+        coords_list (list): The coordinates of the figures (see `parse_coords`).
+        image_format (str): "png", "jpeg" or "webp".
+        quality (int): Quality of the JPEG and WebP images (0-100).
+
+    Returns:
+        list: The paths of the images, in the order of `coords_list`.
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format: {image_format}")
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    figures_per_page = {}
+    # The figures are numbered on each page in the order of coords_list
+    figures_per_page = defaultdict(list)
     image_paths = []
-
     for coords in coords_list:
         if coords:
-            page_num, x, y, w, h = map(float, coords.split(','))
-            page_num = int(page_num)
-            page = doc[page_num - 1]
+            page_num, rect = parse_coords(coords)
+            figure_num = len(figures_per_page[page_num]) + 1
+            output_image_path = f"{output_dir}/coord_page_{page_num}_figure_{figure_num}.{IMAGE_FORMATS[image_format]}"
+            figures_per_page[page_num].append((rect, output_image_path))
+            image_paths.append(output_image_path)
 
-            rect = fitz.Rect(x, y, x + w, y + h)
-            mat = fitz.Matrix(zoom, zoom)
-            pix = page.get_pixmap(matrix=mat, clip=rect)
+    mat = fitz.Matrix(zoom, zoom)
+    with fitz.open(pdf_path) as doc:
+        for page_num, figures in sorted(figures_per_page.items()):
+            display_list = doc.load_page(page_num - 1).get_displaylist()
+            for rect, output_image_path in figures:
+                pix = display_list.get_pixmap(matrix=mat, clip=rect)
+                save_pixmap(pix, output_image_path, image_format, quality)
+                print(f"Image extracted and saved to: {output_image_path}")
 
-            if page_num not in figures_per_page:
-                figures_per_page[page_num] = 0
-            figures_per_page[page_num] += 1
-            figure_num = figures_per_page[page_num]
+    return image_paths
 
-            output_image_path = f"{output_dir}/coord_page_{page_num}_figure_{figure_num}.png"
-            pix.save(output_image_path)
-            image_paths.append(output_image_path)
-            print(f"Image extracted and saved to: {output_image_path}")
+def extract_images_from_pdf(pdf_path, output_folder, error_log, image_index=None):
+    """
+    Extract the images embedded in a PDF, in a single pass over the pages.
 
-    return image_paths
+    An image object used on several pages (same xref) is decoded once, and
+    an image whose content is the same as a previous one (same SHA-256) is
+    not written again: each distinct image is written once, under the name
+    of its first occurrence. The skipped duplicates are logged in error_log.
+
+    With an image index (see image_index.py), the images are stored in the
+    folder shared by the corpus instead, once per group of near-duplicates,
+    and the blocklisted images (logos, badges...) are left out. Each shared
+    image is returned once, even if near-duplicates of it appear several
+    times in the PDF.
 
-def extract_images_from_pdf(pdf_path, output_folder, error_log):
+    Returns:
+        list: The paths of the written images.
+    """
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    pdf_document = fitz.open(pdf_path)
+    pdf_filename = os.path.basename(pdf_path)
     image_paths = []
-    size_count = defaultdict(int)
-
-    # First pass to count the image sizes
-    for page_num in range(len(pdf_document)):
-        page = pdf_document.load_page(page_num)
-        image_list = page.get_images(full=True)
-
-        for img_info in image_list:
-            xref = img_info[0]
-            base_image = pdf_document.extract_image(xref)
-            image_bytes = base_image["image"]
-            image_size = len(image_bytes)
-
-            size_count[image_size] += 1
-
-    # Second pass to extract unique images by size
-    for page_num in range(len(pdf_document)):
-        page = pdf_document.load_page(page_num)
-        image_list = page.get_images(full=True)
-
-        for img_index, img_info in enumerate(image_list):
-            xref = img_info[0]
-            base_image = pdf_document.extract_image(xref)
-            image_bytes = base_image["image"]
-            image_size = len(image_bytes)
-
-            if size_count[image_size] > 1:
-                # Log the error in the TSV file
-                error_log.write(f"{os.path.basename(pdf_path)}\t\tDuplicate image size detected (Size: {image_size} bytes)\tThe image is ignored because it has the same size as other images\n")
-                continue  # Ignore this image as it has duplicates
-
-            img_filename = f"extract_page_{page_num + 1}_image_{img_index + 1}.png"
-            img_path = os.path.join(output_folder, img_filename)
-            with open(img_path, "wb") as img_file:
-                img_file.write(image_bytes)
-            image_paths.append(img_path)
-
-    pdf_document.close()
+    # Path of the image written (or blocklisted) for each xref and for each content hash
+    xref_paths = {}
+    hash_paths = {}
+    # Near-duplicates get the path of the shared image already returned or blocklisted
+    returned_paths = set()
+    blocked_paths = set()
+
+    def log_ignored(img_path, reason):
+        if img_path in blocked_paths:
+            error_log.write(f"{pdf_filename}\t{img_path}\t\tBoilerplate image\tThe image is ignored because it is found in too many papers\n")
+        else:
+            error_log.write(f"{pdf_filename}\t{img_path}\t\tDuplicate image\tThe image is ignored because {reason}\n")
+
+    with fitz.open(pdf_path) as pdf_document:
+        for page_num in range(len(pdf_document)):
+            page = pdf_document.load_page(page_num)
+
+            for img_index, img_info in enumerate(page.get_images(full=True)):
+                xref = img_info[0]
+                if xref in xref_paths:
+                    if xref_paths[xref]:
+                        log_ignored(xref_paths[xref], "the same image object was already extracted")
+                    continue
+
+                base_image = pdf_document.extract_image(xref)
+                if not base_image:
+                    # Not an extractable image (e.g. a stencil mask)
+                    xref_paths[xref] = None
+                    continue
+                image_bytes = base_image["image"]
+                digest = hashlib.sha256(image_bytes).hexdigest()
+                if digest in hash_paths:
+                    xref_paths[xref] = hash_paths[digest]
+                    log_ignored(hash_paths[digest], "an image with the same content was already extracted")
+                    continue
+
+                if image_index is not None:
+                    img_path, blocked = image_index.add(image_bytes, base_image["ext"], pdf_filename, digest)
+                    if img_path in returned_paths or img_path in blocked_paths:
+                        xref_paths[xref] = hash_paths[digest] = img_path
+                        log_ignored(img_path, "a near-duplicate image was already extracted")
+                        continue
+                    if blocked:
+                        xref_paths[xref] = hash_paths[digest] = img_path
+                        blocked_paths.add(img_path)
+                        log_ignored(img_path, None)
+                        continue
+                else:
+                    img_filename = f"extract_page_{page_num + 1}_image_{img_index + 1}.{base_image['ext']}"
+                    img_path = os.path.join(output_folder, img_filename)
+                    with open(img_path, "wb") as img_file:
+                        img_file.write(image_bytes)
+                xref_paths[xref] = hash_paths[digest] = img_path
+                returned_paths.add(img_path)
+                image_paths.append(img_path)
+
     return image_paths
 
+def shared_image_index(output_root_dir, boilerplate_papers=BOILERPLATE_PAPERS):
+    """
+    Return the image index of an output directory, kept open for the next
+    PDFs processed by this process.
+    """
+    key = (output_root_dir, boilerplate_papers)
+    if key not in _image_indexes:
+        _image_indexes[key] = ImageIndex(os.path.join(output_root_dir, SHARED_DIR), boilerplate_papers)
+    return _image_indexes[key]
+
+def html_path(output_root_dir, pdf_filename_without_ext):
+    """
+    Return the path of the HTML page of a PDF.
+    """
+    return os.path.join(output_root_dir, pdf_filename_without_ext, f"{pdf_filename_without_ext}.html")
+
 def html_creation(pdf_filename_without_ext, results, image_paths_coords, image_paths_pdf, output_dir, error_log):
     html_filename = f"{output_dir}/{pdf_filename_without_ext}.html"
-    with open(html_filename, 'w', encoding='utf-8') as html_file:
+    # Written to a temporary file first: the page only exists once complete (see --incremental)
+    with open(html_filename + ".part", 'w', encoding='utf-8') as html_file:
         html_file.write(f"<html><head><title>{pdf_filename_without_ext}</title></head><body>\n")
         html_file.write(f"<h1>{pdf_filename_without_ext}</h1>\n")
         html_file.write("<table border='1'>\n")
@@ -157,7 +284,7 @@ def html_creation(pdf_filename_without_ext, results, image_paths_coords, image_p
             else:
                 html_file.write("<td></td>\n")
 
-            html_file.write(f"<td>{figDesc}</td>\n")
+            html_file.write(f"<td>{html.escape(figDesc, quote=False)}</td>\n")
             html_file.write("</tr>\n")
 
         html_file.write("</table>\n")
@@ -175,45 +302,124 @@ def html_creation(pdf_filename_without_ext, results, image_paths_coords, image_p
         html_file.write("</table>\n")
 
         html_file.write("</body></html>\n")
+    os.replace(html_filename + ".part", html_filename)
     print(f"HTML file created: {html_filename}")
 
-def main():
-    output_root_dir = 'data_figure_html'
-
-    if os.path.exists(output_root_dir):
-        shutil.rmtree(output_root_dir)
-
-    os.makedirs(output_root_dir)
-
-    pdf_folder = './data_pdf'
-    tei_folder = './data_tei_xml'
-    error_log_path = os.path.join(output_root_dir, 'error_log.tsv')
+def process_pdf(pdf_file, pdf_folder, tei_folder, output_root_dir, image_format="png", quality=IMAGE_QUALITY,
+                shared_images=False, boilerplate_papers=BOILERPLATE_PAPERS):
+    """
+    Extract the figures of one PDF and create its HTML page. The errors are
+    written to a buffer rather than to the error log, so that a single
+    process writes the log when several PDFs are processed at the same time.
+
+    With `shared_images`, the images embedded in the PDF go to the image
+    index of the output directory (see image_index.py).
+
+    Returns:
+        tuple: (pdf_file, lines of the error log)
+    """
+    error_log = io.StringIO()
+    pdf_filename_without_ext = os.path.splitext(pdf_file)[0]
+    tei_file_path = find_tei(tei_folder, pdf_filename_without_ext)
+
+    if tei_file_path:
+        print(f"Extracting legends for {pdf_file} \n")
+        try:
+            results = extract_figures_and_coords(tei_file_path)
+
+            output_dir = os.path.join(output_root_dir, pdf_filename_without_ext)
+            coords_list = [coords for _, coords in results if coords]
+            image_paths_coords = extract_images_from_coords(os.path.join(pdf_folder, pdf_file), coords_list, output_dir, zoom=1.0,
+                                                            image_format=image_format, quality=quality)
+            image_index = shared_image_index(output_root_dir, boilerplate_papers) if shared_images else None
+            image_paths_pdf = extract_images_from_pdf(os.path.join(pdf_folder, pdf_file), output_dir, error_log, image_index)
+
+            html_creation(pdf_filename_without_ext, results, image_paths_coords, image_paths_pdf, output_dir, error_log)
+        except Exception as e:
+            # A damaged PDF or TEI file does not stop the other files
+            error = " ".join(f"{type(e).__name__}: {e}".split())
+            error_log.write(f"{pdf_filename_without_ext}\t\t\t{error}\tThe figures could not be extracted\n")
+            print(f"Error: The figures of {pdf_file} could not be extracted: {error}")
+    else:
+        error_log.write(f"{pdf_filename_without_ext}\t\t\tNo corresponding TEI file found\tNo corresponding TEI file found\n")
+        print(f"Error: No corresponding TEI file found for {pdf_file}")
 
-    pdf_files = [f for f in os.listdir(pdf_folder) if f.endswith('.pdf')]
+    return pdf_file, error_log.getvalue()
 
-    with open(error_log_path, 'w', encoding='utf-8') as error_log:
-        error_log.write("PDF Filename\tImage Path\tFigure Description\tError\tExplanation\n")
+def _process_crashed(pdf_file, *args):
+    pdf_filename_without_ext = os.path.splitext(pdf_file)[0]
+    return pdf_file, f"{pdf_filename_without_ext}\t\t\tWorker process crashed\tThe figures could not be extracted\n"
 
-        for pdf_file in pdf_files:
-            pdf_filename_without_ext = os.path.splitext(pdf_file)[0]
-            tei_file_path = os.path.join(tei_folder, f"{pdf_filename_without_ext}.tei.xml")
+def process_pdfs(pdf_files, pdf_folder, tei_folder, output_root_dir, workers=1, image_format="png", quality=IMAGE_QUALITY,
+                 shared_images=False, boilerplate_papers=BOILERPLATE_PAPERS):
+    """
+    Process PDFs, in a pool of `workers` processes if more than one.
 
-            if os.path.exists(tei_file_path):
-                print(f"Extracting legends for {pdf_file} \n")
-                with open(tei_file_path, 'r', encoding='utf-8') as tei_file:
-                    tei_content = tei_file.read()
+    Returns:
+        generator: (pdf_file, lines of the error log), in the order of `pdf_files`.
+    """
+    # One PDF at a time per worker: their processing times vary a lot. A crash of a worker
+    # process (e.g. in MuPDF) only affects the PDF it was processing.
+    tasks = ((pdf_file, pdf_folder, tei_folder, output_root_dir, image_format, quality, shared_images, boilerplate_papers)
+             for pdf_file in pdf_files)
+    return run_tasks(process_pdf, tasks, workers, _process_crashed)
 
-                results = extract_figures_and_coords(tei_content)
+def main():
+    parser = argparse.ArgumentParser(description="Extract the figures of the PDFs, with their legends from the Grobid TEI files, into HTML pages.")
+    parser.add_argument("--pdf-dir", default="./data_pdf", help="Directory of the PDF files (default: ./data_pdf)")
+    parser.add_argument("--tei-dir", default="./data_tei_xml", help="Directory of the TEI files (default: ./data_tei_xml)")
+    parser.add_argument("--output-dir", default="data_figure_html", help="Output directory (default: data_figure_html)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes extracting figures at the same time (default: 1)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Keep the existing outputs and only process the PDFs without an HTML page, "
+                             "instead of deleting the output directory")
+    parser.add_argument("--image-format", choices=list(IMAGE_FORMATS), default="png",
+                        help="Format of the figures cropped from the PDF (default: png, webp needs the Pillow package)")
+    parser.add_argument("--quality", type=int, default=IMAGE_QUALITY,
+                        help=f"Quality of the JPEG and WebP figures, 0-100 (default: {IMAGE_QUALITY})")
+    parser.add_argument("--shared-images", action="store_true",
+                        help=f"Store the near-duplicate images embedded in the PDFs once for the corpus, in "
+                             f"{SHARED_DIR}, instead of writing the images of each PDF to its own folder")
+    parser.add_argument("--boilerplate-papers", type=int, default=BOILERPLATE_PAPERS,
+                        help=f"With --shared-images, leave out the embedded images found in this number of papers "
+                             f"or more (logos, badges...), 0 to keep them all (default: {BOILERPLATE_PAPERS})")
+    args = parser.parse_args()
+    if args.image_format == "webp" and Image is None:
+        parser.error("The Pillow package is needed for WebP images: pip install Pillow")
+
+    output_root_dir = args.output_dir
+    pdf_folder = args.pdf_dir
+    tei_folder = args.tei_dir
+    error_log_path = os.path.join(output_root_dir, 'error_log.tsv')
 
-                output_dir = os.path.join(output_root_dir, pdf_filename_without_ext)
-                coords_list = [coords for _, coords in results if coords]
-                image_paths_coords = extract_images_from_coords(os.path.join(pdf_folder, pdf_file), coords_list, output_dir, zoom=1.0)
-                image_paths_pdf = extract_images_from_pdf(os.path.join(pdf_folder, pdf_file), output_dir, error_log)
+    if os.path.exists(output_root_dir) and not args.incremental:
+        shutil.rmtree(output_root_dir)
 
-                html_creation(pdf_filename_without_ext, results, image_paths_coords, image_paths_pdf, output_dir, error_log)
-            else:
-                error_log.write(f"{pdf_filename_without_ext}\t\t\tNo corresponding TEI file found\tNo corresponding TEI file found\n")
-                print(f"Error: No corresponding TEI file found for {pdf_file}")
+    os.makedirs(output_root_dir, exist_ok=True)
+
+    pdf_files = sorted(f for f in os.listdir(pdf_folder) if f.endswith('.pdf'))
+    if args.incremental:
+        # The HTML page is written last: a PDF with a page was fully processed
+        done = {f for f in pdf_files if os.path.exists(html_path(output_root_dir, os.path.splitext(f)[0]))}
+        pdf_files = [f for f in pdf_files if f not in done]
+        print(f"{len(done)} PDFs already processed, {len(pdf_files)} to process")
+
+    # In incremental mode, the errors of this run are added to those of the previous runs
+    new_log = not (args.incremental and os.path.exists(error_log_path))
+    with open(error_log_path, 'w' if new_log else 'a', encoding='utf-8') as error_log:
+        if new_log:
+            error_log.write("PDF Filename\tImage Path\tFigure Description\tError\tExplanation\n")
+
+        for pdf_file, errors in process_pdfs(pdf_files, pdf_folder, tei_folder, output_root_dir, args.workers,
+                                             args.image_format, args.quality, args.shared_images,
+                                             args.boilerplate_papers):
+            error_log.write(errors)
+            error_log.flush()
+
+    if args.shared_images:
+        images, blocked, occurrences = shared_image_index(output_root_dir, args.boilerplate_papers).stats()
+        print(f"Shared images: {images} stored for {occurrences} occurrences, {blocked} blocklisted")
 
 if __name__ == "__main__":
     main()
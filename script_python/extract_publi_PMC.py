@@ -1,10 +1,16 @@
 import os
+import argparse
+import asyncio
 import requests
-import xml.etree.ElementTree as ET
 import re
-import subprocess
 import sys
 
+from download_ledger import DOWNLOADED, DownloadLedger, add_ledger_arguments
+from pdf_store import PdfStore
+from download_manager import DownloadManager, add_download_arguments, transform_doi
+from id_cache import add_cache_arguments, open_cache
+from ncbi_utils import NcbiClient, add_client_arguments, identifier_type, resolve_dois, resolve_pmcids
+
 # Répertoire de sortie pour les PDFs
 output_dir = "data_pdf"
 os.makedirs(output_dir, exist_ok=True)
@@ -12,65 +18,71 @@ os.makedirs(output_dir, exist_ok=True)
 # Fichier de log
 log_file = "log_PMC.txt"
 
-# Fonction pour convertir le PMID en PMCID
-def pmid_to_pmcid(pmid):
-    url = f"https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/?ids={pmid}&format=xml"
-    response = requests.get(url)
-    if response.status_code == 200:
-        root = ET.fromstring(response.content)
-        record = root.find(".//record")
-        if 'pmcid' in record.attrib:
-            return record.attrib['pmcid']
-    return None
-
 # Fonction pour trouver l'URL du PDF à partir de la page PMCID
-def find_pdf_url(pmcid):
+async def find_pdf_url(client, pmcid):
     url = f"https://www.ncbi.nlm.nih.gov/pmc/?term={pmcid}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        # Utilisation des expressions régulières pour trouver le lien du PDF
-        pdf_url_pattern = rf'/pmc/articles/{pmcid}/pdf/[^"]+\.pdf'
-        pdf_url_match = re.search(pdf_url_pattern, response.text)
-        if pdf_url_match:
-            return f"https://www.ncbi.nlm.nih.gov{pdf_url_match.group(0)}"
+    try:
+        response = await client.get(url)
+    except requests.RequestException:
+        return None
+    # Utilisation des expressions régulières pour trouver le lien du PDF
+    pdf_url_pattern = rf'/pmc/articles/{pmcid}/pdf/[^"]+\.pdf'
+    pdf_url_match = re.search(pdf_url_pattern, response.text)
+    if pdf_url_match:
+        return f"https://www.ncbi.nlm.nih.gov{pdf_url_match.group(0)}"
     return None
 
-# Fonction pour télécharger le PDF en utilisant wget
-def download_pdf_with_wget(pdf_url, file_name):
+# Fonction pour trouver les URL des PDF de tous les articles présents sur PMC
+async def find_pdf_urls(client, pmcids):
+    pmcids = list(dict.fromkeys(pmcid for pmcid in pmcids if pmcid))
+    pdf_urls = await asyncio.gather(*(find_pdf_url(client, pmcid) for pmcid in pmcids))
+    return dict(zip(pmcids, pdf_urls))
+
+# Fonction pour télécharger le PDF d'un article et enregistrer le résultat dans le registre
+# pour chacun de ses identifiants (ex. un PMID et son DOI)
+def download_pdf(manager, ledger, identifiers, pdf_url, file_name):
     pdf_path = os.path.join(output_dir, f"{file_name}.pdf")
-    command = f"wget --user-agent=\"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36\" -O {pdf_path} {pdf_url}"
-    try:
-        result = subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return result.returncode == 0
-    except subprocess.CalledProcessError as e:
-        print(f"Erreur lors du téléchargement du PDF avec wget: {e.stderr.decode().strip()}")
-        return False
-
-# Fonction pour transformer le DOI en un format de fichier valide
-def transform_doi(doi):
-    return re.sub(r'[<>:;/]', lambda x: f"%{ord(x.group(0)):02X}", doi)
-
-# Fonction pour obtenir le DOI à partir du PMID
-def get_doi_from_pmid(pmid):
-    base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
-    params = {
-        "db": "pubmed",
-        "id": pmid,
-        "retmode": "json"
-    }
-    response = requests.get(base_url, params=params)
-    data = response.json()
-    article_ids = data["result"][pmid]["articleids"]
-    doi = next((article_id["value"] for article_id in article_ids if article_id["idtype"] == "doi"), None)
-    return doi
+    for identifier in identifiers:
+        ledger.start(identifier)
+    result = manager.download(pdf_url, pdf_path)
+    for identifier in identifiers:
+        ledger.record(identifier, result, pdf_path)
+    if not result.success:
+        print(f"Erreur lors du téléchargement du PDF: {result.error}")
+    return result.success
+
+async def resolve_identifiers(client, identifiers, cache=None, failed=None):
+    """
+    Résout les DOI des PMID et les PMCID de tous les identifiants
+    (requêtes idconv groupées), puis cherche l'URL du PDF des seuls
+    articles disposant d'un PMCID.
+
+    Args:
+        client (NcbiClient): Client NCBI utilisé pour les requêtes.
+        identifiers (list): Liste des DOI, PMID et PMCID.
+        cache (IdCache): Cache des identifiants, ou None.
+        failed (dict): Reçoit identifiant -> erreur pour les identifiants
+            dont la requête NCBI a échoué, ou None.
+
+    Returns:
+        tuple: (PMID -> DOI, identifiant -> PMCID, PMCID -> URL du PDF)
+    """
+    pmids = [identifier for identifier in identifiers if identifier and identifier_type(identifier) == "pmid"]
+    dois, pmcids = await asyncio.gather(resolve_dois(client, pmids, cache=cache, failed=failed),
+                                        resolve_pmcids(client, identifiers, cache=cache, failed=failed))
+    pdf_urls = await find_pdf_urls(client, pmcids.values())
+    return dois, pmcids, pdf_urls
 
 def main():
-    if len(sys.argv) != 2:
-        print("Erreur: Veuillez fournir un fichier d'entrée contenant des DOI ou des PMID.")
-        print("Usage: python script.py <fichier_d_entree>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Télécharge les PDF disponibles sur PMC à partir d'une liste de DOI, de PMID ou de PMCID.")
+    parser.add_argument("input_file", help="Fichier d'entrée contenant des DOI, des PMID ou des PMCID")
+    add_client_arguments(parser)
+    add_cache_arguments(parser)
+    add_download_arguments(parser)
+    add_ledger_arguments(parser)
+    args = parser.parse_args()
 
-    input_file = sys.argv[1]
+    input_file = args.input_file
 
     if not os.path.isfile(input_file):
         print(f"Erreur: Le fichier {input_file} n'existe pas.")
@@ -78,42 +90,94 @@ def main():
 
     # Lire la liste des DOI et PMID à partir du fichier
     with open(input_file, 'r') as f:
-        identifiers = [line.strip() for line in f.readlines()]
+        identifiers = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+
+    # Ignorer les articles déjà traités lors d'une exécution précédente
+    ledger = DownloadLedger(args.ledger, args.max_attempts, source="pmc")
+    skipped = [identifier for identifier in identifiers if ledger.should_skip(identifier, args.retry_failed)]
+    skipped_set = set(skipped)
+    identifiers = [identifier for identifier in identifiers if identifier not in skipped_set]
+
+    # Résoudre les DOI, PMCID et URL des PDF de tous les identifiants en parallèle
+    cache = open_cache(args)
+    failed = {}
+    try:
+        with NcbiClient(api_key=args.api_key, concurrency=args.concurrency) as client:
+            dois, pmcids, pdf_urls = asyncio.run(resolve_identifiers(client, identifiers, cache, failed))
+    finally:
+        if cache:
+            cache.close()
     
+    # Déterminer le nom de fichier et l'URL du PDF de chaque identifiant
+    articles = []
+    for identifier in identifiers:
+        if identifier_type(identifier) == "doi":
+            # C'est un DOI
+            doi = identifier
+            file_name = transform_doi(doi)
+            pmcid = pmcids.get(doi)
+        elif identifier_type(identifier) == "pmcid":
+            # C'est un PMCID, utilisé directement
+            pmcid = pmcids.get(identifier)
+            file_name = pmcid
+        else:
+            # C'est un PMID
+            pmid = identifier
+            doi = dois.get(pmid)
+            if doi:
+                file_name = transform_doi(doi)
+            else:
+                file_name = pmid
+            pmcid = pmcids.get(pmid)
+        articles.append((identifier, file_name, pmcid, pdf_urls.get(pmcid)))
+
+    # Télécharger les PDF en parallèle, une seule fois par fichier : les identifiants
+    # d'un même article (ex. un PMID et son DOI) ont le même nom de fichier
+    groups = {}
+    for identifier, file_name, _, pdf_url in articles:
+        if pdf_url:
+            groups.setdefault(file_name, (pdf_url, []))[1].append(identifier)
+    to_download = [(group, pdf_url, file_name) for file_name, (pdf_url, group) in groups.items()]
+    downloaded = {}
+    with DownloadManager(workers=args.workers, per_host=args.per_host, chunk_size=args.chunk_size,
+                         store=PdfStore(output_dir)) as manager:
+        for task, success in manager.run(lambda task: download_pdf(manager, ledger, *task), to_download):
+            downloaded.update(dict.fromkeys(task[0], success))
+
     # Traiter chaque identifiant
     with open(log_file, 'w') as log:
-        for identifier in identifiers:
-            if identifier.lower().startswith('10.'):
-                # C'est un DOI
-                doi = identifier
-                file_name = transform_doi(doi)
-                pmcid = pmid_to_pmcid(doi)
+        for identifier in skipped:
+            entry = ledger.get(identifier)
+            if entry["state"] == DOWNLOADED:
+                print(f"Article {identifier} déjà téléchargé en tant que {entry['path']}")
             else:
-                # C'est un PMID
-                pmid = identifier
-                doi = get_doi_from_pmid(pmid)
-                if doi:
-                    file_name = transform_doi(doi)
-                else:
-                    file_name = pmid
-                pmcid = pmid_to_pmcid(pmid)
-    
+                message = f"Article {identifier} ignoré après {entry['attempts']} tentatives: {entry['reason']}"
+                print(message)
+                log.write(message + "\n")
+
+        for identifier, file_name, pmcid, pdf_url in articles:
             if pmcid:
-                pdf_url = find_pdf_url(pmcid)
                 if pdf_url:
-                    success = download_pdf_with_wget(pdf_url, file_name)
+                    success = downloaded[identifier]
                     if success:
                         print(f"Article {identifier} téléchargé avec succès en tant que {file_name}.pdf")
-                    else:
-                        print(f"Échec du téléchargement de l'article {identifier} (PMCID: {pmcid})")
-                        log.write(f"Échec du téléchargement de l'article {identifier} (PMCID: {pmcid})\n")
+                        continue
+                    message = f"Échec du téléchargement de l'article {identifier} (PMCID: {pmcid})"
                 else:
-                    print(f"URL PDF non trouvée pour l'article {identifier} (PMCID: {pmcid})")
-                    log.write(f"URL PDF non trouvée pour l'article {identifier} (PMCID: {pmcid})\n")
+                    message = f"URL PDF non trouvée pour l'article {identifier} (PMCID: {pmcid})"
+                    ledger.start(identifier)
+                    ledger.mark_failed(identifier, message)
+            elif identifier in failed:
+                # Erreur de la requête NCBI : l'article sera réessayé sans compter de tentative
+                message = f"Échec de la requête NCBI pour l'article {identifier}: {failed[identifier]}"
             else:
-                print(f"PMCID non trouvé pour l'article {identifier}")
-                log.write(f"PMCID non trouvé pour l'article {identifier}\n")
+                message = f"PMCID non trouvé pour l'article {identifier}"
+                ledger.start(identifier)
+                ledger.mark_failed(identifier, message)
+            print(message)
+            log.write(message + "\n")
+
+    ledger.close()
 
 if __name__ == "__main__":
     main()
-
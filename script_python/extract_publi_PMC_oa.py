@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Extract PDFs (and JATS XML) from local copies of the PMC Open Access
+packages, without any network access.
+
+The archives can be per-article packages (`PMC1234567.tar.gz`), the large
+oa_bulk tarballs, or directories containing them. Each archive is read
+once, as a stream, and only the requested articles are written: PDFs to
+data_pdf/<DOI>.pdf (validated and stored once by content) and JATS XML to
+data_jats_xml/<DOI>.nxml.
+
+Requested articles may be given as PMCIDs, PMIDs or DOIs. PMIDs and DOIs
+are converted with the identifier cache when possible, otherwise they are
+matched against the article ids found in the JATS XML of each article.
+After a complete pass over an archive, an index of its articles
+(`<archive>.index.tsv`) is written next to it. Later runs use it to skip
+the archives that do not contain any requested article and to stop
+reading as soon as every requested article has been extracted.
+
+@author: amichaud
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import shutil
+import sys
+import tarfile
+import tempfile
+
+from download_ledger import DOWNLOADED, DownloadLedger, add_ledger_arguments
+from download_manager import DownloadResult, transform_doi
+from id_cache import add_cache_arguments, normalize, open_cache
+from ncbi_utils import identifier_type
+from pdf_store import PdfStore
+
+# Default output directories
+PDF_DIR = "data_pdf"
+XML_DIR = "data_jats_xml"
+# Requested articles not found in the archives
+ERROR_FILE = "logs/errors_pmc_oa.txt"
+
+ARCHIVE_SUFFIXES = (".tar.gz", ".tgz", ".tar")
+INDEX_SUFFIX = ".index.tsv"
+# PDFs of an article are kept in memory up to this size, then on disk
+SPOOL_SIZE = 16 * 1024 * 1024
+COPY_BUFFER = 1024 * 1024
+
+PMCID_PATTERN = re.compile(r'^(PMC\d+)(?:\.[^/]*)?$')
+ARTICLE_ID_PATTERN = re.compile(rb'<article-id[^>]*pub-id-type="(pmid|pmc|pmcid|doi)"[^>]*>\s*([^<\s]+)\s*</article-id>')
+
+
+def member_pmcid(name):
+    """
+    Find the PMCID of an archive member from its path
+    (`PMC1234567/article.pdf`, `PMC000xxxxxx/PMC1234567.xml`, `PMC1234567.tar.gz`).
+
+    Args:
+        name (str): The path of the member in the archive.
+
+    Returns:
+        str: The PMCID, or None if the path does not contain one.
+    """
+    for part in reversed(name.split("/")):
+        match = PMCID_PATTERN.match(part)
+        if match:
+            return match.group(1)
+    return None
+
+
+def read_article_ids(xml_data):
+    """
+    Read the PMCID, PMID and DOI of an article from its JATS XML.
+
+    Args:
+        xml_data (bytes): The JATS XML of the article.
+
+    Returns:
+        dict: 'pmcid', 'pmid' and 'doi' (None when absent).
+    """
+    ids = {"pmcid": None, "pmid": None, "doi": None}
+    for kind, value in ARTICLE_ID_PATTERN.findall(xml_data):
+        kind = kind.decode()
+        value = value.decode("utf-8", "replace")
+        if kind in ("pmc", "pmcid"):
+            ids["pmcid"] = value if value.upper().startswith("PMC") else f"PMC{value}"
+        elif ids[kind] is None:
+            ids[kind] = value
+    return ids
+
+
+def find_archives(paths):
+    """
+    List the archives given directly or contained in directories.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for filename in sorted(files):
+                    if filename.endswith(ARCHIVE_SUFFIXES):
+                        yield os.path.join(root, filename)
+        else:
+            yield path
+
+
+def read_index(archive_path):
+    """
+    Read the article index written after a previous pass over an archive.
+
+    Returns:
+        list: (pmcid, pmid, doi) rows, or None if the archive has no index.
+    """
+    index_path = archive_path + INDEX_SUFFIX
+    if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(archive_path):
+        return None
+    rows = []
+    with open(index_path, "r", encoding="utf-8") as index_file:
+        for line in index_file:
+            pmcid, pmid, doi = (line.rstrip("\n").split("\t") + ["", ""])[:3]
+            rows.append((pmcid, pmid or None, doi or None))
+    return rows
+
+
+def write_index(archive_path, rows):
+    """
+    Write the article index of an archive.
+    """
+    index_path = archive_path + INDEX_SUFFIX
+    with open(index_path + ".part", "w", encoding="utf-8") as index_file:
+        for pmcid, pmid, doi in rows:
+            index_file.write(f"{pmcid}\t{pmid or ''}\t{doi or ''}\n")
+    os.replace(index_path + ".part", index_path)
+
+
+class Request:
+    """
+    The requested articles, looked up by PMCID, PMID or DOI.
+    """
+
+    def __init__(self, identifiers, cache=None):
+        self.identifiers = list(dict.fromkeys(identifier for identifier in identifiers if identifier))
+        self.by_pmcid = {}
+        self.by_pmid = {}
+        self.by_doi = {}
+        for identifier in self.identifiers:
+            kind = identifier_type(identifier)
+            if kind == "pmcid":
+                self.by_pmcid[identifier.upper()] = identifier
+            elif kind == "pmid":
+                self.by_pmid[identifier] = identifier
+            else:
+                self.by_doi[normalize("doi", identifier)] = identifier
+        if cache:
+            for kind, requested in (("pmid", self.by_pmid), ("doi", self.by_doi)):
+                for value, pmcid in cache.get_many(kind, "pmcid", list(requested)).items():
+                    if pmcid:
+                        self.by_pmcid.setdefault(pmcid.upper(), requested[value])
+        self.found = set()
+        # Requested PMIDs / DOIs without known PMCID
+        self.pending = set(self.by_pmid.values()) | set(self.by_doi.values())
+        self.pending -= set(self.by_pmcid.values())
+
+    def resolve(self, rows):
+        """
+        Convert the requested PMIDs / DOIs present in an archive index to PMCIDs.
+        """
+        for pmcid, pmid, doi in rows:
+            identifier = self.by_pmid.get(pmid) or self.by_doi.get(normalize("doi", doi or ""))
+            if identifier:
+                self.by_pmcid.setdefault(pmcid.upper(), identifier)
+                self.pending.discard(identifier)
+
+    def unresolved(self):
+        """
+        Tell whether some requested PMIDs / DOIs have no known PMCID and
+        must be matched against the XML of the articles.
+        """
+        return bool(self.pending)
+
+    def mark_found(self, identifier):
+        self.found.add(identifier)
+        self.pending.discard(identifier)
+
+    def may_want(self, pmcid):
+        """
+        Tell whether an article may be requested, before reading its XML.
+        """
+        if pmcid and pmcid.upper() in self.by_pmcid:
+            return self.by_pmcid[pmcid.upper()] not in self.found
+        return self.unresolved()
+
+    def match(self, ids):
+        """
+        Return the requested identifier matching an article, or None.
+        """
+        for identifier in (self.by_pmcid.get((ids["pmcid"] or "").upper()),
+                           self.by_pmid.get(ids["pmid"]),
+                           self.by_doi.get(normalize("doi", ids["doi"] or ""))):
+            if identifier and identifier not in self.found:
+                return identifier
+        return None
+
+    def complete(self):
+        return len(self.found) == len(self.identifiers)
+
+
+class OaIngester:
+    """
+    Streams PMC OA archives and writes the requested articles.
+    """
+
+    def __init__(self, request, pdf_dir=PDF_DIR, xml_dir=XML_DIR, ledger=None, cache=None):
+        self.request = request
+        self.pdf_dir = pdf_dir
+        self.xml_dir = xml_dir
+        self.store = PdfStore(pdf_dir)
+        self.ledger = ledger
+        self.cache = cache
+        self.rows = []
+        self.index_complete = True
+
+    def ingest(self, archive_path):
+        """
+        Read one archive and extract the requested articles it contains.
+        """
+        rows = read_index(archive_path)
+        targets = None
+        if rows is not None:
+            self.request.resolve(rows)
+            pmcids = {pmcid.upper() for pmcid, _, _ in rows} & set(self.request.by_pmcid)
+            targets = {self.request.by_pmcid[pmcid] for pmcid in pmcids} - self.request.found
+            if not targets:
+                print(f"{archive_path}: no requested article (index)")
+                return
+
+        self.rows = []
+        self.index_complete = True
+        with tarfile.open(archive_path, mode="r|*") as tar:
+            completed = self.process_stream(tar, targets)
+        # An index is only useful for archives holding several articles
+        if rows is None and completed and self.index_complete and len(self.rows) > 1:
+            write_index(archive_path, self.rows)
+
+    def process_stream(self, tar, targets=None):
+        """
+        Read the members of an archive stream, grouping them by article.
+
+        Args:
+            tar (tarfile.TarFile): The archive opened as a stream.
+            targets (set): Stop reading once these identifiers are found.
+
+        Returns:
+            bool: True if the whole stream was read.
+        """
+        group = ArticleGroup(None)
+        for member in tar:
+            if not member.isfile():
+                continue
+            pmcid = member_pmcid(member.name)
+
+            if member.name.endswith(ARCHIVE_SUFFIXES):
+                # Per-article package inside a larger archive
+                self.flush(group)
+                group = ArticleGroup(None)
+                if pmcid and not self.request.may_want(pmcid):
+                    # Skipped without decompressing it: its ids stay unknown
+                    self.index_complete = False
+                    continue
+                with tar.extractfile(member) as nested_file:
+                    with tarfile.open(fileobj=nested_file, mode="r|*") as nested:
+                        self.process_stream(nested)
+            else:
+                if pmcid != group.pmcid:
+                    self.flush(group)
+                    group = ArticleGroup(pmcid)
+                name = member.name.lower()
+                if name.endswith((".nxml", ".xml")):
+                    group.add_xml(member.name, tar.extractfile(member).read())
+                elif name.endswith(".pdf") and self.request.may_want(pmcid):
+                    group.add_pdf(member.name, tar.extractfile(member))
+
+            if targets is not None and targets <= self.request.found:
+                group.close()
+                return False
+        self.flush(group)
+        return True
+
+    def flush(self, group):
+        """
+        Write the article of a finished group if it is requested.
+        """
+        try:
+            if group.pmcid is None and group.xml is None:
+                return
+            ids = read_article_ids(group.xml) if group.xml is not None else {"pmcid": None, "pmid": None, "doi": None}
+            ids["pmcid"] = ids["pmcid"] or group.pmcid
+            if not ids["pmcid"]:
+                return
+            self.rows.append((ids["pmcid"], ids["pmid"], ids["doi"]))
+            if self.cache:
+                for source in ("pmid", "doi"):
+                    if ids[source]:
+                        self.cache.put_many(source, "pmcid", {ids[source]: ids["pmcid"]})
+
+            identifier = self.request.match(ids)
+            if identifier:
+                self.write_article(identifier, ids, group)
+        finally:
+            group.close()
+
+    def write_article(self, identifier, ids, group):
+        """
+        Write the PDF and the JATS XML of a requested article.
+        """
+        self.request.mark_found(identifier)
+        file_name = transform_doi(ids["doi"]) if ids["doi"] else ids["pmcid"]
+
+        if group.xml is not None:
+            os.makedirs(self.xml_dir, exist_ok=True)
+            with open(os.path.join(self.xml_dir, f"{file_name}.nxml"), "wb") as xml_file:
+                xml_file.write(group.xml)
+
+        pdf = group.main_pdf()
+        if pdf is None:
+            print(f"{identifier} ({ids['pmcid']}): JATS XML extracted, no PDF in the package")
+            return
+
+        os.makedirs(self.pdf_dir, exist_ok=True)
+        pdf_path = os.path.join(self.pdf_dir, f"{file_name}.pdf")
+        part_path = pdf_path + ".part"
+        if self.ledger:
+            self.ledger.start(identifier)
+        sha256 = hashlib.sha256()
+        size = 0
+        pdf.seek(0)
+        with open(part_path, "wb") as part_file:
+            for block in iter(lambda: pdf.read(COPY_BUFFER), b""):
+                part_file.write(block)
+                sha256.update(block)
+                size += len(block)
+        stored, reason = self.store.add(part_path, pdf_path, sha256.hexdigest())
+        if stored:
+            result = DownloadResult(True, None, sha256.hexdigest(), size)
+            print(f"{identifier} ({ids['pmcid']}) extracted as {pdf_path}")
+        else:
+            os.remove(part_path)
+            result = DownloadResult(False, f"Invalid PDF: {reason}", None, None)
+            print(f"{identifier} ({ids['pmcid']}): invalid PDF ({reason})")
+        if self.ledger:
+            self.ledger.record(identifier, result, pdf_path)
+
+
+class ArticleGroup:
+    """
+    Consecutive members of an archive belonging to the same article.
+    """
+
+    def __init__(self, pmcid):
+        self.pmcid = pmcid
+        self.xml = None
+        self.xml_name = None
+        self.pdfs = []
+
+    def add_xml(self, name, data):
+        # The .nxml file is the article, other XML files may be supplements
+        if self.xml is None or name.lower().endswith(".nxml"):
+            self.xml = data
+            self.xml_name = name
+
+    def add_pdf(self, name, file):
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        shutil.copyfileobj(file, spool, COPY_BUFFER)
+        self.pdfs.append((name, spool))
+
+    def main_pdf(self):
+        """
+        Return the PDF of the article itself: the one named like the XML,
+        otherwise the first one of the package.
+        """
+        if not self.pdfs:
+            return None
+        if self.xml_name:
+            stem = os.path.splitext(os.path.basename(self.xml_name))[0]
+            for name, spool in self.pdfs:
+                if os.path.splitext(os.path.basename(name))[0] == stem:
+                    return spool
+        return self.pdfs[0][1]
+
+    def close(self):
+        for _, spool in self.pdfs:
+            spool.close()
+        self.pdfs = []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract requested articles from local PMC Open Access archives.")
+    parser.add_argument("input_file", help="Txt input file containing PMCIDs, PMIDs or DOIs")
+    parser.add_argument("archives", nargs="+", help="PMC OA archives (.tar.gz) or directories containing them")
+    parser.add_argument("--pdf-dir", default=PDF_DIR, help=f"Output directory of the PDFs (default: {PDF_DIR})")
+    parser.add_argument("--xml-dir", default=XML_DIR, help=f"Output directory of the JATS XML (default: {XML_DIR})")
+    add_cache_arguments(parser)
+    add_ledger_arguments(parser)
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.input_file):
+        print(f"Error: The file {args.input_file} does not exist.")
+        sys.exit(1)
+    with open(args.input_file, "r") as f:
+        identifiers = [line.strip() for line in f if line.strip()]
+
+    cache = open_cache(args)
+    try:
+        request = Request(identifiers, cache)
+        with DownloadLedger(args.ledger, args.max_attempts, source="pmc_oa") as ledger:
+            # Articles whose PDF was already obtained, here or by another fetcher
+            done = [identifier for identifier in request.identifiers
+                    if (ledger.get(identifier) or {}).get("state") == DOWNLOADED and ledger.should_skip(identifier)]
+            for identifier in done:
+                request.mark_found(identifier)
+            print(f"{len(done)} articles already downloaded by a previous run are skipped")
+            ingester = OaIngester(request, args.pdf_dir, args.xml_dir, ledger, cache)
+            for archive_path in find_archives(args.archives):
+                if request.complete():
+                    break
+                name = os.path.basename(archive_path)
+                pmcid = member_pmcid(name)
+                # Per-article packages are skipped from their name, without decompressing them
+                if pmcid and not request.may_want(pmcid):
+                    continue
+                ingester.ingest(archive_path)
+    finally:
+        if cache:
+            cache.close()
+
+    missing = [identifier for identifier in request.identifiers if identifier not in request.found]
+    os.makedirs(os.path.dirname(ERROR_FILE), exist_ok=True)
+    with open(ERROR_FILE, "w") as err_file:
+        for identifier in missing:
+            err_file.write(f"Article {identifier} not found in the PMC OA archives\n")
+    print(f"{len(request.found)} articles extracted, {len(missing)} not found (see {ERROR_FILE})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Download the PDFs freely available from the page linked to each DOI.
+
+The DOI landing page is fetched, the first PDF link found on it is
+downloaded to data_pdf/<DOI>.pdf, and the DOIs for which no PDF could be
+retrieved are written to the error file. The download ledger is used to
+skip the DOIs completed by previous runs.
+
+@author: amichaud
+"""
+
+import argparse
+import os
+import re
+
+from download_ledger import FAILED, DownloadLedger, add_ledger_arguments
+from pdf_store import PdfStore
+from download_manager import DownloadManager, DownloadResult, add_download_arguments, transform_doi
+
+# Directory where the PDFs are saved
+download_dir = "data_pdf"
+# File listing the DOIs that could not be downloaded
+error_file = "erreur_extraction_doi.txt"
+
+PDF_LINK_PATTERN = re.compile(r'https://.*?\.pdf')
+
+
+def download_direct_access(manager, ledger, doi):
+    """
+    Find the PDF link on the landing page of a DOI, download it and
+    record the outcome in the ledger.
+
+    Args:
+        manager (DownloadManager): The download manager.
+        ledger (DownloadLedger): The download ledger.
+        doi (str): The DOI of the publication.
+
+    Returns:
+        DownloadResult: The outcome of the download.
+    """
+    ledger.start(doi)
+    pdf_path = os.path.join(download_dir, f"{transform_doi(doi)}.pdf")
+
+    html_content, info = manager.fetch_text(f"https://doi.org/{doi}")
+    if html_content is None:
+        result = DownloadResult(False, info, None, None)
+    else:
+        pdf_link = PDF_LINK_PATTERN.search(html_content)
+        if pdf_link:
+            result = manager.download(pdf_link.group(0), pdf_path)
+        else:
+            result = DownloadResult(False, "No PDF link found", None, None)
+
+    ledger.record(doi, result, pdf_path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download the PDFs available on the page linked to each DOI.")
+    parser.add_argument("doi_file", help="Txt input file containing DOI list")
+    add_download_arguments(parser)
+    add_ledger_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.doi_file, "r") as f:
+        dois = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+
+    os.makedirs(download_dir, exist_ok=True)
+
+    with DownloadLedger(args.ledger, args.max_attempts, source="direct") as ledger, \
+            DownloadManager(workers=args.workers, per_host=args.per_host, chunk_size=args.chunk_size,
+                            store=PdfStore(download_dir)) as manager:
+        to_fetch = [doi for doi in dois if not ledger.should_skip(doi, args.retry_failed)]
+        print(f"{len(dois) - len(to_fetch)} DOIs already processed by a previous run are skipped")
+
+        for doi, result in manager.run(lambda doi: download_direct_access(manager, ledger, doi), to_fetch):
+            if result.success:
+                print(f"{doi} file successfully downloaded")
+            else:
+                print(f"{doi} file download failed ({result.error})")
+
+        # The error file lists the DOIs of this input that are still failed, once each
+        failed = [doi for doi in dois if (ledger.get(doi) or {}).get("state") == FAILED]
+
+    with open(error_file, "w") as err_file:
+        for doi in failed:
+            err_file.write(f"{doi}\n")
+
+    print(f"Téléchargement terminé. Vérifiez '{download_dir}' pour les articles téléchargés.")
+
+
+if __name__ == "__main__":
+    main()
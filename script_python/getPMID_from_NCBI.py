@@ -8,42 +8,137 @@ Created on Thu Apr 11 11:33:27 2024
 
 from Bio import Entrez
 import argparse
+import os
+from collections import deque
+
+# Number of PMIDs retrieved per request
+PAGE_SIZE = 10000
 
 def search_pubmed(query):
-    Entrez.email = "votre@email.com"  # Remplacez par votre email
-    handle = Entrez.esearch(db="pubmed", term=query, retmax=100000)
+    """
+    Run the search on the NCBI history server.
+
+    Args:
+        query (str): The PubMed search query.
+
+    Returns:
+        tuple: (number of results, WebEnv, query_key)
+    """
+    handle = Entrez.esearch(db="pubmed", term=query, usehistory="y", retmax=0)
     results = Entrez.read(handle)
     handle.close()
-    return results["IdList"]
+    return int(results["Count"]), results["WebEnv"], results["QueryKey"]
+
+def iter_pmid_pages(count, webenv, query_key, start=0, page_size=PAGE_SIZE):
+    """
+    Page through the results stored on the history server.
+
+    Args:
+        count (int): The number of results.
+        webenv (str): The WebEnv of the search.
+        query_key (str): The query_key of the search.
+        start (int): The index of the first result to retrieve.
+        page_size (int): The number of PMIDs per page.
+
+    Returns:
+        generator: Lists of PMIDs, one per page.
+    """
+    for retstart in range(start, count, page_size):
+        handle = Entrez.efetch(db="pubmed", rettype="uilist", retmode="text",
+                               retstart=retstart, retmax=page_size,
+                               webenv=webenv, query_key=query_key)
+        page = [line.strip() for line in handle.read().splitlines() if line.strip()]
+        handle.close()
+        if not page:
+            break
+        yield page
+
+def read_saved_pmids(filename, tail=PAGE_SIZE):
+    """
+    Count the PMIDs already saved by a previous run, dropping a last line
+    left incomplete by an interruption. The file is read line by line:
+    only its last PMIDs are kept in memory.
 
-def save_pmid_to_file(pmid_list, filename):
-    with open(filename, "w") as file:
-        for pmid in pmid_list:
-            file.write(pmid + "\n")
+    Args:
+        filename (str): The output file.
+        tail (int): The number of PMIDs returned from the end of the file.
+
+    Returns:
+        tuple: (number of PMIDs in the file, set of its last `tail` PMIDs)
+    """
+    if not os.path.exists(filename):
+        return 0, set()
+    count = 0
+    last_pmids = deque(maxlen=tail)
+    complete = 0
+    with open(filename, "rb+") as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            complete += len(line)
+            if line.strip():
+                count += 1
+                last_pmids.append(line.strip().decode())
+        if file.seek(0, os.SEEK_END) != complete:
+            file.truncate(complete)
+    return count, set(last_pmids)
+
+def save_pmid_to_file(query, filename, page_size=PAGE_SIZE, resume=False):
+    """
+    Search PubMed and stream the PMIDs to a file page by page.
+
+    Args:
+        query (str): The PubMed search query.
+        filename (str): The name of the output file.
+        page_size (int): The number of PMIDs per page.
+        resume (bool): Continue after the PMIDs already in the file.
+
+    Returns:
+        tuple: (number of results, number of PMIDs in the file)
+    """
+    count, webenv, query_key = search_pubmed(query)
+    # The search is resumed at the position of the last saved PMID. The papers
+    # added to PubMed since the interrupted run come first in the results and
+    # shift the others: the first PMIDs of the resumed search may already be
+    # in the file, so they are compared with the last saved PMIDs until a page
+    # has none of them.
+    saved, last_pmids = read_saved_pmids(filename, page_size) if resume else (0, set())
+    with open(filename, "a" if resume else "w") as file:
+        for page in iter_pmid_pages(count, webenv, query_key, saved, page_size):
+            if last_pmids:
+                new_pmids = [pmid for pmid in page if pmid not in last_pmids]
+                if len(new_pmids) == len(page):
+                    last_pmids = set()
+                page = new_pmids
+            if not page:
+                continue
+            file.write("\n".join(page) + "\n")
+            file.flush()
+            saved += len(page)
+            print(f"{saved}/{count} PMIDs saved")
+    return count, saved
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Searches PubMed for articles and saves PMIDs to file.")
     parser.add_argument("search_query", help="The PubMed search query (enclose phrases in quotation marks).")
     parser.add_argument("filename", help="The name of the file in which to save PMIDs.")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE, help="Number of PMIDs retrieved per request.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted search after the PMIDs already saved in the file.")
+    parser.add_argument("--email", default="votre@email.com", help="Email address sent to NCBI.")
+    parser.add_argument("--api-key", default=os.environ.get("NCBI_API_KEY"),
+                        help="NCBI API key (default: $NCBI_API_KEY).")
 
     args = parser.parse_args()
 
     search_query = args.search_query
     filename = args.filename
 
-    pmid_list = search_pubmed(search_query)
-    save_pmid_to_file(pmid_list, filename)
-
-    print(f"{len(pmid_list)} articles found for the query '{search_query}'. The PMIDs were registered in {filename}.")
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
\ No newline at end of file
+    Entrez.email = args.email
+    if args.api_key:
+        Entrez.api_key = args.api_key
+
+    count, saved = save_pmid_to_file(search_query, filename, args.page_size, args.resume)
+
+    print(f"{count} articles found for the query '{search_query}'. {saved} PMIDs were registered in {filename}.")
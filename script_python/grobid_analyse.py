@@ -3,33 +3,449 @@
 """
 Script to extract text from PDF files and save it as TEI XML format.
 
+The PDFs are sent to Grobid by a pool of worker threads sharing one
+keep-alive HTTP session, so that several documents are processed at the
+same time. The number of requests in flight should match the size of the
+Grobid processing pool (`concurrency` in grobid.yaml, 10 by default).
+When all its workers are busy, Grobid answers 503: the document is then
+sent again after an exponential backoff instead of being reported as an
+error.
+
+Runs are incremental: a manifest records, for each TEI file, the sha256
+of its PDF and the Grobid version and parameters that produced it. Only
+the PDFs that are new, have changed, or were processed with another
+Grobid version or other parameters are sent again. The TEI files can be
+stored compressed (gzip or zstd, see tei_io.py).
+
 Created on Thu Feb 29 14:34:28 2024
 
 @author: amichaud
 """
 
+import argparse
+import hashlib
+import json
+import logging
 import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from progress import ProgressMeter, add_logging_arguments, setup_logging
+from tei_io import COMPRESSIONS, find_tei, read_tei, tei_filename, write_tei
+
+logger = logging.getLogger("grobid_analyse")
+
+GROBID_URL = "http://localhost:8070"
+FULLTEXT_PATH = "/api/processFulltextDocument"
+VERSION_PATH = "/api/version"
+ISALIVE_PATH = "/api/isalive"
+# Default location of the manifest of the produced TEI files
+DEFAULT_MANIFEST = "cache/grobid_manifest.sqlite"
+# Summary of the last run
+SUMMARY_FILE = "./logs/grobid_analyse_summary.json"
+# Number of PDFs sent at the same time to each Grobid server
+DEFAULT_CONCURRENCY = 10
+# Attempts after a 503 (Grobid busy) or an unreachable server before giving up on a PDF
+MAX_RETRIES = 8
+# Base delay of the exponential backoff (in seconds), and its maximum
+BACKOFF = 0.5
+MAX_BACKOFF = 30
+# Connection and read timeouts (in seconds): large PDFs can take minutes
+TIMEOUT = (10, 300)
+# Interval between two health checks of the Grobid servers (in seconds)
+HEALTH_INTERVAL = 10
+HEALTH_TIMEOUT = 5
+# Time a PDF waits for a healthy server before failing (in seconds)
+NODE_WAIT = 300
+
+
+class GrobidNode:
+    """
+    A Grobid server, with its state and throughput statistics.
+    """
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.healthy = False
+        self.checked = False
+        self.version = None
+        self.outstanding = 0
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0
+        self.ejections = 0
+        self.seconds = 0.0
+
+    def stats(self, elapsed):
+        """
+        Return the statistics of the server over a run of `elapsed` seconds.
+        """
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "version": self.version,
+            "processed": self.processed,
+            "failed": self.failed,
+            "busy_replies": self.busy,
+            "ejections": self.ejections,
+            "pdf_per_second": round(self.processed / elapsed, 2) if elapsed else None,
+            "mean_seconds": round(self.seconds / self.processed, 3) if self.processed else None,
+        }
+
+
+class GrobidClient:
+    """
+    Grobid client sharing a pooled HTTP session between worker threads.
+
+    Several Grobid servers can be used: each PDF is sent to the healthy
+    server with the fewest requests in flight. Servers are checked with
+    /api/isalive; a server that does not answer is ejected, and admitted
+    again once its health check succeeds.
+    """
+
+    def __init__(self, urls=GROBID_URL, concurrency=DEFAULT_CONCURRENCY,
+                 max_retries=MAX_RETRIES, timeout=TIMEOUT, params=None,
+                 health_interval=HEALTH_INTERVAL):
+        if isinstance(urls, str):
+            urls = [urls]
+        self.nodes = [GrobidNode(url) for url in dict.fromkeys(urls)]
+        self.params = params or {}
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.session = requests.Session()
+        # One extra connection per server for the health checks
+        adapter = HTTPAdapter(pool_connections=len(self.nodes), pool_maxsize=concurrency + 1)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.condition = threading.Condition()
+        # Time since which no server is healthy
+        self.unavailable_since = None
+        self.started = time.monotonic()
+
+        self.check_nodes()
+        self.stopped = threading.Event()
+        self.health_thread = threading.Thread(target=self._health_loop, daemon=True)
+        self.health_thread.start()
+
+    def close(self):
+        self.stopped.set()
+        self.health_thread.join()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def is_alive(self, node):
+        try:
+            response = self.session.get(node.url + ISALIVE_PATH, timeout=HEALTH_TIMEOUT)
+        except requests.RequestException:
+            return False
+        return response.ok and response.text.strip().lower() == "true"
+
+    def check_nodes(self):
+        """
+        Run the health check of every server, ejecting or admitting them.
+        """
+        for node in self.nodes:
+            alive = self.is_alive(node)
+            if alive and not node.healthy:
+                node.version = self._read_version(node)
+                logger.info(f"Grobid server available: {node.url} (version {node.version or 'unknown'})")
+                with self.condition:
+                    node.healthy = True
+                    self.unavailable_since = None
+                    self.condition.notify_all()
+            elif not alive and node.healthy:
+                self.eject(node, "health check failed")
+            elif not alive and not node.checked:
+                logger.warning(f"Grobid server unavailable: {node.url}")
+            node.checked = True
+
+    def _health_loop(self):
+        while not self.stopped.wait(self.health_interval):
+            self.check_nodes()
+
+    def _read_version(self, node):
+        try:
+            response = self.session.get(node.url + VERSION_PATH, timeout=HEALTH_TIMEOUT)
+            response.raise_for_status()
+        except requests.RequestException:
+            return None
+        return response.text.strip() or None
+
+    def eject(self, node, reason):
+        """
+        Stop sending PDFs to a server until its health check succeeds.
+        """
+        with self.condition:
+            if not node.healthy:
+                return
+            node.healthy = False
+            node.ejections += 1
+        logger.warning(f"Grobid server ejected: {node.url} ({reason})")
+
+    def version(self):
+        """
+        Return the version of the Grobid servers, or None if it cannot be read.
+        """
+        versions = [node.version for node in self.nodes if node.healthy and node.version]
+        if len(set(versions)) > 1:
+            logger.warning(f"The Grobid servers run different versions: {', '.join(sorted(set(versions)))}")
+        return versions[0] if versions else None
+
+    def acquire(self):
+        """
+        Reserve the healthy server with the fewest requests in flight,
+        waiting for one to be available.
+
+        Returns:
+            GrobidNode: The server, or None if no server has been healthy
+            for NODE_WAIT seconds.
+        """
+        with self.condition:
+            while True:
+                nodes = [node for node in self.nodes if node.healthy and node.outstanding < self.concurrency]
+                if nodes:
+                    node = min(nodes, key=lambda node: node.outstanding)
+                    node.outstanding += 1
+                    return node
+                if not any(node.healthy for node in self.nodes):
+                    now = time.monotonic()
+                    self.unavailable_since = self.unavailable_since or now
+                    if now - self.unavailable_since >= NODE_WAIT:
+                        return None
+                    self.condition.wait(NODE_WAIT - (now - self.unavailable_since))
+                else:
+                    self.condition.wait()
+
+    def release(self, node, outcome, seconds=0.0):
+        """
+        Release a server reserved by `acquire` and count the outcome of
+        the request: "processed", "busy" or "failed" (None when the
+        request did not reach the server).
+        """
+        with self.condition:
+            node.outstanding -= 1
+            if outcome == "processed":
+                node.processed += 1
+                node.seconds += seconds
+            elif outcome == "busy":
+                node.busy += 1
+            elif outcome == "failed":
+                node.failed += 1
+            self.condition.notify()
+
+    def process_fulltext(self, pdf_path):
+        """
+        Send a PDF to Grobid, retrying while Grobid is busy or when a
+        server does not answer.
+
+        Args:
+            pdf_path (str): The path to the PDF file.
+
+        Returns:
+            tuple: (TEI XML or None, error message or None)
+        """
+        attempt = 0
+        while True:
+            node = self.acquire()
+            if node is None:
+                return None, "No Grobid server available"
+            start = time.monotonic()
+            try:
+                with open(pdf_path, "rb") as pdf_file:
+                    response = self.session.post(node.url + FULLTEXT_PATH, files={"input": pdf_file},
+                                                 data=self.params, timeout=self.timeout)
+            except requests.ConnectionError as e:
+                # The server is unreachable: the PDF is sent to another one
+                self.release(node, None)
+                self.eject(node, str(e))
+                error = str(e)
+            except requests.RequestException as e:
+                self.release(node, "failed")
+                return None, str(e)
+            else:
+                if response.status_code == 200:
+                    self.release(node, "processed", time.monotonic() - start)
+                    return response.text, None
+                if response.status_code != 503:
+                    self.release(node, "failed")
+                    return None, f"HTTP {response.status_code}"
+                self.release(node, "busy")
+                error = "HTTP 503"
+
+            if attempt >= self.max_retries:
+                return None, error
+            # Grobid busy or unreachable: wait before sending the document again
+            delay = min(MAX_BACKOFF, BACKOFF * 2 ** attempt) + random.uniform(0, BACKOFF)
+            attempt += 1
+            time.sleep(delay)
+
+    def run(self, pdf_paths):
+        """
+        Process PDFs with `concurrency` requests in flight on each server.
+
+        Args:
+            pdf_paths (list): The PDFs to process.
+
+        Returns:
+            generator: (pdf_path, TEI XML or None, error or None), in completion order.
+        """
+        self.started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency * len(self.nodes)) as executor:
+            futures = {executor.submit(self.process_fulltext, pdf_path): pdf_path for pdf_path in pdf_paths}
+            for future in as_completed(futures):
+                text, error = future.result()
+                yield futures[future], text, error
+
+    def stats(self):
+        """
+        Return the statistics of each server since the start of the last run.
+        """
+        elapsed = time.monotonic() - self.started
+        return [node.stats(elapsed) for node in self.nodes]
+
 
-def extract_text_from_pdf(pdf_path):
+class TeiManifest:
+    """
+    Record of the TEI files produced, stored in a SQLite database: the
+    PDF they come from (sha256, size, modification time) and the Grobid
+    version and parameters used.
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS tei (
+                   tei_path TEXT PRIMARY KEY,
+                   pdf_path TEXT NOT NULL,
+                   pdf_size INTEGER NOT NULL,
+                   pdf_mtime INTEGER NOT NULL,
+                   pdf_sha256 TEXT NOT NULL,
+                   grobid_version TEXT,
+                   params TEXT NOT NULL,
+                   updated REAL NOT NULL
+               )"""
+        )
+        self.connection.commit()
+        self.entries = {row[0]: row[1:] for row in self.connection.execute(
+            "SELECT tei_path, pdf_size, pdf_mtime, pdf_sha256, grobid_version, params FROM tei")}
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def pdf_sha256(self, tei_path, pdf_path):
+        """
+        Return the sha256 of a PDF. The file is only read when its size or
+        modification time differs from the manifest.
+        """
+        stat = os.stat(pdf_path)
+        entry = self.entries.get(tei_path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        sha256 = hashlib.sha256()
+        with open(pdf_path, "rb") as pdf_file:
+            for block in iter(lambda: pdf_file.read(1024 * 1024), b""):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def is_current(self, tei_path, pdf_sha256, version, params):
+        """
+        Tell whether a TEI file exists and was produced from this PDF
+        content with this Grobid version and these parameters.
+        """
+        entry = self.entries.get(tei_path)
+        return (entry is not None and existing_tei(tei_path) is not None
+                and entry[2:] == (pdf_sha256, version, params_key(params)))
+
+    def record(self, tei_path, pdf_path, pdf_sha256, version, params):
+        """
+        Record a TEI file produced by Grobid.
+        """
+        stat = os.stat(pdf_path)
+        row = (stat.st_size, stat.st_mtime_ns, pdf_sha256, version, params_key(params))
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO tei (tei_path, pdf_path, pdf_size, pdf_mtime, pdf_sha256, "
+                "grobid_version, params, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (tei_path, pdf_path) + row + (time.time(),))
+        self.entries[tei_path] = row
+
+
+def params_key(params):
+    """
+    Serialize Grobid parameters in a canonical form.
+    """
+    return json.dumps(params or {}, sort_keys=True)
+
+
+def tei_path_for(output_dir, pdf_filename, compression="none"):
+    """
+    Return the path of the TEI file produced from a PDF. The manifest
+    uses the path without compression.
+    """
+    return os.path.join(output_dir, tei_filename(os.path.splitext(pdf_filename)[0], compression))
+
+
+def existing_tei(tei_path):
+    """
+    Return the path of the TEI file whatever its compression, or None.
+    """
+    directory, filename = os.path.split(tei_path)
+    return find_tei(directory, filename[:-len(".tei.xml")])
+
+
+def parse_params(values):
+    """
+    Parse NAME=VALUE Grobid parameters given on the command line.
+    """
+    params = {}
+    for value in values or []:
+        name, sep, param = value.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"Invalid Grobid parameter (expected NAME=VALUE): {value}")
+        params[name] = param
+    return params
+
+
+def extract_text_from_pdf(pdf_path, client=None):
     """
     Extract text from a PDF file using an API.
 
     Args:
         pdf_path (str): The path to the PDF file.
+        client (GrobidClient): The Grobid client, a local one is used if None.
 
     Returns:
         str: The extracted text if successful, None otherwise.
     """
-    url = "http://localhost:8070/api/processFulltextDocument"
-    files = {'input': open(pdf_path, 'rb')}
-    response = requests.post(url, files=files)
-    if response.status_code == 200:
-        return response.text
-    else:
-        return None
+    if client is None:
+        with GrobidClient(concurrency=1) as client:
+            return client.process_fulltext(pdf_path)[0]
+    return client.process_fulltext(pdf_path)[0]
+
 
-def save_text_to_file(text, output_dir, pdf_filename):
+def save_text_to_file(text, output_dir, pdf_filename, compression="none"):
     """
     Save the extracted text to a file in TEI XML format.
 
@@ -37,46 +453,114 @@ def save_text_to_file(text, output_dir, pdf_filename):
         text (str): The extracted text.
         output_dir (str): The directory to save the output file.
         pdf_filename (str): The filename of the original PDF file.
+        compression (str): "none", "gzip" or "zstd".
 
     Returns:
         None
     """
     if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    output_filename = os.path.splitext(pdf_filename)[0] + ".tei.xml"
-    output_path = os.path.join(output_dir, output_filename)
-    with open(output_path, "w", encoding="utf-8") as output_file:
-        output_file.write(text)
-    print(f"Text saved to: {output_path}")
-
-
-
+        os.makedirs(output_dir, exist_ok=True)
+    output_path = tei_path_for(output_dir, pdf_filename, compression)
+    write_tei(output_path, text)
+    logger.debug(f"Text saved to: {output_path}")
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Extract the text of PDF files with Grobid, as TEI XML.")
     # Directory containing PDF files to analyze
-    pdf_directory = "./data_pdf"
+    parser.add_argument("--pdf-dir", default="./data_pdf", help="Directory of the PDFs (default: ./data_pdf)")
     # Directory where you want to save the output files
-    output_dir = "./data_tei_xml"
+    parser.add_argument("--output-dir", default="./data_tei_xml",
+                        help="Directory of the TEI XML files (default: ./data_tei_xml)")
     # File to save extraction errors
-    error_file = "./logs/grobid_errors.txt"
-
-    print(f"Starting the Grobid analysis of PDFs from : {pdf_directory}")
-
-    # Open the error file in append mode
-    with open(error_file, "a") as err_file:
-        # Iterate through all files in the directory
-        for filename in os.listdir(pdf_directory):
-            if filename.endswith(".pdf"):
-                pdf_path = os.path.join(pdf_directory, filename)
-                extracted_text = extract_text_from_pdf(pdf_path)
-                if extracted_text:
-                    save_text_to_file(extracted_text, output_dir, filename)
-                else:
-                    print(f"Failed to extract text from PDF: {pdf_path}")
-                    err_file.write(f"{filename}\n")
+    parser.add_argument("--error-file", default="./logs/grobid_errors.txt",
+                        help="File listing the PDFs that could not be processed")
+    parser.add_argument("--grobid-url", nargs="+", default=[GROBID_URL],
+                        help=f"URLs of the Grobid servers, separated by spaces or commas (default: {GROBID_URL})")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Number of PDFs sent at the same time to each Grobid server, "
+                             "ideally the size of its processing pool")
+    parser.add_argument("--param", action="append", metavar="NAME=VALUE",
+                        help="Parameter sent to processFulltextDocument (e.g. teiCoordinates=figure), can be repeated")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST,
+                        help=f"SQLite manifest of the produced TEI files (default: {DEFAULT_MANIFEST})")
+    parser.add_argument("--compress", choices=list(COMPRESSIONS), default="none",
+                        help="Compression of the TEI XML files (default: none, zstd needs the zstandard package)")
+    parser.add_argument("--force", action="store_true",
+                        help="Send every PDF to Grobid, even if its TEI file is up to date")
+    add_logging_arguments(parser, SUMMARY_FILE)
+    args = parser.parse_args()
+    setup_logging(args)
+    try:
+        params = parse_params(args.param)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    pdf_directory = args.pdf_dir
+    output_dir = args.output_dir
+    logger.info(f"Starting the Grobid analysis of PDFs from : {pdf_directory}")
+
+    pdf_files = sorted(filename for filename in os.listdir(pdf_directory) if filename.endswith(".pdf"))
+    failed = []
+
+    grobid_urls = [url for value in args.grobid_url for url in value.split(",") if url]
+
+    with TeiManifest(args.manifest) as manifest, \
+            GrobidClient(grobid_urls, concurrency=args.concurrency, params=params) as client:
+        if not any(node.healthy for node in client.nodes):
+            logger.error(f"No Grobid server is available ({', '.join(grobid_urls)})")
+            sys.exit(1)
+        version = client.version()
+        logger.info(f"Grobid version: {version or 'unknown'}")
+
+        # Only the new or changed PDFs are sent to Grobid
+        to_process = {}
+        for filename in pdf_files:
+            pdf_path = os.path.join(pdf_directory, filename)
+            tei_path = tei_path_for(output_dir, filename)
+            pdf_sha256 = manifest.pdf_sha256(tei_path, pdf_path)
+            if args.force or not manifest.is_current(tei_path, pdf_sha256, version, params):
+                to_process[pdf_path] = pdf_sha256
+                continue
+            # Up to date TEI stored with another compression: converted without Grobid
+            existing_path = existing_tei(tei_path)
+            output_path = tei_path_for(output_dir, filename, args.compress)
+            if existing_path != output_path:
+                write_tei(output_path, read_tei(existing_path))
+        logger.info(f"{len(pdf_files) - len(to_process)} PDFs already up to date, {len(to_process)} to process")
+
+        progress = ProgressMeter("grobid_analyse", total=len(to_process), interval=args.progress_interval,
+                                 logger=logger)
+        for pdf_path, extracted_text, error in client.run(list(to_process)):
+            filename = os.path.basename(pdf_path)
+            progress.update(os.path.getsize(pdf_path), error=not extracted_text)
+            if extracted_text:
+                save_text_to_file(extracted_text, output_dir, filename, args.compress)
+                manifest.record(tei_path_for(output_dir, filename), pdf_path, to_process[pdf_path], version, params)
+                # The full TEI is only logged in debug mode
+                logger.debug("%s: %s", filename, extracted_text)
+            else:
+                logger.warning(f"Failed to extract text from PDF: {pdf_path} ({error})")
+                failed.append(filename)
+
+        node_stats = client.stats() if to_process else []
+        for stats in node_stats:
+            logger.info(f"{stats['url']}: {stats['processed']} PDFs ({stats['pdf_per_second']} PDF/s), "
+                        f"{stats['failed']} failed, {stats['busy_replies']} busy replies, "
+                        f"ejected {stats['ejections']} times")
+
+    # The error file lists the PDFs that failed in this run, once each
+    os.makedirs(os.path.dirname(args.error_file) or ".", exist_ok=True)
+    with open(args.error_file, "w") as err_file:
+        for filename in sorted(failed):
+            err_file.write(f"{filename}\n")
+
+    logger.info(f"The extracted tei.xml files were saved as : {output_dir}")
+    if failed:
+        logger.warning(f"{len(failed)} PDFs could not be processed, see {args.error_file}")
+    progress.write_summary(args.summary_file, up_to_date=len(pdf_files) - len(to_process),
+                           grobid_version=version, error_file=args.error_file, servers=node_stats)
 
-    print(f"The extracted tei.xml files were saved as : {output_dir}")
-    print(f"Extraction errors are available in the grobid_errors.txt file")
-main()
 
+if __name__ == "__main__":
+    main()
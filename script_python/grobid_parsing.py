@@ -1,116 +1,968 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
+Parse the .tei.xml files produced by Grobid into JSON: metadata of the
+article, references, abstract, body and figure legends.
+
+Each file is parsed once with lxml. The bibliographic references
+(`<ref type=...>` elements with their content) are removed from the tree
+before the text is read. The fields are those of grobid_tei_xml (same
+names, same order, same removal of the empty fields), so the JSON is the
+same as with `grobid_tei_xml.parse_document_xml`. With `--sections`, the
+structure of the body (sections and paragraphs, as character offsets in
+the flat `body` text) is added in a `sections` field. With `--format jsonl`,
+the documents are written as a sharded JSON Lines corpus (json_corpus.py)
+instead of one JSON file per article. The files larger than
+`--stream-threshold` MB are read as a stream (`stream_document`), with a
+memory use bounded by the largest section instead of the whole document.
+The figures of each TEI file (`extract_figures`) are written next to it
+(`<name>.figures.json`), for extract_figure.py.
+
 Created on Thu Mar 21 16:54:27 2024
 
 @author: amichaud
 """
 
+import argparse
+import io
 import json
-import grobid_tei_xml
-import re
+import logging
 import os
-from bs4 import BeautifulSoup
+import re
+from bisect import bisect_left
+
+from lxml import etree
+
+from json_corpus import COMPRESSIONS, CorpusWriter
+from process_pool import run_tasks
+from progress import ProgressMeter, add_logging_arguments, setup_logging
+from tei_io import list_tei, open_tei, read_tei, tei_size, tei_stem
 
-def process_json_string(json_string):
+logger = logging.getLogger("grobid_parsing")
+
+TEI = "{http://www.tei-c.org/ns/1.0}"
+XML_NS = "{http://www.w3.org/XML/1998/namespace}"
+
+# File listing the TEI files that could not be converted
+ERROR_FILE = "./logs/grobid_parsing_errors.tsv"
+# Summary of the last run
+SUMMARY_FILE = "./logs/grobid_parsing_summary.json"
+# Number of files sent at once to a worker process
+CHUNK_SIZE = 16
+# Bytes read at once when a TEI file is parsed as a stream
+STREAM_READ_SIZE = 64 * 1024
+# TEI files larger than this (uncompressed, in MB) are read as a stream (see stream_document)
+STREAM_THRESHOLD = 32
+# Suffix of the figure file written next to each TEI file (see write_figure_cache)
+FIGURE_CACHE_SUFFIX = ".figures.json"
+FIGURE_CACHE_VERSION = 1
+
+# Comments and processing instructions are dropped, so that the text around them is read as one
+# string. Grobid may repeat an xml:id, which must not make the parsing fail.
+PARSER = etree.XMLParser(remove_comments=True, remove_pis=True, collect_ids=False, huge_tree=True)
+
+
+def parse_tei(source):
     """
-    Clean 'abstract' and 'body' fields by removing newlines.
-    
+    Parse a TEI XML document.
+
     Args:
-        json_string (str): The input JSON string.
-    
+        source (str, bytes or file object): The XML content, or a stream
+            opened with `tei_io.open_tei`.
+
     Returns:
-        str: The cleaned JSON string.
+        lxml.etree._Element: The root element.
     """
-    data = json.loads(json_string)
-
-    if 'abstract' in data and data['abstract']:
-        data['abstract'] = data['abstract'].replace('\n', '')
-    if 'body' in data and data['body']:
-        data['body'] = data['body'].replace('\n', '')
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    if isinstance(source, bytes):
+        return etree.fromstring(source, PARSER)
+    return etree.parse(source, PARSER).getroot()
 
-    return json.dumps(data)
 
-def remove_references_with_content(xml_data):
+def remove_references(root):
     """
-    Remove all <ref> elements with content from the XML.
-    
+    Remove all <ref type=...> elements with their content, keeping the
+    text that follows them.
+
     Args:
-        xml_data (str): The raw XML string.
-    
-    Returns:
-        str: The XML string with <ref> removed.
+        root (lxml.etree._Element): The TEI document, modified in place.
     """
-    return re.sub(r'<ref type.*?</ref>', '', xml_data, flags=re.DOTALL)
+    for ref in list(root.iter(f"{TEI}ref")):
+        if "type" not in ref.attrib:
+            continue
+        parent = ref.getparent()
+        if parent is None:
+            continue
+        if ref.tail:
+            previous = ref.getprevious()
+            if previous is not None:
+                previous.tail = (previous.tail or "") + ref.tail
+            else:
+                parent.text = (parent.text or "") + ref.tail
+        parent.remove(ref)
+
 
-def extract_figure_legends(xml_data):
+def extract_figure_legends(root):
     """
     Extract figure legends from TEI XML.
-    
+
     Args:
-        xml_data (str): The XML string of the document.
-    
+        root (lxml.etree._Element): The TEI document.
+
     Returns:
         list: A list of figure legends (strings).
     """
-    soup = BeautifulSoup(xml_data, "xml")
-    figures = soup.find_all("figure")
     legends = []
-    for fig in figures:
-        desc = fig.find("figDesc")
-        if desc:
-            legends.append(desc.get_text(strip=True))
+    for figure in root.iter(f"{TEI}figure"):
+        desc = next(figure.iter(f"{TEI}figDesc"), None)
+        if desc is not None:
+            legends.append("".join(text.strip() for text in desc.itertext()))
     return legends
 
-def extract_tei_data(xml_data_modif, name_file, output_dir):
+
+def _figure_record(figure):
     """
-    Parse TEI XML and export a JSON file with additional figure legends.
-    
+    Read a <figure> element, whatever the order and presence of its children.
+    """
+    def child_text(tag):
+        elem = figure.find(f"{TEI}{tag}")
+        return " ".join("".join(elem.itertext()).split()) if elem is not None else None
+
+    # The coordinates of the image, or else of the whole figure (with its legend)
+    graphics = [graphic for graphic in figure.iter(f"{TEI}graphic") if graphic.get("coords")]
+    graphic = next((graphic for graphic in graphics if graphic.get("type") == "bitmap"), None)
+    if graphic is None and graphics:
+        graphic = graphics[0]
+    return _compact(
+        id=figure.get(f"{XML_NS}id"),
+        type=figure.get("type") or "figure",
+        label=child_text("label"),
+        head=child_text("head"),
+        legend=child_text("figDesc"),
+        coords=graphic.get("coords") if graphic is not None else figure.get("coords"),
+        graphic_type=graphic.get("type") if graphic is not None else None,
+    )
+
+
+def extract_figures(root):
+    """
+    Extract the figures and tables of a TEI document, before the removal of
+    the references (the legends keep the text of their citations).
+
     Args:
-        xml_data_modif (str): Cleaned and modified XML string.
-        name_file (str): Base name for the output JSON file.
-        output_dir (str): Directory to save the JSON.
+        root (lxml.etree._Element): The TEI document, or a part of it.
+
+    Returns:
+        list: A dict per <figure>: "type" ("figure" or "table"), and when
+            present "id", "label", "head", "legend", "coords" (Grobid
+            coordinates of the image, or of the figure if it has no image)
+            and "graphic_type".
+    """
+    return [_figure_record(figure) for figure in root.iter(f"{TEI}figure")]
+
+
+def stream_figures(source):
+    """
+    Extract the figures of a TEI document as `extract_figures`, reading it
+    as a stream: only the figure being read is kept in memory.
+    """
+    figures = []
+    # Number of open <figure> elements
+    depth = 0
+    for event, elem in _iterparse(source, events=("start", "end")):
+        if elem.tag == f"{TEI}figure":
+            depth += 1 if event == "start" else -1
+            if event == "end" and not depth:
+                # Nested figures are read with their parent, in document order
+                figures.extend(extract_figures(elem))
+                _release(elem)
+        elif event == "end" and not depth:
+            _release(elem)
+    return figures
+
+
+def figure_cache_path(tei_path):
+    """
+    Return the path of the figure file of a TEI file (`<name>.figures.json`, next to it).
+    """
+    directory, filename = os.path.split(tei_path)
+    return os.path.join(directory, (tei_stem(filename) or filename) + FIGURE_CACHE_SUFFIX)
+
+
+def write_figure_cache(tei_path, figures):
+    """
+    Write the figures of a TEI file next to it, so that the figure
+    extraction (extract_figure.py) does not parse the TEI file again.
+    """
+    # Written in place: a partial file is not valid JSON, and is read as missing
+    with open(figure_cache_path(tei_path), "w", encoding="utf-8") as cache_file:
+        cache_file.write(json.dumps({"version": FIGURE_CACHE_VERSION, "figures": figures}, ensure_ascii=False))
+
+
+def read_figure_cache(tei_path):
+    """
+    Read the figures of a TEI file from its figure file.
+
+    Returns:
+        list: The figures (see `extract_figures`), or None if the figure
+            file is missing, older than the TEI file, or of another version.
+    """
+    path = figure_cache_path(tei_path)
+    try:
+        if os.path.getmtime(path) < os.path.getmtime(tei_path):
+            return None
+        with open(path, encoding="utf-8") as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    if cache.get("version") != FIGURE_CACHE_VERSION:
+        return None
+    return cache["figures"]
+
+
+def load_figures(tei_path):
+    """
+    Return the figures of a TEI file: from its figure file if it is up to
+    date, else by reading the TEI file as a stream, the figure file being
+    then written for the next time.
+    """
+    figures = read_figure_cache(tei_path)
+    if figures is None:
+        with open_tei(tei_path) as tei_file:
+            if tei_size(tei_path) > STREAM_THRESHOLD * 1024 * 1024:
+                figures = stream_figures(tei_file)
+            else:
+                figures = extract_figures(parse_tei(tei_file))
+        try:
+            write_figure_cache(tei_path, figures)
+        except OSError as e:
+            logger.warning(f"Figure file of {tei_path} not written: {e}")
+    return figures
+
+
+def extract_sections(root, body):
+    """
+    Extract the structure of the body: its sections (<div>) with their
+    title and paragraphs (<p>), located by character offsets in the flat
+    `body` text of the JSON, so that `body[start:end]` is the text of a
+    title or paragraph. Paragraphs outside any <div> are grouped in
+    sections without title.
+
+    Args:
+        root (lxml.etree._Element): The TEI document, without its references.
+        body (str): The flat body text, as written in the JSON.
+
+    Returns:
+        list: Sections, as dicts with "title", "n" and "head" ([start, end]
+            of the title) when the section has a title, and "paragraphs"
+            (list of [start, end]).
+    """
+    body_elem = root.find(f".//{TEI}text/{TEI}body")
+    if body_elem is None or not body:
+        return []
+    # The body text is written again as `_text` joins it, recording the position of each chunk
+    chunks = []
+    length = 0
+
+    def write(chunk):
+        nonlocal length
+        start = length + 1 if chunks else 0
+        chunks.append(chunk)
+        length = start + len(chunk)
+        return start, length
+
+    if body_elem.text:
+        write(body_elem.text)
+    items = []
+    for child in body_elem:
+        items.append(_section_item(child, write))
+        if child.tail:
+            write(child.tail)
+    raw = " ".join(chunks)
+    if raw.strip().replace("\n", "") != body:
+        logger.warning("The sections are left out: the body text does not match the TEI body")
+        return []
+    return _locate_sections(items, raw)
+
+
+def _text_events(elem):
+    """
+    Walk an element as `itertext` does: ("start", element), ("text", chunk)
+    and ("end", element) events, the chunks in the order of `itertext`.
+    """
+    yield "start", elem
+    if elem.text:
+        yield "text", elem.text
+    for child in elem:
+        yield from _text_events(child)
+        if child.tail:
+            yield "text", child.tail
+    yield "end", elem
+
+
+def _section_item(elem, write):
+    """
+    Write the text of a child of <body> chunk by chunk, in the order of
+    `itertext`, with `write(chunk)`, which returns the (start, end)
+    position of the chunk in the body text. Return the positions of the
+    titles and paragraphs: ("div", title span, n, paragraph spans) for a
+    <div>, ("p", span) for a <p>, None otherwise. The span of an element
+    without text is None.
+    """
+    head = elem.find(f"{TEI}head") if elem.tag == f"{TEI}div" else None
+    spans = []
+    open_spans = []
+    for event, value in _text_events(elem):
+        if event == "text":
+            start, end = write(value)
+            for span in open_spans:
+                if span[0] is None:
+                    span[0] = start
+                span[1] = end
+        elif value is head or value.tag == f"{TEI}p":
+            if event == "start":
+                span = [None, None]
+                spans.append((value, span))
+                open_spans.append(span)
+            else:
+                open_spans.pop()
+    spans = [(node, span if span[0] is not None else None) for node, span in spans]
+
+    if elem.tag == f"{TEI}div":
+        paragraphs = [span for node, span in spans if node is not head]
+        if head is None:
+            return "div", None, None, paragraphs
+        return "div", next(span for node, span in spans if node is head), head.get("n"), paragraphs
+    if elem.tag == f"{TEI}p":
+        return "p", spans[0][1]
+    return None
+
+
+def _locate_sections(items, raw):
+    """
+    Build the sections from the items of `_section_item`, whose positions
+    are in the body text `raw` as it is joined from the TEI: the positions
+    are moved to the flat body of the JSON, which is `raw` stripped and
+    without its newlines.
+    """
+    body = raw.strip().replace("\n", "")
+    if not body:
+        return []
+    lead = len(raw) - len(raw.lstrip())
+    newlines = [match.start() for match in re.finditer("\n", raw)]
+    lead_newlines = bisect_left(newlines, lead)
+
+    def locate(span):
+        # Position in the flat body: after the stripped whitespace and without the newlines before
+        if span is None:
+            return None
+        start, end = (min(max(position - lead - bisect_left(newlines, position) + lead_newlines, 0), len(body))
+                      for position in span)
+        while start < end and body[start].isspace():
+            start += 1
+        while end > start and body[end - 1].isspace():
+            end -= 1
+        return [start, end] if start < end else None
+
+    sections = []
+    untitled = None
+    for item in items:
+        if item is None:
+            continue
+        if item[0] == "div":
+            _, title, n, paragraphs = item
+            section = {}
+            span = locate(title)
+            if span:
+                section.update(title=body[span[0]:span[1]], n=n, head=span)
+            section["paragraphs"] = [span for span in map(locate, paragraphs) if span]
+            sections.append(_compact(**section))
+            untitled = None
+        else:
+            span = locate(item[1])
+            if span:
+                if untitled is None:
+                    untitled = {"paragraphs": []}
+                    sections.append(untitled)
+                untitled["paragraphs"].append(span)
+    return [section for section in sections if section.get("paragraphs") or section.get("head")]
+
+
+def _text(elem):
+    """
+    Join the text of an element as grobid_tei_xml does.
+    """
+    return " ".join(elem.itertext()).strip() or None
+
+
+def _compact(**fields):
+    """
+    Build a dict of the non-empty fields (None, "" and {} are dropped, as
+    in the dicts of grobid_tei_xml), keeping their order.
+    """
+    return {key: value for key, value in fields.items() if value is not None and value != "" and value != {}}
+
+
+def _parse_persname(elem):
+    full_name = " ".join([text.strip() for text in elem.itertext() if text.strip()]).strip()
+    return dict(
+        full_name=full_name or None,
+        given_name=elem.findtext(f'./{TEI}forename[@type="first"]'),
+        middle_name=elem.findtext(f'./{TEI}forename[@type="middle"]'),
+        surname=elem.findtext(f"./{TEI}surname"),
+    )
+
+
+def _parse_affiliation(elem):
+    orgnames = {}
+    for orgname in elem.findall(f"./{TEI}orgName"):
+        if orgname.get("type"):
+            orgnames[orgname.get("type")] = orgname.text or None
+    if not orgnames:
+        return None
+
+    address = None
+    address_elem = elem.find(f"./{TEI}address")
+    if address_elem is not None:
+        fields = {child.tag.split("}")[-1]: child.text or None for child in address_elem}
+        if fields:
+            address = _compact(
+                addr_line=fields.get("addrLine"),
+                post_code=fields.get("postCode"),
+                settlement=fields.get("settlement"),
+                country=fields.get("country"),
+            )
+    return _compact(
+        institution=orgnames.get("institution"),
+        department=orgnames.get("department"),
+        laboratory=orgnames.get("laboratory"),
+        address=address,
+    )
+
+
+def _parse_author(elem):
+    persname = elem.find(f"./{TEI}persName")
+    if persname is None:
+        return None
+    affiliation = elem.find(f"./{TEI}affiliation")
+    return _compact(
+        **_parse_persname(persname),
+        email=elem.findtext(f"./{TEI}email"),
+        orcid=elem.findtext(f'.//{TEI}idno[@type="ORCID"]'),
+        affiliation=_parse_affiliation(affiliation) if affiliation is not None else None,
+    )
+
+
+def _parse_editor(elem):
+    persnames = elem.findall(f"./{TEI}persName")
+    if not persnames:
+        # Sometimes the name is given directly in <editor>
+        if len(elem) == 0 and elem.text and len(elem.text.strip()) >= 2:
+            return [{"full_name": elem.text.strip()}]
+        return []
+    return [_compact(**_parse_persname(persname)) for persname in persnames]
+
+
+def _clean_url(url):
+    if not url:
+        return None
+    url = url.strip()
+    if url.endswith(".Lastaccessed"):
+        url = url.replace(".Lastaccessed", "")
+    if url.startswith("<"):
+        url = url[1:]
+    if ">" in url:
+        url = url.split(">")[0]
+    return url or None
+
+
+def _parse_biblio(elem, index=None):
+    """
+    Read the bibliographic fields of a <teiHeader> or of a <biblStruct>.
+    """
+    authors = [author for author in map(_parse_author, elem.iterfind(f".//{TEI}author")) if author is not None]
+    editors = []
+    for editor in elem.iterfind(f".//{TEI}editor"):
+        editors.extend(_parse_editor(editor))
+
+    def find(path):
+        return elem.findtext(f".//{TEI}{path}")
+
+    title = find('title[@type="main"]')
+    book_title = None
+    book_title_elem = elem.find(f'.//{TEI}title[@level="m"]')
+    if book_title_elem is not None and book_title_elem.get("type") is None:
+        book_title = book_title_elem.text
+    if book_title and not title:
+        title, book_title = book_title, None
+
+    note = None
+    note_elem = elem.find(f".//{TEI}note")
+    if note_elem is not None and note_elem.get("type") is None:
+        note = note_elem.text
+
+    date = None
+    date_elem = elem.find(f'.//{TEI}date[@type="published"]')
+    if date_elem is not None:
+        date = date_elem.get("when") or None
+
+    arxiv_id = find('idno[@type="arXiv"]')
+    if arxiv_id and arxiv_id.startswith("arXiv:"):
+        arxiv_id = arxiv_id[6:]
+
+    pages = first_page = last_page = None
+    pages_elem = elem.find(f'.//{TEI}biblScope[@unit="page"]')
+    if pages_elem is not None:
+        first_page = pages_elem.get("from") or None
+        last_page = pages_elem.get("to") or None
+        pages = f"{first_page}-{last_page}" if first_page and last_page else pages_elem.text
+
+    doi = find('idno[@type="DOI"]')
+    url = None
+    ptr = elem.find(f".//{TEI}ptr[@target]")
+    if ptr is not None:
+        url = _clean_url(ptr.get("target"))
+    # A DOI URL is redundant with the DOI
+    if doi and url and ("://doi.org/" in url or "://dx.doi.org/" in url):
+        url = None
+
+    return _compact(
+        authors=authors,
+        index=index,
+        id=elem.get(f"{XML_NS}id"),
+        unstructured=find('note[@type="raw_reference"]'),
+        date=date,
+        title=title,
+        book_title=book_title,
+        series_title=find('title[@level="s"]'),
+        editors=editors or None,
+        journal=find('title[@level="j"]'),
+        journal_abbrev=find('title[@level="j"][@type="abbrev"]'),
+        publisher=find(f"publicationStmt/{TEI}publisher") or find(f"imprint/{TEI}publisher"),
+        institution=find(f"respStmt/{TEI}orgName"),
+        issn=find('idno[@type="ISSN"]'),
+        eissn=find('idno[@type="eISSN"]'),
+        volume=find('biblScope[@unit="volume"]'),
+        issue=find('biblScope[@unit="issue"]'),
+        pages=pages,
+        first_page=first_page,
+        last_page=last_page,
+        note=note,
+        doi=doi,
+        pmid=find('idno[@type="PMID"]'),
+        pmcid=find('idno[@type="PMCID"]'),
+        arxiv_id=arxiv_id,
+        pii=find('idno[@type="PII"]'),
+        ark=find('idno[@type="ark"]'),
+        istex_id=find('idno[@type="istexId"]'),
+        url=url,
+    )
+
+
+def extract_document(root):
     """
-    doc = grobid_tei_xml.parse_document_xml(xml_data_modif)
-    doc_dict = doc.to_dict()
+    Read the metadata, references and text of a TEI document, whose
+    references were removed with `remove_references`.
+
+    Args:
+        root (lxml.etree._Element): The TEI document.
+
+    Returns:
+        dict: The fields of the document, without the empty ones.
+    """
+    header = root.find(f".//{TEI}teiHeader")
+    if header is None:
+        raise ValueError("XML does not look like TEI format")
+
+    language_code = None
+    text = root.find(f".//{TEI}text")
+    if text is not None and len(text) and text.get(f"{XML_NS}lang"):
+        language_code = text.get(f"{XML_NS}lang")
 
-    # Extract and include figure legends
-    legends = extract_figure_legends(xml_data_modif)
+    fields = {}
+    for field, path in (("body", f".//{TEI}text/{TEI}body"),
+                        ("acknowledgement", f'.//{TEI}back/{TEI}div[@type="acknowledgement"]'),
+                        ("annex", f'.//{TEI}back/{TEI}div[@type="annex"]')):
+        elem = root.find(path)
+        fields[field] = _text(elem) if elem is not None else None
+
+    citations = [_parse_biblio(bibl, index)
+                 for index, bibl in enumerate(root.iterfind(f".//{TEI}listBibl/{TEI}biblStruct"))]
+    return _build_document(header, language_code, citations, fields)
+
+
+def _build_document(header, language_code, citations, fields):
+    """
+    Build the dict of a document, with the fields in the order of grobid_tei_xml.
+
+    Args:
+        header (lxml.etree._Element): The <teiHeader>, without its references.
+        language_code (str): The language of the text.
+        citations (list): The parsed references.
+        fields (dict): The text of the body, acknowledgement and annex.
+    """
+    application = header.findall(f".//{TEI}appInfo/{TEI}application")[0]
+    abstract = header.find(f".//{TEI}profileDesc/{TEI}abstract")
+    return _compact(
+        grobid_version=application.get("version").strip(),
+        grobid_timestamp=application.get("when").strip(),
+        header=_parse_biblio(header),
+        pdf_md5=header.findtext(f'.//{TEI}idno[@type="MD5"]'),
+        language_code=language_code,
+        citations=citations,
+        abstract=_text(abstract) if abstract is not None else None,
+        **fields,
+    )
+
+
+def _release(elem):
+    """
+    Free a processed element, and its previous siblings, during an iterparse.
+    """
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+def _iterparse(stream, events=("end",)):
+    """
+    Parse a stream with the options of PARSER, yielding the (event, element)
+    pairs (etree.iterparse does not take collect_ids).
+    """
+    parser = etree.XMLPullParser(events=events, remove_comments=True, remove_pis=True,
+                                 collect_ids=False, huge_tree=True)
+    while True:
+        data = stream.read(STREAM_READ_SIZE)
+        if not data:
+            break
+        parser.feed(data)
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def stream_document(source, sections=False, figures=None):
+    """
+    Read a TEI document as a stream (lxml iterparse), for the files too
+    large to be held as a tree. The parts of the document are processed as
+    soon as they are complete, then freed: the header, each child of the
+    body and of the back, and each reference of the bibliography. The
+    memory used is that of the largest part (e.g. a section), whatever the
+    size of the document. The result is the same as with `extract_document`.
+
+    Args:
+        source (str, bytes or file object): The TEI XML document.
+        sections (bool): Also locate the sections of the body (see `extract_sections`).
+        figures (list): If given, the figures of the document are added
+            to it (see `extract_figures`).
+
+    Returns:
+        tuple: (fields of the document as `extract_document`, figure
+            legends, sections of the body or None)
+    """
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+
+    body_tag, back_tag = f"{TEI}body", f"{TEI}back"
+    header = None
+    language_code = None
+    citations = []
+    legends = []
+    items = []
+    sections_found = [] if sections else None
+    fields = {"body": None, "acknowledgement": None, "annex": None}
+    # Text of the body (its chunks joined by spaces, as `_text`), and whether its
+    # last chunk is a text or tail that the tail of a removed <ref> is joined to
+    # (see remove_references)
+    body_text = io.StringIO()
+    joinable = False
+    # Child of the body processed once its tail is complete, i.e. at the end of the next one
+    pending = None
+
+    def read_part(part):
+        # Figure legends and references of a part, in document order
+        if figures is not None:
+            figures.extend(extract_figures(part))
+        remove_references(part)
+        legends.extend(extract_figure_legends(part))
+        for bibl in part.iter(f"{TEI}biblStruct"):
+            if bibl.getparent() is not None and bibl.getparent().tag == f"{TEI}listBibl":
+                citations.append(_parse_biblio(bibl, len(citations)))
+
+    def add_chunk(chunk, join=False):
+        # Returns the position of the chunk in the body text (see _section_item)
+        if body_text.tell() and not join:
+            body_text.write(" ")
+        start = body_text.tell()
+        body_text.write(chunk)
+        return start, start + len(chunk)
+
+    def add_body_child(child):
+        nonlocal joinable
+        if not body_text.tell() and child.getparent().text:
+            add_chunk(child.getparent().text)
+            joinable = True
+        if child.tag == f"{TEI}ref" and "type" in child.attrib:
+            if child.tail:
+                add_chunk(child.tail, joinable)
+                joinable = True
+            return
+        read_part(child)
+        item = _section_item(child, add_chunk)
+        if sections:
+            items.append(item)
+        joinable = False
+        if child.tail:
+            add_chunk(child.tail)
+            joinable = True
+
+    for _, elem in _iterparse(source):
+        parent = elem.getparent()
+        parent_tag = parent.tag if parent is not None else None
+        if parent_tag == body_tag:
+            if pending is not None:
+                add_body_child(pending)
+                _release(pending)
+            pending = elem
+        elif elem.tag == body_tag:
+            if pending is not None:
+                add_body_child(pending)
+            elif elem.text:
+                add_chunk(elem.text)
+            if sections:
+                sections_found = _locate_sections(items, body_text.getvalue())
+            fields["body"] = body_text.getvalue().strip() or None
+            body_text = io.StringIO()
+            pending = None
+            _release(elem)
+        elif elem.tag == f"{TEI}biblStruct" and parent_tag == f"{TEI}listBibl" \
+                and any(ancestor.tag == back_tag for ancestor in elem.iterancestors()):
+            # The references of the bibliography are read one by one
+            remove_references(elem)
+            citations.append(_parse_biblio(elem, len(citations)))
+            _release(elem)
+        elif parent_tag == back_tag:
+            if figures is not None:
+                figures.extend(extract_figures(elem))
+            remove_references(elem)
+            if elem.tag == f"{TEI}div" and elem.get("type") in ("acknowledgement", "annex") \
+                    and fields[elem.get("type")] is None:
+                fields[elem.get("type")] = _text(elem)
+            legends.extend(extract_figure_legends(elem))
+            _release(elem)
+        elif elem.tag == f"{TEI}teiHeader":
+            if header is None:
+                read_part(elem)
+                header = elem
+        elif parent_tag == f"{TEI}text" and elem.tag != back_tag:
+            # Other parts of the text (e.g. <front>)
+            read_part(elem)
+            _release(elem)
+        elif elem.tag == f"{TEI}text" and language_code is None:
+            if len(elem) and elem.get(f"{XML_NS}lang"):
+                language_code = elem.get(f"{XML_NS}lang")
+
+    if header is None:
+        raise ValueError("XML does not look like TEI format")
+    return _build_document(header, language_code, citations, fields), legends, sections_found
+
+
+def tei_to_json(source, sections=False, stream=False, figures=None):
+    """
+    Convert a TEI XML document into the JSON of the article.
+
+    Args:
+        source (str, bytes or file object): The TEI XML document.
+        sections (bool): Add the sections and paragraphs of the body
+            (see `extract_sections`).
+        stream (bool): Read the document as a stream (see `stream_document`)
+            instead of as a tree; the JSON is the same.
+        figures (list): If given, the figures of the document are added to
+            it (see `extract_figures`), read from the same parsing.
+
+    Returns:
+        str: The JSON string, abstract and body without newlines.
+    """
+    if stream:
+        doc_dict, legends, stream_sections = stream_document(source, sections, figures)
+    else:
+        root = parse_tei(source)
+        if figures is not None:
+            figures.extend(extract_figures(root))
+        remove_references(root)
+        doc_dict = extract_document(root)
+        legends = extract_figure_legends(root)
     doc_dict["figure_legends"] = legends
+    for field in ("abstract", "body"):
+        if doc_dict.get(field):
+            doc_dict[field] = doc_dict[field].replace("\n", "")
+    if sections:
+        body = doc_dict.get("body", "")
+        doc_dict["sections"] = stream_sections if stream else extract_sections(root, body)
+    return json.dumps(doc_dict)
+
+
+def extract_tei_data(xml_data, name_file, output_dir, sections=False, stream=False, figure_path=None):
+    """
+    Parse TEI XML and export a JSON file with additional figure legends.
+
+    Args:
+        xml_data (str, bytes or file object): The TEI XML document.
+        name_file (str): Base name for the output JSON file.
+        output_dir (str): Directory to save the JSON, not saved if None.
+        sections (bool): Add the sections and paragraphs of the body.
+        stream (bool): Read the document as a stream (for very large files).
+        figure_path (str): The TEI file, whose figure file is written if given
+            (see `write_figure_cache`).
+
+    Returns:
+        str: The JSON string.
+    """
+    figures = [] if figure_path else None
+    data_parsed = tei_to_json(xml_data, sections, stream, figures)
+    if figure_path:
+        write_figure_cache(figure_path, figures)
 
-    data_parsed = json.dumps(doc_dict, indent=2)
-    data_parsed = process_json_string(data_parsed)
+    if output_dir is not None:
+        # Written to a temporary file first: a failed conversion leaves no partial JSON
+        output_path = os.path.join(output_dir, name_file + ".json")
+        with open(output_path + ".part", "w") as file:
+            file.write(data_parsed)
+        os.replace(output_path + ".part", output_path)
+    # The full document is only logged in debug mode
+    logger.debug("%s: %s", name_file, data_parsed)
+    return data_parsed
 
-    with open(os.path.join(output_dir, name_file + ".json"), "w") as file:
-        file.write(data_parsed)
-        print(data_parsed)
 
 def read_xml(path_xml):
     """
-    Read the content of a .tei.xml file.
-    
+    Read the content of a .tei.xml file (possibly compressed: .tei.xml.gz, .tei.xml.zst).
+
     Args:
         path_xml (str): Path to the XML file.
-    
+
     Returns:
         str: The XML file content.
     """
-    with open(path_xml, 'r', encoding='utf-8') as file:
-        return file.read()
+    return read_tei(path_xml)
+
+
+def convert_file(name_file, xml_path, output_dir, sections=False, stream_threshold=STREAM_THRESHOLD,
+                 figure_cache=True):
+    """
+    Convert one TEI file, catching its errors so that a malformed file
+    does not stop the conversion of the others. If `output_dir` is None,
+    the JSON is returned instead of being saved. Files larger than
+    `stream_threshold` MB (uncompressed) are read as a stream. With
+    `figure_cache`, the figure file of the TEI file is written too.
+
+    Returns:
+        tuple: (name_file, error message or None, size of the TEI file,
+            JSON string if not saved)
+    """
+    try:
+        size = os.path.getsize(xml_path)
+        stream = stream_threshold is not None and tei_size(xml_path) > stream_threshold * 1024 * 1024
+        with open_tei(xml_path) as xml_file:
+            data_parsed = extract_tei_data(xml_file, name_file, output_dir, sections, stream,
+                                           xml_path if figure_cache else None)
+    except Exception as e:
+        return name_file, f"{type(e).__name__}: {e}", 0, None
+    return name_file, None, size, data_parsed if output_dir is None else None
+
+
+def _convert_crashed(name_file, *args):
+    return name_file, "Worker process crashed", 0, None
+
+
+def convert_files(files, output_dir, workers=1, sections=False, stream_threshold=STREAM_THRESHOLD,
+                  figure_cache=True):
+    """
+    Convert TEI files, in a pool of `workers` processes if more than one.
+
+    Args:
+        files (list): (name_file, xml_path) pairs.
+        output_dir (str): Directory to save the JSON files, or None to return the JSON.
+        workers (int): Number of worker processes.
+        sections (bool): Add the sections and paragraphs of the body.
+        stream_threshold (float): Size (MB) above which a file is read as a stream.
+        figure_cache (bool): Write the figure file of each TEI file.
+
+    Returns:
+        generator: (name_file, error message or None, size of the TEI file, JSON string if not saved),
+            in the order of `files`.
+    """
+    # A crash of a worker process (e.g. in the XML library) only affects the file it was converting
+    tasks = ((name_file, xml_path, output_dir, sections, stream_threshold, figure_cache) for name_file, xml_path in files)
+    return run_tasks(convert_file, tasks, workers, _convert_crashed, CHUNK_SIZE)
+
 
 def main():
     """
     Main function to process all .tei.xml files in a directory.
     """
-    tei_directory = "./data_tei_xml"
-    output_dir = "./data_json"
+    parser = argparse.ArgumentParser(description="Convert the Grobid .tei.xml files into JSON.")
+    parser.add_argument("--tei-dir", default="./data_tei_xml", help="Directory of the TEI files (default: ./data_tei_xml)")
+    parser.add_argument("--output-dir", default="./data_json", help="Directory of the JSON files (default: ./data_json)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes converting files at the same time (default: 1)")
+    parser.add_argument("--error-file", default=ERROR_FILE,
+                        help=f"TSV file listing the files that could not be converted (default: {ERROR_FILE})")
+    parser.add_argument("--sections", action="store_true",
+                        help="Add the sections and paragraphs of the body, as offsets in the body text")
+    parser.add_argument("--format", choices=["files", "jsonl"], default="files",
+                        help="One JSON file per article (files, default), or a sharded JSON Lines corpus with "
+                             "an index (jsonl, see json_corpus.py)")
+    parser.add_argument("--compress", choices=list(COMPRESSIONS), default="none",
+                        help="Compression of the JSON Lines shards (default: none, zstd needs the zstandard package)")
+    parser.add_argument("--stream-threshold", type=float, default=STREAM_THRESHOLD,
+                        help="Size (MB, uncompressed) above which a TEI file is read as a stream instead of "
+                             f"as a tree, to bound the memory used (default: {STREAM_THRESHOLD}, 0: always)")
+    parser.add_argument("--no-figure-cache", action="store_true",
+                        help=f"Do not write the figures of each TEI file next to it (<name>{FIGURE_CACHE_SUFFIX}, "
+                             "read by extract_figure.py)")
+    add_logging_arguments(parser, SUMMARY_FILE)
+    args = parser.parse_args()
+    setup_logging(args)
+
+    tei_directory = args.tei_dir
+    output_dir = args.output_dir
+    os.makedirs(output_dir, exist_ok=True)
+
+    files = list_tei(tei_directory)
+    logger.info(f"Converting {len(files)} TEI files from {tei_directory} with {args.workers} worker(s)")
+    progress = ProgressMeter("grobid_parsing", total=len(files), interval=args.progress_interval, logger=logger)
+    # In a corpus, the documents are written by this process, in file order
+    corpus = CorpusWriter(output_dir, args.compress) if args.format == "jsonl" else None
+    errors = []
+    for name_file, error, size, data_parsed in convert_files(files, None if corpus else output_dir,
+                                                             args.workers, args.sections, args.stream_threshold,
+                                                             not args.no_figure_cache):
+        progress.update(size, error=bool(error))
+        if error:
+            logger.warning(f"Failed to convert {name_file}: {error}")
+            errors.append((name_file, error))
+        elif corpus is not None:
+            corpus.write(name_file, data_parsed)
+    # Not closed if the run was interrupted: the previous corpus is kept
+    if corpus is not None:
+        corpus.close()
 
-    for filename in os.listdir(tei_directory):
-        if filename.endswith(".tei.xml"):
-            xml_path = os.path.join(tei_directory, filename)
-            xml_data = read_xml(xml_path)
-            xml_data_modif = remove_references_with_content(xml_data)
-            extract_tei_data(xml_data_modif, filename.replace(".tei.xml", ""), output_dir)
+    # The error manifest lists the failures of this run, in file order
+    os.makedirs(os.path.dirname(args.error_file) or ".", exist_ok=True)
+    with open(args.error_file, "w", encoding="utf-8") as err_file:
+        err_file.write("TEI file\tError\n")
+        for name_file, error in errors:
+            err_file.write(f"{name_file}\t{' '.join(error.split())}\n")
+    if errors:
+        logger.warning(f"{len(errors)} TEI files could not be converted, see {args.error_file}")
+    progress.write_summary(args.summary_file, workers=args.workers, format=args.format, error_file=args.error_file)
 
-main()
 
+if __name__ == "__main__":
+    main()
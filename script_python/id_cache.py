@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent SQLite cache of the identifier mappings (PMID <-> DOI <-> PMCID)
+resolved by the NCBI scripts, so that re-runs on overlapping identifier
+sets only query NCBI for the identifiers never seen before.
+
+Negative results (identifier without DOI / without PMCID) are cached too,
+but expire after a configurable delay since they may change over time.
+
+@author: amichaud
+"""
+
+import os
+import sqlite3
+import time
+
+# Default location of the cache database
+DEFAULT_CACHE = "cache/identifiers.sqlite"
+# Negative results are forgotten after this delay (in days)
+NEGATIVE_TTL_DAYS = 30
+# Maximum number of variables in a single SQLite query
+QUERY_CHUNK = 500
+
+
+def normalize(kind, value):
+    """
+    Normalize an identifier so that different spellings share a cache entry.
+
+    Args:
+        kind (str): The identifier type ('pmid', 'doi' or 'pmcid').
+        value (str): The identifier.
+
+    Returns:
+        str: The normalized identifier.
+    """
+    value = value.strip()
+    if kind in ("doi", "pmcid"):
+        return value.lower()
+    return value
+
+
+class IdCache:
+    """
+    Mapping cache stored in a SQLite database.
+
+    Each entry maps an identifier of one type (source) to an identifier of
+    another type (target). A NULL result is a negative entry.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE, negative_ttl_days=NEGATIVE_TTL_DAYS):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.negative_ttl = negative_ttl_days * 86400
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS mappings (
+                   source TEXT NOT NULL,
+                   value TEXT NOT NULL,
+                   target TEXT NOT NULL,
+                   result TEXT,
+                   updated REAL NOT NULL,
+                   PRIMARY KEY (source, value, target)
+               )"""
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_many(self, source, target, values):
+        """
+        Look up cached mappings.
+
+        Args:
+            source (str): The type of the given identifiers.
+            target (str): The type of the wanted identifiers.
+            values (list): The identifiers to look up.
+
+        Returns:
+            dict: identifier -> result (None for a negative entry) for every
+            identifier present in the cache. Expired negative entries are
+            left out.
+        """
+        keys = {}
+        for value in values:
+            keys.setdefault(normalize(source, value), []).append(value)
+        expiry = time.time() - self.negative_ttl
+        found = {}
+        key_list = list(keys)
+        for start in range(0, len(key_list), QUERY_CHUNK):
+            chunk = key_list[start:start + QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT value, result, updated FROM mappings "
+                f"WHERE source = ? AND target = ? AND value IN ({placeholders})",
+                [source, target] + chunk,
+            )
+            for key, result, updated in rows:
+                if result is None and updated < expiry:
+                    continue
+                for value in keys[key]:
+                    found[value] = result
+        return found
+
+    def put_many(self, source, target, mapping):
+        """
+        Store mappings, replacing any previous entry.
+
+        Args:
+            source (str): The type of the given identifiers.
+            target (str): The type of the resolved identifiers.
+            mapping (dict): identifier -> result (None for a negative result).
+        """
+        now = time.time()
+        rows = [(source, normalize(source, value), target, result, now)
+                for value, result in mapping.items() if value]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO mappings (source, value, target, result, updated) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+
+def add_cache_arguments(parser):
+    """
+    Add the identifier cache options to an argument parser.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser to extend.
+    """
+    parser.add_argument("--cache", default=DEFAULT_CACHE,
+                        help=f"SQLite identifier cache (default: {DEFAULT_CACHE})")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Do not read nor update the identifier cache")
+    parser.add_argument("--negative-ttl", type=float, default=NEGATIVE_TTL_DAYS,
+                        help="Days after which identifiers not found are queried again")
+
+
+def open_cache(args):
+    """
+    Open the identifier cache selected on the command line.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        IdCache: The opened cache, or None when disabled.
+    """
+    if args.no_cache:
+        return None
+    return IdCache(args.cache, args.negative_ttl)
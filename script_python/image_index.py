@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Corpus-level index of the images embedded in the PDFs (extract_figure.py),
+keyed by a perceptual hash.
+
+The logos, journal banners and license badges of the publishers are
+embedded in every paper. Each image is identified by the dHash of a 9x8
+grayscale thumbnail: the images that look the same (same or close hash,
+whatever their resolution or encoding) are stored once, in a folder
+shared by the HTML pages, and each page links to the stored copy. An
+image found in `boilerplate_papers` papers or more is blocklisted: it is
+no longer shown in the pages.
+
+Near-duplicates are found by multi-index hashing: the 64-bit hash is
+split into 4 bands of 16 bits, each indexed, and two hashes within a
+Hamming distance of 3 share at least one band. A lookup only reads the
+images sharing a band with the hash, whatever the size of the index. The
+64 bits alone confuse distinct figures drawn the same way (e.g. two bar
+charts), so the candidates are then compared on a 16x16 thumbnail.
+
+@author: amichaud
+"""
+
+import hashlib
+import os
+import sqlite3
+
+import fitz  # PyMuPDF
+
+# Folder of the shared images and of the index, in the output folder of extract_figure.py
+SHARED_DIR = "_images"
+INDEX_FILE = "index.sqlite"
+# Images found in this number of papers are blocklisted (0: never)
+BOILERPLATE_PAPERS = 10
+# Maximum Hamming distance between the hashes of two near-duplicates (at most 3 with 4 bands)
+HASH_DISTANCE = 3
+# Maximum differences of mean gray level and of aspect ratio between two near-duplicates:
+# the dHash only compares neighbouring pixels (e.g. all the uniform images have the hash 0)
+MEAN_TOLERANCE = 16
+RATIO_TOLERANCE = 0.1
+# Side of the thumbnails compared, and maximum mean difference of their pixels, in gray levels
+THUMBNAIL_SIZE = 16
+THUMBNAIL_TOLERANCE = 6
+# Seconds to wait for the lock of the database, shared by the worker processes
+LOCK_TIMEOUT = 60
+
+
+def image_hash(image_bytes):
+    """
+    Compute the dHash of an image: each bit tells whether a pixel of a 9x8
+    grayscale thumbnail is brighter than its right neighbour.
+
+    Args:
+        image_bytes (bytes): The image, in a format read by PyMuPDF.
+
+    Returns:
+        tuple: (64-bit hash, mean gray level of the thumbnail, aspect ratio
+            of the image, THUMBNAIL_SIZE x THUMBNAIL_SIZE grayscale thumbnail).
+    """
+    pix = fitz.Pixmap(image_bytes)
+    ratio = pix.width / pix.height
+    samples, stride = _thumbnail(pix, 9, 8)
+    value = 0
+    for row in range(8):
+        line = samples[row * stride:row * stride + 9]
+        for col in range(8):
+            value = value << 1 | (line[col] > line[col + 1])
+    mean = sum(samples[row * stride + col] for row in range(8) for col in range(9)) / 72
+    samples, stride = _thumbnail(pix, THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+    thumbnail = b"".join(samples[row * stride:row * stride + THUMBNAIL_SIZE] for row in range(THUMBNAIL_SIZE))
+    return value, mean, ratio, thumbnail
+
+
+def _thumbnail(pix, width, height):
+    # Scaled before the conversion to gray, which is then done on a few pixels
+    thumbnail = fitz.Pixmap(pix, width, height, None)
+    if thumbnail.alpha:
+        thumbnail = fitz.Pixmap(thumbnail, 0)
+    if thumbnail.n != 1:
+        thumbnail = fitz.Pixmap(fitz.csGRAY, thumbnail)
+    return thumbnail.samples, thumbnail.stride
+
+
+def _thumbnail_distance(thumbnail, other):
+    return sum(abs(a - b) for a, b in zip(thumbnail, other)) / len(thumbnail)
+
+
+def _bands(value):
+    return [(value >> shift) & 0xFFFF for shift in (48, 32, 16, 0)]
+
+
+class ImageIndex:
+    """
+    Index of the images of the corpus, stored in a SQLite database next to
+    the shared images. It can be used by several processes at the same time.
+    """
+
+    def __init__(self, directory, boilerplate_papers=BOILERPLATE_PAPERS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.boilerplate_papers = boilerplate_papers
+        self.connection = sqlite3.connect(os.path.join(directory, INDEX_FILE), timeout=LOCK_TIMEOUT,
+                                          isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS images (
+                   id INTEGER PRIMARY KEY,
+                   sha256 TEXT NOT NULL UNIQUE,
+                   b0 INTEGER, b1 INTEGER, b2 INTEGER, b3 INTEGER,
+                   mean REAL,
+                   ratio REAL,
+                   thumbnail BLOB,
+                   filename TEXT NOT NULL,
+                   papers INTEGER NOT NULL DEFAULT 0,
+                   blocked INTEGER NOT NULL DEFAULT 0
+               )"""
+        )
+        for band in range(4):
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS images_b{band} ON images (b{band})")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS occurrences (
+                   image INTEGER NOT NULL,
+                   paper TEXT NOT NULL,
+                   PRIMARY KEY (image, paper)
+               ) WITHOUT ROWID"""
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def find(self, digest, hashed):
+        """
+        Find an image of the index with the same content, or else a near-duplicate.
+
+        Args:
+            digest (str): The sha256 of the image.
+            hashed (tuple): The result of `image_hash`, or None if it could not be computed.
+
+        Returns:
+            tuple: (id, filename, blocked) of the image, or None.
+        """
+        row = self.connection.execute("SELECT id, filename, blocked FROM images WHERE sha256 = ?",
+                                      (digest,)).fetchone()
+        if row or hashed is None:
+            return row
+        value, mean, ratio, thumbnail = hashed
+        bands = _bands(value)
+        candidates = self.connection.execute(
+            " UNION ".join(f"SELECT id, filename, blocked, b0, b1, b2, b3, ratio, thumbnail FROM images "
+                           f"WHERE b{band} = ? AND mean BETWEEN ? AND ?" for band in range(4)),
+            [param for band in bands for param in (band, mean - MEAN_TOLERANCE, mean + MEAN_TOLERANCE)],
+        )
+        best = None
+        for image_id, filename, blocked, *other_bands, other_ratio, other_thumbnail in candidates:
+            if abs(other_ratio - ratio) > RATIO_TOLERANCE * max(ratio, other_ratio):
+                continue
+            other = other_bands[0] << 48 | other_bands[1] << 32 | other_bands[2] << 16 | other_bands[3]
+            if bin(value ^ other).count("1") > HASH_DISTANCE:
+                continue
+            distance = _thumbnail_distance(thumbnail, other_thumbnail)
+            if distance <= THUMBNAIL_TOLERANCE and (best is None or distance < best[0]):
+                best = (distance, image_id, filename, blocked)
+        return best[1:] if best else None
+
+    def add(self, image_bytes, ext, paper, digest=None):
+        """
+        Add an image found in a paper: the image is stored if no image of
+        the index looks the same, and the papers of the image are counted.
+
+        Args:
+            image_bytes (bytes): The image.
+            ext (str): The extension of the image file.
+            paper (str): The name of the paper.
+            digest (str): The sha256 of the image, if already computed.
+
+        Returns:
+            tuple: (path of the stored image, True if the image is blocklisted)
+        """
+        digest = digest or hashlib.sha256(image_bytes).hexdigest()
+        hashed = None
+        # The exact copies are found without computing the hash
+        if not self.connection.execute("SELECT 1 FROM images WHERE sha256 = ?", (digest,)).fetchone():
+            try:
+                hashed = image_hash(image_bytes)
+            except Exception:
+                # Not readable by PyMuPDF (e.g. JBIG2): only the exact copies are found
+                pass
+
+        # The lookup and the insertion are done under the lock of the database,
+        # so that two processes do not store the same image
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            found = self.find(digest, hashed)
+            if found:
+                image_id, filename, blocked = found
+            else:
+                filename = f"{digest[:32]}.{ext}"
+                path = os.path.join(self.directory, filename)
+                with open(path + ".part", "wb") as image_file:
+                    image_file.write(image_bytes)
+                os.replace(path + ".part", path)
+                bands, mean, ratio, thumbnail = (_bands(hashed[0]), *hashed[1:]) if hashed else ([None] * 4, None, None, None)
+                image_id = self.connection.execute(
+                    "INSERT INTO images (sha256, b0, b1, b2, b3, mean, ratio, thumbnail, filename) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (digest, *bands, mean, ratio, thumbnail, filename),
+                ).lastrowid
+                blocked = 0
+            if self.connection.execute("INSERT OR IGNORE INTO occurrences VALUES (?, ?)", (image_id, paper)).rowcount:
+                self.connection.execute("UPDATE images SET papers = papers + 1 WHERE id = ?", (image_id,))
+                papers = self.connection.execute("SELECT papers FROM images WHERE id = ?", (image_id,)).fetchone()[0]
+                if self.boilerplate_papers and papers >= self.boilerplate_papers and not blocked:
+                    self.connection.execute("UPDATE images SET blocked = 1 WHERE id = ?", (image_id,))
+                    blocked = 1
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return os.path.join(self.directory, filename), bool(blocked)
+
+    def stats(self):
+        """
+        Return the number of stored images, of blocklisted images, and of
+        occurrences (image, paper).
+        """
+        images, blocked = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(blocked), 0) FROM images").fetchone()
+        occurrences = self.connection.execute("SELECT COUNT(*) FROM occurrences").fetchone()[0]
+        return images, blocked, occurrences
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Corpus of JSON documents stored as sharded JSON Lines files, instead of
+one small JSON file per article.
+
+A corpus is a directory of shards (`part-00000.jsonl`, optionally
+compressed: `.jsonl.gz`, `.jsonl.zst`) holding one document per line,
+with its identifier in an "id" field (the file name the document would
+have in the per-file layout, i.e. the URL-encoded DOI). An index
+(`index.tsv`) gives the position of each document, so that a document
+can be read by its identifier without reading the shards.
+
+Compressed shards are written in blocks (independent gzip members or
+zstd frames): a document is read by decompressing its block only, and
+the shards remain valid .gz / .zst files that can be read as a whole
+(`zcat part-00000.jsonl.gz | jq`).
+
+The scripts reading JSON documents (bern2_analyse.py, json_to_pubtator.py,
+bern2jsontoPubtator.py) accept either a corpus or a directory of JSON
+files, see `iter_json_documents`.
+
+@author: amichaud
+"""
+
+import gzip
+import io
+import json
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_FILE = "index.tsv"
+SHARD_PREFIX = "part-"
+# Suffix of the shards for each compression
+COMPRESSIONS = {"none": ".jsonl", "gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+# Documents per shard
+SHARD_RECORDS = 10000
+# Size of the compressed blocks (uncompressed bytes): a random access decompresses one block
+BLOCK_BYTES = 256 * 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+# Characters of a DOI replaced in the file names (see extract_publi_combined.sh)
+DOI_REPLACEMENTS = (("<", "%3C"), (">", "%3E"), (":", "%3A"), (";", "%3B"), ("/", "%2F"))
+
+
+def doi_to_name(doi):
+    """
+    Return the file name (without extension) of the document of a DOI
+    (`10.1/abc` -> `10.1%2Fabc`).
+    """
+    for char, replacement in DOI_REPLACEMENTS:
+        doi = doi.replace(char, replacement)
+    return doi
+
+
+def _zstandard():
+    if zstandard is None:
+        raise ImportError("The zstandard package is needed for .zst corpora: pip install zstandard")
+    return zstandard
+
+
+def _compress(data, compression):
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    if compression == "zstd":
+        return _zstandard().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+
+def _decompress(data, compression):
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        return _zstandard().ZstdDecompressor().decompress(data)
+    return data
+
+
+def _shard_compression(filename):
+    for compression, suffix in COMPRESSIONS.items():
+        if compression != "none" and filename.endswith(suffix):
+            return compression
+    return "none"
+
+
+def is_corpus(path):
+    """
+    Return True if a path is a JSON Lines corpus (a directory with an index).
+    """
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+
+class CorpusWriter:
+    """
+    Writes the documents of a corpus, replacing the corpus of the
+    directory when closed. The shards are written as .part files until
+    then, so the previous corpus stays readable during the run. The
+    identifiers are prefixed with `prefix`, as the names of the files
+    of JsonDirectoryWriter.
+    """
+
+    def __init__(self, directory, compression="none", shard_records=SHARD_RECORDS, prefix=""):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}")
+        if compression == "zstd":
+            _zstandard()
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.compression = compression
+        self.shard_records = shard_records
+        self.prefix = prefix
+        # Uncompressed records are written one by one
+        self.block_bytes = BLOCK_BYTES if compression != "none" else 0
+        self.index = {}
+        self.ids = set()
+        self.shards = []
+        self.shard_file = None
+        self.shard_count = 0
+        self.block = []
+        self.block_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _open_shard(self):
+        filename = f"{SHARD_PREFIX}{len(self.shards):05d}{COMPRESSIONS[self.compression]}"
+        self.shards.append(filename)
+        self.shard_file = open(os.path.join(self.directory, filename + ".part"), "wb")
+        self.shard_count = 0
+
+    def _flush_block(self):
+        if not self.block:
+            return
+        data = b"".join(line for _, line in self.block)
+        block = _compress(data, self.compression)
+        block_offset = self.shard_file.tell()
+        self.shard_file.write(block)
+        record_offset = 0
+        for doc_id, line in self.block:
+            self.index[doc_id] = (self.shards[-1], block_offset, len(block), record_offset, len(line))
+            record_offset += len(line)
+        self.block = []
+        self.block_size = 0
+
+    def write(self, doc_id, document):
+        """
+        Add a document to the corpus.
+
+        Args:
+            doc_id (str): The identifier of the document (file name without extension).
+            document (dict or str): The document, or its JSON (an object).
+                It cannot have an "id" field, which holds the identifier.
+
+        Raises:
+            ValueError: If the identifier was already written, or the
+                document has an "id" field.
+        """
+        doc_id = self.prefix + doc_id
+        if doc_id in self.ids:
+            raise ValueError(f"Document written twice in the corpus: {doc_id}")
+        if isinstance(document, str):
+            document = json.loads(document)
+        if "id" in document:
+            raise ValueError(f'Document {doc_id} has an "id" field, reserved for the identifier in the corpus')
+        self.ids.add(doc_id)
+        # The identifier is the first field of the JSON object
+        line = (json.dumps({"id": doc_id, **document}, ensure_ascii=False) + "\n").encode("utf-8")
+
+        if self.shard_file is None or self.shard_count >= self.shard_records:
+            self._close_shard()
+            self._open_shard()
+        self.block.append((doc_id, line))
+        self.block_size += len(line)
+        self.shard_count += 1
+        if self.block_size >= self.block_bytes:
+            self._flush_block()
+
+    def _close_shard(self):
+        if self.shard_file is not None:
+            self._flush_block()
+            self.shard_file.close()
+            self.shard_file = None
+
+    def close(self):
+        """
+        Write the last shard and the index, and remove the shards of the
+        previous corpus.
+        """
+        self._close_shard()
+        for filename in self.shards:
+            path = os.path.join(self.directory, filename)
+            os.replace(path + ".part", path)
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        with open(index_path + ".part", "w", encoding="utf-8") as index_file:
+            index_file.write("id\tshard\tblock_offset\tblock_length\trecord_offset\trecord_length\n")
+            for doc_id, entry in self.index.items():
+                index_file.write("\t".join(map(str, (doc_id,) + entry)) + "\n")
+        os.replace(index_path + ".part", index_path)
+        for filename in os.listdir(self.directory):
+            if filename.startswith(SHARD_PREFIX) and filename not in self.shards:
+                os.remove(os.path.join(self.directory, filename))
+
+
+class CorpusReader:
+    """
+    Reads the documents of a corpus, in order or by identifier.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index = {}
+        with open(os.path.join(directory, INDEX_FILE), encoding="utf-8") as index_file:
+            next(index_file)
+            for line in index_file:
+                doc_id, shard, *offsets = line.rstrip("\n").split("\t")
+                self.index[doc_id] = (shard, *map(int, offsets))
+        self.shards = sorted({entry[0] for entry in self.index.values()})
+        self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for shard_file in self.files.values():
+            shard_file.close()
+        self.files = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def _key(self, key):
+        if key in self.index:
+            return key
+        name = doi_to_name(key)
+        return name if name in self.index else None
+
+    def __contains__(self, key):
+        return self._key(key) is not None
+
+    def ids(self):
+        """
+        Return the identifiers of the documents, in the order they were written.
+        """
+        return list(self.index)
+
+    def get(self, key):
+        """
+        Read a document by its identifier or its DOI.
+
+        Returns:
+            dict: The document, without its "id" field.
+        """
+        doc_id = self._key(key)
+        if doc_id is None:
+            raise KeyError(key)
+        shard, block_offset, block_length, record_offset, record_length = self.index[doc_id]
+        if shard not in self.files:
+            self.files[shard] = open(os.path.join(self.directory, shard), "rb")
+        shard_file = self.files[shard]
+        shard_file.seek(block_offset)
+        block = _decompress(shard_file.read(block_length), _shard_compression(shard))
+        document = json.loads(block[record_offset:record_offset + record_length])
+        document.pop("id", None)
+        return document
+
+    def __iter__(self):
+        """
+        Read the documents in order, one shard after the other.
+
+        Returns:
+            generator: (identifier, document) pairs.
+        """
+        for shard in self.shards:
+            path = os.path.join(self.directory, shard)
+            compression = _shard_compression(shard)
+            if compression == "gzip":
+                stream = gzip.open(path, "rb")
+            elif compression == "zstd":
+                stream = _zstandard().ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True,
+                                                                      closefd=True)
+            else:
+                stream = open(path, "rb")
+            with io.TextIOWrapper(stream, encoding="utf-8") as lines:
+                for line in lines:
+                    if line.strip():
+                        document = json.loads(line)
+                        yield document.pop("id"), document
+
+
+class JsonDirectoryWriter:
+    """
+    Writes documents as one JSON file per document (`<prefix><id>.json`),
+    with the interface of CorpusWriter.
+    """
+
+    def __init__(self, directory, prefix="", indent=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.indent = indent
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, doc_id, document):
+        # Written to a temporary file first: a failed write leaves no partial JSON
+        path = os.path.join(self.directory, f"{self.prefix}{doc_id}.json")
+        with open(path + ".part", "w", encoding="utf-8") as file:
+            if isinstance(document, str):
+                file.write(document)
+            else:
+                json.dump(document, file, ensure_ascii=False, indent=self.indent)
+        os.replace(path + ".part", path)
+
+    def close(self):
+        pass
+
+
+def open_writer(directory, output_format="files", compression="none", prefix="", indent=None):
+    """
+    Open the output of documents: a JSON Lines corpus ("jsonl", with
+    `<prefix><id>` identifiers) or a directory of JSON files ("files",
+    named `<prefix><id>.json`), so both give the same identifiers.
+    """
+    if output_format == "jsonl":
+        return CorpusWriter(directory, compression, prefix=prefix)
+    return JsonDirectoryWriter(directory, prefix, indent)
+
+
+def iter_json_documents(path):
+    """
+    Read the documents of a corpus, of a directory of JSON files, or of
+    a single JSON file.
+
+    Returns:
+        generator: (identifier, document) pairs; the identifier of a JSON
+            file is its name without the .json extension.
+    """
+    if is_corpus(path):
+        with CorpusReader(path) as reader:
+            yield from reader
+    elif os.path.isdir(path):
+        for filename in sorted(os.listdir(path)):
+            if filename.endswith(".json"):
+                with open(os.path.join(path, filename), encoding="utf-8") as file:
+                    document = json.load(file)
+                yield filename[:-len(".json")], document
+    else:
+        with open(path, encoding="utf-8") as file:
+            document = json.load(file)
+        yield os.path.splitext(os.path.basename(path))[0], document
@@ -11,9 +11,35 @@ import json
 import argparse
 import logging
 
+from json_corpus import is_corpus, iter_json_documents
+
 # Configure logging to provide information on the progress
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 
+def pubtator_content(data, file_base_name):
+    """
+    Build the PubTator text of a document.
+    
+    Args:
+        data (dict): The JSON document.
+        file_base_name (str): The identifier of the document.
+    
+    Returns:
+        str: The PubTator lines.
+    """
+    lines = []
+    # Check if 'abstract' key exists and add its content to the lines
+    if 'abstract' in data:
+        lines.append(f"{file_base_name}|t|{data['abstract']}")
+    else : 
+        lines.append(f"{file_base_name}|t|null")
+    # Check if 'body' key exists and add its content to the lines
+    if 'body' in data:
+        lines.append(f"{file_base_name}|a|{data['body']}")
+    else : 
+        lines.append(f"{file_base_name}|a|null")
+    return '\n'.join(lines)
+
 def process_json_file(input_file, output_dir):
     """
     Process a single JSON file and create a PubTator file.
@@ -31,34 +57,48 @@ def process_json_file(input_file, output_dir):
     with open(input_file, 'r', encoding='utf-8') as f:
         data = json.load(f)
 
-    lines = []
-    # Check if 'abstract' key exists and add its content to the lines
-    if 'abstract' in data:
-        lines.append(f"{file_base_name}|t|{data['abstract']}")
-    else : 
-        lines.append(f"{file_base_name}|t|null")
-    # Check if 'body' key exists and add its content to the lines
-    if 'body' in data:
-        lines.append(f"{file_base_name}|a|{data['body']}")
-    else : 
-        lines.append(f"{file_base_name}|a|null")
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(pubtator_content(data, file_base_name))
 
-    # If there are any lines to write, create the PubTator file
-    if lines:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(lines))
-    else:
-        logging.info(f"No 'abstract' or 'body' found in file: {input_file}")
+def process_corpus(input_path, output_dir=None, output_file=None):
+    """
+    Process the documents of a JSON Lines corpus (or of a directory of JSON
+    files), creating a PubTator file per document, or a single PubTator
+    file with all of them (separated by a blank line) if output_file is given.
+    
+    Args:
+        input_path (str): Path to the corpus or directory.
+        output_dir (str): Directory where the output PubTator files will be stored.
+        output_file (str): Single PubTator output file.
+    """
+    logging.info(f"Processing corpus: {input_path}")
+    single = open(output_file, 'w', encoding='utf-8') if output_file else None
+    try:
+        for count, (doc_id, data) in enumerate(iter_json_documents(input_path)):
+            content = pubtator_content(data, doc_id)
+            if single is not None:
+                single.write(("\n\n" if count else "") + content)
+            else:
+                with open(os.path.join(output_dir, f"{doc_id}.pubtator"), 'w', encoding='utf-8') as f:
+                    f.write(content)
+    finally:
+        if single is not None:
+            single.close()
+    logging.info(f"Finished processing corpus: {input_path}")
 
-def process_input(input_path, output_dir):
+def process_input(input_path, output_dir, output_file=None):
     """
-    Process the input path which can be a file or a directory of JSON files.
+    Process the input path which can be a file, a directory of JSON files
+    or a JSON Lines corpus.
     
     Args:
         input_path (str): Path to the input JSON file or directory containing JSON files.
         output_dir (str): Directory where the output PubTator files will be stored.
+        output_file (str): Single PubTator file for all the documents, if given.
     """
-    if os.path.isfile(input_path):
+    if is_corpus(input_path) or (output_file and os.path.isdir(input_path)):
+        process_corpus(input_path, output_dir, output_file)
+    elif os.path.isfile(input_path):
         # Process a single JSON file
         process_json_file(input_path, output_dir)
     elif os.path.isdir(input_path):
@@ -73,8 +113,9 @@ def process_input(input_path, output_dir):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process JSON files to PubTator format.')
-    parser.add_argument('input_path', type=str, help='Input file or directory containing JSON files.')
+    parser.add_argument('input_path', type=str, help='Input file, directory containing JSON files, or JSON Lines corpus.')
     parser.add_argument('output_dir', type=str, help='Output directory to store PubTator files.')
+    parser.add_argument('--output-file', type=str, help='Write all the documents to this single PubTator file instead.')
 
     args = parser.parse_args()
 
@@ -84,5 +125,5 @@ if __name__ == "__main__":
         logging.info(f"Created output directory: {args.output_dir}")
 
     # Process the input path
-    process_input(args.input_path, args.output_dir)
+    process_input(args.input_path, args.output_dir, args.output_file)
 
@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the scripts that query the NCBI E-utilities
+(PMIDtoDOI.py, extract_doi_from_json_aniseed.py, extract_publi_PMC.py).
+
+@author: amichaud
+"""
+
+import asyncio
+import os
+import random
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from id_cache import normalize
+
+ESUMMARY_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
+IDCONV_URL = "https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/"
+# Number of PMIDs sent in a single esummary request
+DEFAULT_BATCH_SIZE = 200
+# Maximum number of ids accepted by idconv in a single request
+IDCONV_BATCH_SIZE = 200
+# NCBI allows 3 requests per second without API key, 10 with one
+RATE_WITHOUT_KEY = 3
+RATE_WITH_KEY = 10
+# Number of requests allowed in flight at the same time
+DEFAULT_CONCURRENCY = 10
+# Timeout of a single request (in seconds)
+TIMEOUT = 30
+# Retries on 429 / 5xx replies and connection errors
+MAX_RETRIES = 5
+BACKOFF = 1.0
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Errors of a batch that still fails after its retries (HTTP error, malformed reply)
+BATCH_ERRORS = (requests.RequestException, ValueError, ET.ParseError)
+# Error log shared by the PMID -> DOI scripts
+ERROR_FILE = "logs/errors_extract_doi_from_pmid.txt"
+
+
+def chunks(items, size):
+    """
+    Split a list into consecutive chunks.
+
+    Args:
+        items (list): The items to split.
+        size (int): The maximum size of a chunk.
+
+    Returns:
+        generator: Lists of at most `size` items.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class TokenBucket:
+    """
+    Token bucket limiting the number of requests started per second.
+    Tokens are refilled continuously up to `capacity`. With the default
+    capacity of 1 there is no burst: the requests start at least 1/rate
+    seconds apart, so that no second holds more than `rate` of them.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Wait until a token is available and consume it.
+        """
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class NcbiClient:
+    """
+    Asynchronous client for the NCBI web services.
+
+    Requests run on a pooled keep-alive session in worker threads. At most
+    `concurrency` requests are in flight and their start rate is limited by a
+    token bucket (3 req/s without API key, 10 req/s with one). 429 and 5xx
+    replies are retried with exponential backoff.
+    """
+
+    def __init__(self, api_key=None, concurrency=DEFAULT_CONCURRENCY, rate=None,
+                 max_retries=MAX_RETRIES, timeout=TIMEOUT):
+        self.api_key = api_key or os.environ.get("NCBI_API_KEY")
+        if rate is None:
+            rate = RATE_WITH_KEY if self.api_key else RATE_WITHOUT_KEY
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        # Created lazily so that they belong to the running event loop
+        self.loop = None
+        self.semaphore = None
+        self.bucket = None
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _send(self, method, url, params, data):
+        return self.session.request(method, url, params=params, data=data, timeout=self.timeout)
+
+    async def request(self, method, url, params=None, data=None):
+        """
+        Send a request, waiting for the rate limiter and retrying on failure.
+
+        Args:
+            method (str): The HTTP method ("GET" or "POST").
+            url (str): The URL to query.
+            params (dict): The query string parameters.
+            data (dict): The form parameters (POST).
+
+        Returns:
+            requests.Response: The successful response.
+
+        Raises:
+            requests.RequestException: If every attempt failed.
+        """
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+            self.bucket = TokenBucket(self.rate)
+        if self.api_key:
+            if data is not None:
+                data = dict(data, api_key=self.api_key)
+            else:
+                params = dict(params or {}, api_key=self.api_key)
+
+        attempt = 0
+        while True:
+            async with self.semaphore:
+                await self.bucket.acquire()
+                try:
+                    response = await loop.run_in_executor(self.executor, self._send, method, url, params, data)
+                    error = None
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    response, error = None, e
+
+            if response is not None and response.status_code not in RETRY_STATUS:
+                response.raise_for_status()
+                return response
+            if attempt >= self.max_retries:
+                if error is not None:
+                    raise error
+                response.raise_for_status()
+
+            delay = BACKOFF * 2 ** attempt + random.uniform(0, BACKOFF)
+            retry_after = response.headers.get("Retry-After") if response is not None else None
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, url, params=None):
+        return await self.request("GET", url, params=params)
+
+    async def post(self, url, data=None):
+        return await self.request("POST", url, data=data)
+
+
+def identifier_type(identifier):
+    """
+    Guess the type of an article identifier.
+
+    Args:
+        identifier (str): A PMID, DOI or PMCID.
+
+    Returns:
+        str: 'doi', 'pmcid' or 'pmid'.
+    """
+    if identifier.lower().startswith("10."):
+        return "doi"
+    if identifier.upper().startswith("PMC"):
+        return "pmcid"
+    return "pmid"
+
+
+def doi_from_summary(summary):
+    """
+    Extract the DOI from an esummary record.
+
+    Args:
+        summary (dict): The esummary record of one PMID.
+
+    Returns:
+        str: The DOI if present, None otherwise.
+    """
+    article_ids = summary.get("articleids", [])
+    return next((article_id["value"] for article_id in article_ids if article_id["idtype"] == "doi"), None)
+
+
+async def fetch_dois(client, batch):
+    """
+    Retrieve the DOIs of one batch of PMIDs with a single esummary request.
+
+    Args:
+        client (NcbiClient): The client sending the request.
+        batch (list): The PMIDs of the batch.
+
+    Returns:
+        dict: PMID -> DOI (None when the PMID has no DOI, or is reported
+        as an error by esummary). The PMIDs missing from the reply are left
+        out, so that they are neither cached nor reported as without DOI.
+
+    Raises:
+        ValueError: If the reply has no result (e.g. an error body sent with status 200).
+    """
+    params = {
+        "db": "pubmed",
+        "id": ",".join(batch),
+        "retmode": "json"
+    }
+    # POST so that long id lists are not limited by the URL length
+    response = await client.post(ESUMMARY_URL, data=params)
+    data = response.json()
+    if "result" not in data:
+        raise ValueError(data.get("error") or "esummary reply without result")
+    result = data["result"]
+    dois = {}
+    for pmid in batch:
+        summary = result.get(pmid)
+        if summary is not None:
+            dois[pmid] = None if "error" in summary else doi_from_summary(summary)
+    return dois
+
+
+def batch_failed(batch, error, failed):
+    """
+    Report a batch that could not be resolved. The other batches go on.
+
+    Args:
+        batch (list): The identifiers of the batch.
+        error (Exception): The error raised by the batch.
+        failed (dict): Receives identifier -> error message, or None.
+    """
+    message = " ".join(f"{type(error).__name__}: {error}".split())
+    print(f"Error: request failed for {len(batch)} identifiers ({message})")
+    if failed is not None:
+        failed.update(dict.fromkeys(batch, message))
+
+
+async def resolve_dois(client, pmids, batch_size=DEFAULT_BATCH_SIZE, cache=None, failed=None):
+    """
+    Retrieve the DOIs of a list of PMIDs, sending the batches concurrently.
+    PMIDs found in the cache are not sent to NCBI.
+
+    Args:
+        client (NcbiClient): The client sending the requests.
+        pmids (list): The PMIDs to resolve.
+        batch_size (int): The number of PMIDs sent per request.
+        cache (IdCache): The identifier cache, or None.
+        failed (dict): Receives PMID -> error message for the PMIDs of
+            the batches that failed after their retries, or None.
+
+    Returns:
+        dict: PMID -> DOI (None when the PMID has no DOI). The PMIDs of
+        the failed batches are left out.
+    """
+    pmids = list(dict.fromkeys(pmid for pmid in pmids if pmid))
+    dois = cache.get_many("pmid", "doi", pmids) if cache else {}
+    missing = [pmid for pmid in pmids if pmid not in dois]
+
+    async def fetch_and_store(batch):
+        try:
+            result = await fetch_dois(client, batch)
+        except BATCH_ERRORS as e:
+            batch_failed(batch, e, failed)
+            return {}
+        # Stored batch by batch so that an interrupted run keeps its progress
+        if cache:
+            cache.put_many("pmid", "doi", result)
+            cache.put_many("doi", "pmid", {doi: pmid for pmid, doi in result.items() if doi})
+        return result
+
+    results = await asyncio.gather(*(fetch_and_store(batch) for batch in chunks(missing, batch_size)))
+    for result in results:
+        dois.update(result)
+    return dois
+
+
+async def fetch_pmcids(client, batch, idtype):
+    """
+    Convert one batch of PMIDs or DOIs to PMCIDs with a single idconv request.
+
+    Args:
+        client (NcbiClient): The client sending the request.
+        batch (list): The identifiers of the batch, all of the same type.
+        idtype (str): The type of the identifiers ('pmid' or 'doi').
+
+    Returns:
+        tuple: (identifier -> PMCID (None when the article is not in PMC),
+        list of the record attributes returned by idconv)
+    """
+    params = {"ids": ",".join(batch), "idtype": idtype, "format": "xml"}
+    response = await client.get(IDCONV_URL, params=params)
+    root = ET.fromstring(response.content)
+
+    requested = {normalize(idtype, identifier): identifier for identifier in batch}
+    pmcids = dict.fromkeys(batch)
+    records = []
+    for record in root.iter("record"):
+        key = record.attrib.get("requested-id") or record.attrib.get(idtype, "")
+        identifier = requested.get(normalize(idtype, key))
+        if identifier is None:
+            continue
+        pmcids[identifier] = record.attrib.get("pmcid")
+        records.append(record.attrib)
+    return pmcids, records
+
+
+def store_idconv_records(cache, records):
+    """
+    Store every mapping found in idconv records in the identifier cache.
+
+    Args:
+        cache (IdCache): The identifier cache.
+        records (list): The record attributes returned by idconv.
+    """
+    mappings = {}
+    for record in records:
+        ids = {kind: record.get(kind) for kind in ("pmid", "doi", "pmcid")}
+        for source, source_id in ids.items():
+            for target, target_id in ids.items():
+                if source != target and source_id and target_id:
+                    mappings.setdefault((source, target), {})[source_id] = target_id
+    for (source, target), mapping in mappings.items():
+        cache.put_many(source, target, mapping)
+
+
+async def resolve_pmcids(client, identifiers, cache=None, batch_size=IDCONV_BATCH_SIZE, failed=None):
+    """
+    Convert a list of PMIDs / DOIs to PMCIDs with batched idconv requests
+    (one request per `batch_size` identifiers of the same type), sending
+    the batches concurrently. Identifiers found in the cache are not sent
+    to NCBI, and PMCIDs are returned as they are.
+
+    Args:
+        client (NcbiClient): The client sending the requests.
+        identifiers (list): The PMIDs, DOIs or PMCIDs to convert.
+        cache (IdCache): The identifier cache, or None.
+        batch_size (int): The number of identifiers sent per request.
+        failed (dict): Receives identifier -> error message for the
+            identifiers of the batches that failed after their retries, or None.
+
+    Returns:
+        dict: identifier -> PMCID (None when the article is not in PMC).
+        The identifiers of the failed batches are left out.
+    """
+    identifiers = list(dict.fromkeys(identifier for identifier in identifiers if identifier))
+    pmcids = {identifier: identifier.upper() for identifier in identifiers if identifier_type(identifier) == "pmcid"}
+    batches = []
+    for kind in ("pmid", "doi"):
+        of_kind = [identifier for identifier in identifiers if identifier_type(identifier) == kind]
+        if cache:
+            pmcids.update(cache.get_many(kind, "pmcid", of_kind))
+        missing = [identifier for identifier in of_kind if identifier not in pmcids]
+        batches.extend((batch, kind) for batch in chunks(missing, batch_size))
+
+    async def fetch_and_store(batch, kind):
+        try:
+            result, records = await fetch_pmcids(client, batch, kind)
+        except BATCH_ERRORS as e:
+            batch_failed(batch, e, failed)
+            return {}
+        if cache:
+            cache.put_many(kind, "pmcid", result)
+            store_idconv_records(cache, records)
+        return result
+
+    results = await asyncio.gather(*(fetch_and_store(batch, kind) for batch, kind in batches))
+    for result in results:
+        pmcids.update(result)
+    return pmcids
+
+
+def run_with_client(coroutine_function, *args, api_key=None, concurrency=DEFAULT_CONCURRENCY, **kwargs):
+    """
+    Run a coroutine function taking an NcbiClient as first argument
+    from synchronous code.
+
+    Args:
+        coroutine_function (callable): The coroutine function to run.
+        api_key (str): The NCBI API key (defaults to $NCBI_API_KEY).
+        concurrency (int): The maximum number of requests in flight.
+
+    Returns:
+        The result of the coroutine.
+    """
+    with NcbiClient(api_key=api_key, concurrency=concurrency) as client:
+        return asyncio.run(coroutine_function(client, *args, **kwargs))
+
+
+def get_dois_from_pmids(pmids, batch_size=DEFAULT_BATCH_SIZE, api_key=None, concurrency=DEFAULT_CONCURRENCY,
+                        cache=None, failed=None):
+    """
+    Retrieve the DOIs of a list of PMIDs with batched esummary requests.
+
+    Args:
+        pmids (list): The PMIDs to resolve.
+        batch_size (int): The number of PMIDs sent per request.
+        api_key (str): The NCBI API key (defaults to $NCBI_API_KEY).
+        concurrency (int): The maximum number of requests in flight.
+        cache (IdCache): The identifier cache, or None.
+        failed (dict): Receives PMID -> error message for the PMIDs whose
+            request failed, or None.
+
+    Returns:
+        dict: PMID -> DOI (None when the PMID has no DOI).
+    """
+    return run_with_client(resolve_dois, pmids, batch_size, cache, failed,
+                           api_key=api_key, concurrency=concurrency)
+
+
+def get_doi_from_pmid(pmid):
+    """
+    Retrieve the DOI of a single PMID.
+
+    Args:
+        pmid (str): The PMID to resolve.
+
+    Returns:
+        str: The DOI if found, None otherwise.
+    """
+    return get_dois_from_pmids([pmid]).get(pmid)
+
+
+def write_dois(pmids, output_file, batch_size=DEFAULT_BATCH_SIZE, error_file=ERROR_FILE,
+               api_key=None, concurrency=DEFAULT_CONCURRENCY, cache=None):
+    """
+    Resolve PMIDs to DOIs and write them to a text file, one DOI per line.
+    PMIDs without DOI, and those whose request failed, are listed in the
+    error file.
+
+    Args:
+        pmids (list): The PMIDs to resolve.
+        output_file (str): The text file receiving the DOIs.
+        batch_size (int): The number of PMIDs sent per request.
+        error_file (str): The text file listing the PMIDs without DOI.
+        api_key (str): The NCBI API key (defaults to $NCBI_API_KEY).
+        concurrency (int): The maximum number of requests in flight.
+        cache (IdCache): The identifier cache, or None.
+    """
+    failed = {}
+    dois = get_dois_from_pmids(pmids, batch_size, api_key=api_key, concurrency=concurrency, cache=cache,
+                               failed=failed)
+    erreurs = []
+
+    with open(output_file, "w") as f:
+        for pmid in pmids:
+            if not pmid:
+                continue
+            doi = dois.get(pmid)
+            if doi:
+                f.write(doi + "\n")
+            elif pmid in failed:
+                erreurs.append(f"Request failed for PMID {pmid}: {failed[pmid]}")
+            else:
+                erreurs.append(f"DOI not found for PMID {pmid}")
+
+    if erreurs:
+        os.makedirs(os.path.dirname(error_file) or ".", exist_ok=True)
+        with open(error_file, "w") as f_err:
+            for erreur in erreurs:
+                f_err.write(erreur + "\n")
+
+
+def add_client_arguments(parser):
+    """
+    Add the NCBI client options to an argument parser.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser to extend.
+    """
+    parser.add_argument("--api-key", default=None,
+                        help="NCBI API key (default: $NCBI_API_KEY), raises the limit from 3 to 10 requests per second")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Maximum number of NCBI requests in flight")
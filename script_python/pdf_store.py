@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Validated, content-addressed storage of the PDFs in data_pdf.
+
+Before being stored, a file must look like a complete PDF: `%PDF-`
+header, `%%EOF` marker and at least one page when the page count can be
+read. HTML error pages saved as .pdf are rejected, so they never reach
+Grobid.
+
+Each distinct PDF is stored once in `<data_pdf>/.store/<sha256[:2]>/<sha256>.pdf`
+and the usual DOI-named files (`data_pdf/<DOI>.pdf`) are hard links to it,
+so the same PDF fetched under two DOI spellings or by two fetchers uses
+the disk only once. Where the DOI-named files cannot be hard links (e.g.
+.store on another file system), a store would keep a second copy of
+every PDF: the PDFs are then saved as plain files, without the store.
+
+Usage:
+    python script_python/pdf_store.py add <files or directories> [--dest data_pdf] [--move] [--keep-existing]
+    python script_python/pdf_store.py gc [--dest data_pdf]
+
+@author: amichaud
+"""
+
+import argparse
+import hashlib
+import mmap
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+# Directory of the stored objects, inside the PDF directory
+STORE_DIRNAME = ".store"
+# Number of bytes searched for the header and the EOF marker
+HEADER_WINDOW = 1024
+TRAILER_WINDOW = 4096
+
+PAGES_COUNT_PATTERN = re.compile(rb'/Type\s*/Pages\b[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages\b')
+PAGE_PATTERN = re.compile(rb'/Type\s*/Page\b(?!s)')
+
+
+def count_pages(data):
+    """
+    Read the page count of a PDF without parsing it.
+
+    The /Count of the page tree root is used when the page tree is stored
+    in clear, otherwise the /Type /Page objects are counted. Both are
+    hidden when the objects are compressed in object streams.
+
+    Args:
+        data (bytes or mmap): The content of the PDF.
+
+    Returns:
+        int: The number of pages, or None if it cannot be read cheaply.
+    """
+    counts = [int(a or b) for a, b in PAGES_COUNT_PATTERN.findall(data)]
+    if counts:
+        return max(counts)
+    pages = len(PAGE_PATTERN.findall(data))
+    return pages or None
+
+
+def validate_pdf(path):
+    """
+    Check that a file looks like a complete PDF.
+
+    Args:
+        path (str): The file to check.
+
+    Returns:
+        tuple: (valid, reason of the rejection or None, page count or None)
+    """
+    if not os.path.isfile(path):
+        return False, "Missing file", None
+    size = os.path.getsize(path)
+    if size == 0:
+        return False, "Empty file", None
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data.find(b"%PDF-", 0, HEADER_WINDOW) < 0:
+                head = data[:64].lstrip().lower()
+                if head.startswith((b"<!doctype html", b"<html")):
+                    return False, "HTML page instead of a PDF", None
+                return False, "Missing %PDF- header", None
+            if data.find(b"%%EOF", max(0, size - TRAILER_WINDOW)) < 0:
+                return False, "Missing %%EOF marker (truncated file)", None
+            pages = count_pages(data)
+    if pages == 0:
+        return False, "PDF without pages", 0
+    return True, None, pages
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    """
+    Compute the sha256 of a file.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(chunk_size), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class PdfStore:
+    """
+    Content-addressed PDF storage of a PDF directory.
+    """
+
+    def __init__(self, pdf_dir="data_pdf"):
+        self.pdf_dir = pdf_dir
+        self.store_dir = os.path.join(pdf_dir, STORE_DIRNAME)
+        # Directory -> whether it can hold hard links to the stored PDFs
+        self.hard_links = {}
+
+    def object_path(self, sha256):
+        return os.path.join(self.store_dir, sha256[:2], f"{sha256}.pdf")
+
+    def supports_hard_links(self, directory):
+        """
+        Tell whether a directory can hold hard links to the stored PDFs
+        (not on another file system, nor on file systems without hard links).
+        """
+        directory = os.path.abspath(directory)
+        if directory not in self.hard_links:
+            os.makedirs(self.store_dir, exist_ok=True)
+            os.makedirs(directory, exist_ok=True)
+            fd, probe_path = tempfile.mkstemp(suffix=".probe", dir=self.store_dir)
+            os.close(fd)
+            link_path = os.path.join(directory, os.path.basename(probe_path))
+            try:
+                os.link(probe_path, link_path)
+                os.remove(link_path)
+                self.hard_links[directory] = True
+            except OSError:
+                print(f"Warning: {directory} cannot hold hard links to {self.store_dir}: "
+                      f"the PDFs are saved there as plain files, without deduplication")
+                self.hard_links[directory] = False
+            finally:
+                os.remove(probe_path)
+        return self.hard_links[directory]
+
+    def add(self, src_path, dest_path, sha256=None, move=True, keep_existing=False):
+        """
+        Validate a PDF, store it once by content and link `dest_path` to it.
+
+        Args:
+            src_path (str): The PDF to store.
+            dest_path (str): The DOI-named path that must point to the PDF.
+            sha256 (str): The sha256 of the file if already known.
+            move (bool): Consume `src_path` (it is removed once stored).
+            keep_existing (bool): Leave `dest_path` untouched if it already exists.
+
+        Returns:
+            tuple: (stored, reason of the rejection or None)
+        """
+        valid, reason, _ = validate_pdf(src_path)
+        if not valid:
+            return False, reason
+
+        if not self.supports_hard_links(os.path.dirname(dest_path) or "."):
+            # The store would be a second copy of the PDF: it is saved in place
+            if os.path.abspath(src_path) == os.path.abspath(dest_path):
+                return True, None
+            if os.path.exists(dest_path) and keep_existing:
+                if move:
+                    os.remove(src_path)
+                return True, None
+            tmp_path = dest_path + ".link"
+            if move:
+                shutil.move(src_path, tmp_path)
+            else:
+                shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, dest_path)
+            return True, None
+
+        sha256 = sha256 or sha256_file(src_path)
+        object_path = self.object_path(sha256)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        if not os.path.exists(object_path):
+            link_or_copy(src_path, object_path)
+
+        if os.path.exists(dest_path) and keep_existing:
+            pass
+        elif not (os.path.exists(dest_path) and os.path.samefile(dest_path, object_path)):
+            os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+            tmp_path = dest_path + ".link"
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+            link_or_copy(object_path, tmp_path)
+            os.replace(tmp_path, dest_path)
+
+        if os.path.exists(src_path) and os.path.abspath(src_path) != os.path.abspath(object_path):
+            if move:
+                # The source may already be a link to the stored PDF
+                os.remove(src_path)
+            elif not os.path.samefile(src_path, object_path):
+                # Keep the source file, but as one more link to the stored PDF
+                tmp_path = src_path + ".link"
+                if os.path.lexists(tmp_path):
+                    os.remove(tmp_path)
+                link_or_copy(object_path, tmp_path)
+                os.replace(tmp_path, src_path)
+        return True, None
+
+    def collect_garbage(self):
+        """
+        Remove the stored objects no longer linked from any file.
+
+        Returns:
+            int: The number of removed objects.
+        """
+        removed = 0
+        for root, _, files in os.walk(self.store_dir):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if os.stat(path).st_nlink == 1:
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+
+def link_or_copy(src_path, dest_path):
+    """
+    Hard link a file, or copy it when hard links are not available
+    (e.g. a source file on another file system, copied into the store).
+    """
+    try:
+        os.link(src_path, dest_path)
+    except FileExistsError:
+        # Stored meanwhile by another worker: same content
+        pass
+    except OSError:
+        shutil.copyfile(src_path, dest_path)
+
+
+def iter_pdf_files(paths):
+    """
+    List the PDF files given directly or contained in directories.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for filename in sorted(os.listdir(path)):
+                if filename.endswith(".pdf"):
+                    yield os.path.join(path, filename)
+        else:
+            yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate and store PDFs once by content in data_pdf.")
+    parser.add_argument("command", choices=["add", "gc"],
+                        help="add: store PDFs and link them into the PDF directory; gc: remove unused stored PDFs")
+    parser.add_argument("paths", nargs="*", help="PDF files or directories to add")
+    parser.add_argument("--dest", default="data_pdf", help="PDF directory (default: data_pdf)")
+    parser.add_argument("--move", action="store_true", help="Remove the source files once stored")
+    parser.add_argument("--keep-existing", action="store_true",
+                        help="Do not replace the files already present in the PDF directory")
+    args = parser.parse_args()
+
+    store = PdfStore(args.dest)
+    if args.command == "gc":
+        print(f"{store.collect_garbage()} unused PDFs removed from {store.store_dir}")
+        return
+
+    invalid = 0
+    for pdf_path in iter_pdf_files(args.paths):
+        dest_path = os.path.join(args.dest, os.path.basename(pdf_path))
+        stored, reason = store.add(pdf_path, dest_path, move=args.move,
+                                   keep_existing=args.keep_existing)
+        if not stored:
+            invalid += 1
+            print(f"err: {pdf_path}: {reason}")
+    if invalid:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Process pool of the file conversions (grobid_parsing.py,
+extract_figure.py), robust to the crash of a worker process.
+
+A file can crash the process reading it (e.g. a segmentation fault in
+lxml or MuPDF), which breaks the whole pool. The results already
+received are kept, the first unfinished file is processed again alone
+in a process of its own, and the pool is restarted for the other files:
+a crash only costs the file that caused it.
+
+@author: amichaud
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+
+
+def _apply(function, task):
+    return function(*task)
+
+
+def run_isolated(function, task, on_crash):
+    """
+    Call `function(*task)` in a process of its own.
+
+    Args:
+        function (callable): A function of a module, so that it can be sent to the process.
+        task (tuple): The arguments of the call.
+        on_crash (callable): Called with the arguments of the task if the
+            process crashed; its return value is the result of the task.
+
+    Returns:
+        The result of the call.
+    """
+    try:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            return executor.submit(function, *task).result()
+    except BrokenProcessPool:
+        return on_crash(*task)
+
+
+def run_tasks(function, tasks, workers, on_crash, chunksize=1):
+    """
+    Call `function(*task)` for each task, in a pool of `workers` processes
+    if more than one, else in this process. When a worker process dies,
+    the first unfinished task is run alone (see `run_isolated`), then the
+    pool is restarted for the remaining tasks.
+
+    Args:
+        function (callable): A function of a module, so that it can be sent to the processes.
+        tasks (iterable): The arguments of each call.
+        workers (int): Number of worker processes.
+        on_crash (callable): Gives the result of a task whose process crashed.
+        chunksize (int): Number of tasks sent at once to a worker process.
+
+    Returns:
+        generator: The results, in the order of the tasks.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield function(*task)
+        return
+
+    remaining = list(tasks)
+    while remaining:
+        done = 0
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for result in executor.map(_apply, repeat(function), remaining, chunksize=chunksize):
+                    done += 1
+                    yield result
+            remaining = []
+        except BrokenProcessPool:
+            remaining = remaining[done:]
+            yield run_isolated(function, remaining.pop(0), on_crash)
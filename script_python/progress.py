@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Logging and progress metrics of the TEI stage
+(grobid_analyse.py, grobid_parsing.py).
+
+Messages are logged with levels instead of being printed. During a run,
+a throughput line (files/s, MB/s, errors) is logged periodically, and a
+summary of the run is written as JSON at the end. The content of the
+documents is only logged in debug mode (`--debug`).
+
+@author: amichaud
+"""
+
+import json
+import logging
+import os
+import time
+
+# Interval between two throughput lines (in seconds)
+PROGRESS_INTERVAL = 10
+
+
+def add_logging_arguments(parser, summary_file):
+    """
+    Add the logging and metrics options to an argument parser.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser to extend.
+        summary_file (str): Default path of the summary JSON.
+    """
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="Minimum level of the logged messages (default: INFO)")
+    parser.add_argument("--debug", action="store_true",
+                        help="Log every message and the full output of each document")
+    parser.add_argument("--progress-interval", type=float, default=PROGRESS_INTERVAL,
+                        help=f"Seconds between two throughput lines (default: {PROGRESS_INTERVAL})")
+    parser.add_argument("--summary-file", default=summary_file,
+                        help=f"JSON summary of the run (default: {summary_file})")
+
+
+def setup_logging(args):
+    """
+    Configure the logging from the command line options.
+    """
+    level = logging.DEBUG if args.debug else getattr(logging, args.log_level)
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(message)s", datefmt="%H:%M:%S")
+
+
+class ProgressMeter:
+    """
+    Counts the processed files and logs the throughput periodically.
+    """
+
+    def __init__(self, stage, total=None, interval=PROGRESS_INTERVAL, logger=None):
+        self.stage = stage
+        self.total = total
+        self.interval = interval
+        self.logger = logger or logging.getLogger(stage)
+        self.files = 0
+        self.errors = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+    def update(self, nbytes=0, error=False):
+        """
+        Count a processed file, and log the throughput if it is time to.
+
+        Args:
+            nbytes (int): The size of the processed file.
+            error (bool): The file could not be processed.
+        """
+        self.files += 1
+        self.bytes += nbytes or 0
+        if error:
+            self.errors += 1
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.logger.info(self.line())
+
+    def line(self):
+        """
+        Return the throughput line of the run so far.
+        """
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        done = f"{self.files}/{self.total}" if self.total is not None else str(self.files)
+        return (f"{self.stage}: {done} files, {self.files / elapsed:.1f} files/s, "
+                f"{self.bytes / elapsed / 1e6:.2f} MB/s, {self.errors} errors")
+
+    def summary(self, **extra):
+        """
+        Return the summary of the run.
+
+        Args:
+            **extra: Additional fields of the summary.
+
+        Returns:
+            dict: The summary.
+        """
+        elapsed = time.monotonic() - self.started
+        summary = {
+            "stage": self.stage,
+            "files": self.files,
+            "succeeded": self.files - self.errors,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "seconds": round(elapsed, 3),
+            "files_per_second": round(self.files / elapsed, 2) if elapsed else None,
+            "mb_per_second": round(self.bytes / elapsed / 1e6, 3) if elapsed else None,
+        }
+        summary.update(extra)
+        return summary
+
+    def write_summary(self, path, **extra):
+        """
+        Log the final throughput line and write the summary JSON.
+
+        Returns:
+            dict: The summary.
+        """
+        summary = self.summary(**extra)
+        self.logger.info(self.line())
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w", encoding="utf-8") as summary_file:
+                json.dump(summary, summary_file, indent=2)
+            self.logger.info(f"Summary written to {path}")
+        return summary
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reading and writing of the TEI XML files produced by Grobid, plain or
+compressed (`.tei.xml`, `.tei.xml.gz`, `.tei.xml.zst`).
+
+The compression is given by the file name, and the files are
+decompressed as a stream when read, so every step of the pipeline
+(grobid_parsing.py, extract_figure.py) reads the three forms the same
+way. zstd needs the optional `zstandard` package (`pip install zstandard`).
+
+@author: amichaud
+"""
+
+import gzip
+import io
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TEI_SUFFIX = ".tei.xml"
+# Suffix added to TEI_SUFFIX for each compression
+COMPRESSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+TEI_SUFFIXES = tuple(TEI_SUFFIX + suffix for suffix in COMPRESSIONS.values())
+# Compression levels: gzip is kept fast, zstd 10 is close to xz for XML
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+# Typical compression ratio of a TEI file with zstd, when its size is unknown
+ZSTD_RATIO = 8
+
+
+def tei_stem(filename):
+    """
+    Return the name of a TEI file without its TEI suffix
+    (`10.1%2Fabc.tei.xml.gz` -> `10.1%2Fabc`), or None if it is not a TEI file.
+    """
+    for suffix in TEI_SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return None
+
+
+def tei_filename(stem, compression="none"):
+    """
+    Return the name of the TEI file of a document for a compression.
+    """
+    return stem + TEI_SUFFIX + COMPRESSIONS[compression]
+
+
+def find_tei(directory, stem):
+    """
+    Return the path of the TEI file of a document, whatever its
+    compression, or None if there is none.
+    """
+    for suffix in TEI_SUFFIXES:
+        path = os.path.join(directory, stem + suffix)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def list_tei(directory):
+    """
+    List the TEI files of a directory.
+
+    Returns:
+        list: (stem, path) pairs, sorted by stem.
+    """
+    files = []
+    for filename in os.listdir(directory):
+        stem = tei_stem(filename)
+        if stem is not None:
+            files.append((stem, os.path.join(directory, filename)))
+    return sorted(files)
+
+
+def _zstandard():
+    if zstandard is None:
+        raise ImportError("The zstandard package is needed for .zst TEI files: pip install zstandard")
+    return zstandard
+
+
+def compression_of(path):
+    """
+    Return the compression of a file from its name ("none", "gzip" or "zstd").
+    """
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return "none"
+
+
+def open_tei(path, mode="rb", compression=None):
+    """
+    Open a TEI file, compressed or not, as a stream.
+
+    Args:
+        path (str): The TEI file.
+        mode (str): "rb", "wb", "rt" or "wt" (text is read and written in UTF-8).
+        compression (str): "none", "gzip" or "zstd", given by the name of the file if None.
+
+    Returns:
+        file object: The (de)compressing stream.
+    """
+    compression = compression or compression_of(path)
+    binary_mode = mode.replace("t", "").replace("b", "") + "b"
+    if compression == "gzip":
+        stream = gzip.open(path, binary_mode, compresslevel=GZIP_LEVEL)
+    elif compression == "zstd":
+        zstd = _zstandard()
+        if binary_mode == "rb":
+            stream = zstd.open(path, binary_mode, dctx=zstd.ZstdDecompressor())
+        else:
+            stream = zstd.open(path, binary_mode, cctx=zstd.ZstdCompressor(level=ZSTD_LEVEL))
+    else:
+        stream = open(path, binary_mode)
+    if "t" not in mode:
+        return stream
+    return io.TextIOWrapper(stream, encoding="utf-8")
+
+
+def tei_size(path):
+    """
+    Return the size of the XML content of a TEI file, without
+    decompressing it: the size given by the gzip trailer or the zstd
+    frame header, or an estimate from the compressed size if the frame
+    does not give it.
+    """
+    size = os.path.getsize(path)
+    compression = compression_of(path)
+    if compression == "gzip" and size >= 4:
+        with open(path, "rb") as tei_file:
+            tei_file.seek(-4, os.SEEK_END)
+            # Size modulo 2**32 (of the last member)
+            return max(int.from_bytes(tei_file.read(4), "little"), size)
+    if compression == "zstd":
+        with open(path, "rb") as tei_file:
+            header = tei_file.read(18)
+        content_size = -1
+        if zstandard is not None:
+            try:
+                content_size = zstandard.frame_content_size(header)
+            except zstandard.ZstdError:
+                pass
+        return content_size if content_size >= 0 else size * ZSTD_RATIO
+    return size
+
+
+def read_tei(path):
+    """
+    Read the content of a TEI file, compressed or not.
+
+    Returns:
+        str: The XML content.
+    """
+    with open_tei(path, "rt") as tei_file:
+        return tei_file.read()
+
+
+def write_tei(path, text):
+    """
+    Write a TEI file, compressed according to its name. The file is
+    replaced atomically, and the other forms of the same document are
+    removed so that a single TEI file remains.
+
+    Args:
+        path (str): The TEI file to write.
+        text (str): The XML content.
+    """
+    part_path = path + ".part"
+    with open_tei(part_path, "wt", compression=compression_of(path)) as tei_file:
+        tei_file.write(text)
+    os.replace(part_path, path)
+
+    directory, filename = os.path.split(path)
+    stem = tei_stem(filename)
+    if stem is not None:
+        for suffix in TEI_SUFFIXES:
+            other_path = os.path.join(directory, stem + suffix)
+            if other_path != path and os.path.exists(other_path):
+                os.remove(other_path)
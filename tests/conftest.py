@@ -0,0 +1,69 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+# The scripts import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "script_python"))
+
+
+class StubServer:
+    """
+    Local HTTP server answering every request with `handler(method, path, params, headers)`,
+    which returns (status, body) or (status, body, headers). A stopped server can be started
+    again on the same port by passing it `port`.
+    """
+
+    def __init__(self, handler, port=0):
+        self.handler = handler
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def answer(self):
+                url = urlsplit(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    body = self.rfile.read(length).decode()
+                    params.update({key: values[0] for key, values in parse_qs(body).items()})
+                stub.requests.append((self.command, url.path, params))
+                status, body, *headers = stub.handler(self.command, url.path, params, self.headers)
+                body = body.encode() if isinstance(body, str) else body
+                self.send_response(status)
+                for name, value in (headers[0] if headers else {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = answer
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    servers = []
+
+    def start(handler, port=0):
+        server = StubServer(handler, port)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
@@ -0,0 +1,46 @@
+import sqlite3
+
+from download_ledger import DOWNLOADED, FAILED, DownloadLedger
+from download_manager import DownloadResult
+
+
+def test_attempts_are_counted_per_source(tmp_path):
+    path = str(tmp_path / "downloads.sqlite")
+    with DownloadLedger(path, max_attempts=2, source="pmc") as pmc, \
+            DownloadLedger(path, max_attempts=2, source="direct") as direct:
+        for _ in range(2):
+            pmc.start("10.1000/a")
+            pmc.mark_failed("10.1000/a", "PMCID non trouvé")
+
+        assert pmc.should_skip("10.1000/a")
+        assert not direct.should_skip("10.1000/a")
+        assert direct.get("10.1000/a") is None
+
+        pdf_path = tmp_path / "a.pdf"
+        pdf_path.write_bytes(b"%PDF-1.4")
+        direct.start("10.1000/a")
+        direct.record("10.1000/a", DownloadResult(True, None, "0" * 64, 8), str(pdf_path))
+
+        # Downloaded by any source: skipped by all of them
+        assert pmc.should_skip("10.1000/a", retry_failed=True)
+        assert pmc.get("10.1000/a")["state"] == DOWNLOADED
+
+
+def test_ledger_without_sources_is_migrated(tmp_path):
+    path = str(tmp_path / "downloads.sqlite")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE downloads (identifier TEXT PRIMARY KEY, state TEXT NOT NULL, reason TEXT, "
+                       "attempts INTEGER NOT NULL DEFAULT 0, path TEXT, sha256 TEXT, bytes INTEGER, source TEXT, "
+                       "updated REAL NOT NULL)")
+    connection.execute("INSERT INTO downloads (identifier, state, reason, attempts, source, updated) "
+                       "VALUES ('123', 'failed', 'No PDF link found', 3, 'direct', 0)")
+    connection.commit()
+    connection.close()
+
+    with DownloadLedger(path, max_attempts=3, source="direct") as direct:
+        assert direct.get("123")["state"] == FAILED
+        assert direct.should_skip("123")
+    with DownloadLedger(path, max_attempts=3, source="pmc") as pmc:
+        assert not pmc.should_skip("123")
+        pmc.start("123")
+        assert pmc.get("123")["attempts"] == 1
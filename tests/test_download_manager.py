@@ -0,0 +1,166 @@
+import hashlib
+import re
+import threading
+import time
+
+from download_manager import DownloadManager
+
+
+def test_fetch_text_limits_the_host_reached_after_redirects(stub_server):
+    lock = threading.Lock()
+    active = [0, 0]
+
+    def publisher(method, path, params, headers):
+        with lock:
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+        time.sleep(0.1)
+        with lock:
+            active[0] -= 1
+        return 200, f"<a href='https://example.org{path}.pdf'>PDF</a>"
+
+    target = stub_server(publisher)
+    # Two resolvers redirecting to the same host
+    resolvers = [stub_server(lambda method, path, params, headers: (302, "", {"Location": target.url + path}))
+                 for _ in range(2)]
+    urls = [f"{resolver.url}/10.1000/{index}" for resolver in resolvers for index in range(4)]
+
+    with DownloadManager(workers=8, per_host=2) as manager:
+        pages = list(manager.run(manager.fetch_text, urls))
+
+    assert all(text and final_url.startswith(target.url) for _, (text, final_url) in pages)
+    assert active[1] == 2
+
+
+def range_server(stub_server, resource):
+    """
+    Serve resource["content"] with resource["etag"], honouring Range when
+    If-Range is absent or matches the current ETag.
+    """
+
+    def handler(method, path, params, headers):
+        content, etag = resource["content"], resource["etag"]
+        match = re.match(r"bytes=(\d+)-", headers.get("Range") or "")
+        if match and headers.get("If-Range", etag) == etag:
+            start = int(match.group(1))
+            return 206, content[start:], {"ETag": etag, "Content-Range": f"bytes {start}-{len(content) - 1}/{len(content)}"}
+        return 200, content, {"ETag": etag}
+
+    return stub_server(handler)
+
+
+def test_resume_unchanged_resource(stub_server, tmp_path):
+    resource = {"content": bytes(range(256)) * 40, "etag": '"v1"'}
+    server = range_server(stub_server, resource)
+    dest = tmp_path / "a.pdf"
+    (tmp_path / "a.pdf.part").write_bytes(resource["content"][:1000])
+    (tmp_path / "a.pdf.part.validator").write_text('"v1"')
+
+    with DownloadManager() as manager:
+        result = manager.download(server.url + "/a.pdf", str(dest))
+
+    assert result.success and dest.read_bytes() == resource["content"]
+    assert result.sha256 == hashlib.sha256(resource["content"]).hexdigest()
+    assert not (tmp_path / "a.pdf.part.validator").exists()
+
+
+def test_resume_changed_resource_starts_over(stub_server, tmp_path):
+    resource = {"content": b"old version " * 500, "etag": '"v1"'}
+    server = range_server(stub_server, resource)
+    dest = tmp_path / "a.pdf"
+
+    # Interrupted download of the first version
+    with DownloadManager() as manager:
+        with manager.session.get(server.url + "/a.pdf") as response:
+            (tmp_path / "a.pdf.part").write_bytes(response.content[:1000])
+    (tmp_path / "a.pdf.part.validator").write_text('"v1"')
+
+    resource.update(content=b"new version " * 600, etag='"v2"')
+    with DownloadManager() as manager:
+        result = manager.download(server.url + "/a.pdf", str(dest))
+
+    assert result.success and dest.read_bytes() == resource["content"]
+
+
+def test_part_without_validator_is_not_resumed(stub_server, tmp_path):
+    requests = []
+    server = stub_server(lambda method, path, params, headers: (requests.append(headers.get("Range")) or
+                                                                 (200, b"%PDF-1.4 complete")))
+    (tmp_path / "a.pdf.part").write_bytes(b"garbage")
+
+    with DownloadManager() as manager:
+        result = manager.download(server.url + "/a.pdf", str(tmp_path / "a.pdf"))
+
+    assert result.success and (tmp_path / "a.pdf").read_bytes() == b"%PDF-1.4 complete"
+    assert requests == [None]
+
+
+def test_resume_at_another_offset_starts_over(stub_server, tmp_path):
+    content = bytes(range(256)) * 40
+
+    def handler(method, path, params, headers):
+        if headers.get("Range"):
+            # Ignores the requested offset
+            return 206, content[500:], {"ETag": '"v1"', "Content-Range": f"bytes 500-{len(content) - 1}/{len(content)}"}
+        return 200, content, {"ETag": '"v1"'}
+
+    server = stub_server(handler)
+    dest = tmp_path / "a.pdf"
+    (tmp_path / "a.pdf.part").write_bytes(content[:1000])
+    (tmp_path / "a.pdf.part.validator").write_text('"v1"')
+
+    with DownloadManager() as manager:
+        result = manager.download(server.url + "/a.pdf", str(dest))
+
+    assert result.success and dest.read_bytes() == content
+    # The resume attempt, then the whole resource
+    assert len(server.requests) == 2
+
+
+def test_download_limits_the_host_reached_after_redirects(stub_server, tmp_path):
+    lock = threading.Lock()
+    active = [0, 0]
+    content = b"%PDF-1.4 " + bytes(range(256)) * 40
+
+    def publisher(method, path, params, headers):
+        with lock:
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+        time.sleep(0.1)
+        with lock:
+            active[0] -= 1
+        return 200, content
+
+    target = stub_server(publisher)
+    resolvers = [stub_server(lambda method, path, params, headers: (302, "", {"Location": target.url + path}))
+                 for _ in range(2)]
+    urls = [f"{resolver.url}/{number}.pdf" for number, resolver in enumerate(resolvers * 4)]
+
+    with DownloadManager(workers=8, per_host=2) as manager:
+        results = list(manager.run(lambda url: manager.download(url, str(tmp_path / url.rsplit("/", 1)[1])), urls))
+
+    assert all(result.success and result.size == len(content) for _, result in results)
+    assert len(target.requests) == 8 and active[1] == 2
+
+
+def test_resume_after_redirects(stub_server, tmp_path):
+    resource = {"content": bytes(range(256)) * 40, "etag": '"v1"'}
+    ranges = []
+    publisher = range_server(stub_server, resource)
+    handler = publisher.handler
+
+    def recording_handler(method, path, params, headers):
+        ranges.append(headers.get("Range"))
+        return handler(method, path, params, headers)
+
+    publisher.handler = recording_handler
+    resolver = stub_server(lambda method, path, params, headers: (301, "", {"Location": publisher.url + path}))
+    (tmp_path / "a.pdf.part").write_bytes(resource["content"][:1000])
+    (tmp_path / "a.pdf.part.validator").write_text('"v1"')
+
+    with DownloadManager() as manager:
+        result = manager.download(resolver.url + "/a.pdf", str(tmp_path / "a.pdf"))
+
+    assert result.success and (tmp_path / "a.pdf").read_bytes() == resource["content"]
+    # Resumed from the publisher: the Range request reached the final host
+    assert ranges == ["bytes=1000-"]
@@ -0,0 +1,134 @@
+import io
+import json
+import os
+import re
+import shutil
+
+import fitz
+
+from extract_figure import extract_figures_and_coords, extract_images_from_pdf, parse_coords
+from grobid_parsing import FIGURE_CACHE_SUFFIX, FIGURE_CACHE_VERSION, load_figures, read_figure_cache
+from image_index import ImageIndex
+
+
+def pattern(size):
+    """
+    A PNG of the same pattern at any size: near-duplicates with different content.
+    """
+    samples = bytes(value for y in range(size) for x in range(size)
+                    for value in (x * 256 // size, y * 256 // size, (x + y) * 128 // size))
+    return fitz.Pixmap(fitz.csRGB, size, size, samples, False).tobytes("png")
+
+
+def write_pdf(path, images):
+    with fitz.open() as doc:
+        page = doc.new_page()
+        for index, image in enumerate(images):
+            page.insert_image(fitz.Rect(10, 10 + 150 * index, 138, 138 + 150 * index), stream=image)
+        doc.save(path)
+
+
+def test_near_duplicates_are_returned_once(tmp_path):
+    write_pdf(str(tmp_path / "paper.pdf"), [pattern(64), pattern(128)])
+    index = ImageIndex(str(tmp_path / "_images"), boilerplate_papers=0)
+    error_log = io.StringIO()
+
+    paths = extract_images_from_pdf(str(tmp_path / "paper.pdf"), str(tmp_path / "paper"), error_log, index)
+
+    assert len(paths) == 1
+    assert error_log.getvalue() == f"paper.pdf\t{paths[0]}\t\tDuplicate image\t" \
+                                   "The image is ignored because a near-duplicate image was already extracted\n"
+
+
+def test_blocked_image_repeats_are_logged_with_their_path(tmp_path):
+    # The same image inserted from a PNG and from a PPM: two objects with the same content
+    write_pdf(str(tmp_path / "paper.pdf"), [pattern(64), fitz.Pixmap(pattern(64)).tobytes("ppm")])
+    index = ImageIndex(str(tmp_path / "_images"), boilerplate_papers=1)
+    error_log = io.StringIO()
+
+    paths = extract_images_from_pdf(str(tmp_path / "paper.pdf"), str(tmp_path / "paper"), error_log, index)
+
+    assert paths == []
+    lines = error_log.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[0] == lines[1]
+    assert lines[0].split("\t")[1].startswith(str(tmp_path / "_images"))
+    assert lines[0].split("\t")[3] == "Boilerplate image"
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+# The figure regex of extract_figure.py before the structural reader
+FIGURE_REGEX = re.compile(
+    r'<figure(?![^>]*\btype="table")[^>]*>\s*'
+    r'<head>[^<]*</head>\s*'
+    r'<label>[^<]*</label>\s*'
+    r'<figDesc>(.*?)</figDesc>\s*'
+    r'(<graphic[^>]*coords="([^"]+)"[^>]*type="bitmap"[^>]*/>)?',
+    re.DOTALL
+)
+
+
+def copy_sample(tmp_path):
+    tei_path = tmp_path / "paper.tei.xml"
+    shutil.copyfile(os.path.join(DATA_DIR, "grobid_sample.tei.xml"), tei_path)
+    return tei_path
+
+
+def plain(legend):
+    return " ".join(re.sub(r"<[^>]+>", "", legend).split())
+
+
+def test_structural_reader_finds_the_figures_of_the_regex(tmp_path):
+    tei_path = copy_sample(tmp_path)
+    figures = extract_figures_and_coords(str(tei_path))
+
+    regex_figures = [(plain(legend), coords or None) for legend, _, coords in FIGURE_REGEX.findall(tei_path.read_text())]
+    structural = dict(figures)
+    for legend, coords in regex_figures:
+        # Same legend, and the same coordinates when the regex found some
+        assert legend in structural
+        assert coords is None or structural[legend] == coords
+    # The figure without <head> and <label> is only found by the structural reader
+    assert len(regex_figures) == 2
+    assert ("Supplementary view of the tail bud.", "7,100.00,100.00,300.00,200.00") in figures
+
+
+def test_tables_are_excluded(tmp_path):
+    figures = extract_figures_and_coords(str(copy_sample(tmp_path)))
+
+    assert [legend for legend, _ in figures] == [
+        "Notochord intercalation. (Satoh, 2003) (A) Stage 21 embryo. (B) Stage 23 embryo.",
+        "Cell elongation over two pages.",
+        "Supplementary view of the tail bud.",
+    ]
+
+
+def test_multi_region_coords(tmp_path):
+    figures = dict(extract_figures_and_coords(str(copy_sample(tmp_path))))
+
+    # Without graphic, the coordinates of the figure: one box per page
+    coords = figures["Cell elongation over two pages."]
+    assert coords == "4,72.00,80.00,220.00,150.00;5,72.00,60.00,220.00,140.00"
+    # The boxes are merged on the page of the first one
+    assert parse_coords(coords) == (4, fitz.Rect(72, 80, 292, 230))
+    assert parse_coords("2,10,10,20,20;2,50,40,10,10") == (2, fitz.Rect(10, 10, 60, 50))
+
+
+def test_figure_cache_is_refreshed_when_the_tei_changes(tmp_path):
+    tei_path = copy_sample(tmp_path)
+    figures = load_figures(str(tei_path))
+    cache_path = tmp_path / ("paper" + FIGURE_CACHE_SUFFIX)
+    assert read_figure_cache(str(tei_path)) == figures and cache_path.exists()
+
+    # Up to date: read from the figure file
+    cache_path.write_text(json.dumps({"version": FIGURE_CACHE_VERSION, "figures": []}))
+    assert load_figures(str(tei_path)) == []
+
+    # The TEI file is newer than its figure file: read again
+    tei_path.write_text(tei_path.read_text().replace("Cell elongation", "Cell growth"))
+    os.utime(cache_path, (os.path.getmtime(tei_path) - 10,) * 2)
+    assert read_figure_cache(str(tei_path)) is None
+    figures = load_figures(str(tei_path))
+    assert "Cell growth over two pages." in [figure.get("legend") for figure in figures]
+    assert read_figure_cache(str(tei_path)) == figures
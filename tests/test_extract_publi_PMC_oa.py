@@ -0,0 +1,90 @@
+import io
+import os
+import tarfile
+
+from extract_publi_PMC_oa import INDEX_SUFFIX, OaIngester, Request, find_archives, read_index
+
+
+def jats(pmcid, pmid, doi):
+    return (f'<article><front><article-meta><article-id pub-id-type="pmid">{pmid}</article-id>'
+            f'<article-id pub-id-type="pmc">{pmcid[3:]}</article-id>'
+            f'<article-id pub-id-type="doi">{doi}</article-id></article-meta></front></article>').encode()
+
+
+def pdf(pmcid):
+    return f"%PDF-1.4\n% {pmcid}\n1 0 obj << /Type /Pages /Count 1 >> endobj\n%%EOF\n".encode()
+
+
+def article_members(pmcid, pmid, doi):
+    return [(f"{pmcid}/article.nxml", jats(pmcid, pmid, doi)), (f"{pmcid}/article.pdf", pdf(pmcid))]
+
+
+def tar_bytes(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def write_tar(path, members):
+    with open(path, "wb") as tar_file:
+        tar_file.write(tar_bytes(members))
+
+
+def make_archives(directory):
+    """
+    A per-article package (PMC111) and an oa_bulk-style tarball holding
+    two articles (PMC222, PMC333) and a nested per-article package (PMC444).
+    """
+    os.makedirs(directory)
+    write_tar(os.path.join(directory, "PMC111.tar.gz"), article_members("PMC111", "111", "10.1000/a"))
+    write_tar(os.path.join(directory, "oa_bulk.tar.gz"),
+              article_members("PMC222", "222", "10.1000/b")
+              + article_members("PMC333", "333", "10.1000/c")
+              + [("PMC444.tar.gz", tar_bytes(article_members("PMC444", "444", "10.1000/d")))])
+
+
+def ingest(request, tmp_path):
+    ingester = OaIngester(request, str(tmp_path / "data_pdf"), str(tmp_path / "data_jats_xml"))
+    for archive_path in find_archives([str(tmp_path / "archives")]):
+        ingester.ingest(archive_path)
+    return ingester
+
+
+def test_requested_articles_are_extracted(tmp_path):
+    make_archives(str(tmp_path / "archives"))
+    # One article requested by PMCID, PMID and DOI each; PMC333 is not requested
+    request = Request(["PMC111", "222", "10.1000/D"])
+    ingest(request, tmp_path)
+
+    assert request.complete()
+    assert sorted(os.listdir(tmp_path / "data_pdf")) == [".store", "10.1000%2Fa.pdf", "10.1000%2Fb.pdf", "10.1000%2Fd.pdf"]
+    assert (tmp_path / "data_pdf" / "10.1000%2Fb.pdf").read_bytes() == pdf("PMC222")
+    assert (tmp_path / "data_jats_xml" / "10.1000%2Fd.nxml").read_bytes() == jats("PMC444", "444", "10.1000/d")
+
+    # Index written for the bulk tarball only
+    assert not os.path.exists(tmp_path / "archives" / ("PMC111.tar.gz" + INDEX_SUFFIX))
+    assert read_index(str(tmp_path / "archives" / "oa_bulk.tar.gz")) == [
+        ("PMC222", "222", "10.1000/b"), ("PMC333", "333", "10.1000/c"), ("PMC444", "444", "10.1000/d")]
+
+
+def test_indexed_archive_stops_after_requested_articles(tmp_path, capsys):
+    make_archives(str(tmp_path / "archives"))
+    ingest(Request(["PMC444"]), tmp_path)
+
+    # Resolved from the index, then only read up to the article
+    request = Request(["222"])
+    ingester = ingest(request, tmp_path)
+    assert request.complete()
+    assert os.path.exists(tmp_path / "data_pdf" / "10.1000%2Fb.pdf")
+    assert ingester.rows == [("PMC222", "222", "10.1000/b")]
+
+    # Archives without any requested article are not read
+    capsys.readouterr()
+    request = Request(["10.1000/unknown"])
+    ingest(request, tmp_path)
+    assert not request.complete()
+    assert "oa_bulk.tar.gz: no requested article (index)" in capsys.readouterr().out
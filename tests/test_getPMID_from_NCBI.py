@@ -0,0 +1,63 @@
+import io
+
+import pytest
+
+import getPMID_from_NCBI
+from getPMID_from_NCBI import read_saved_pmids, save_pmid_to_file
+
+
+@pytest.fixture
+def pubmed(monkeypatch):
+    """
+    Stub of the NCBI history server: the results are the PMIDs of `pubmed["results"]`,
+    and the retstart of each efetch is recorded.
+    """
+    state = {"results": [], "retstarts": []}
+
+    def esearch(**kwargs):
+        return io.StringIO()
+
+    def read(handle):
+        return {"Count": str(len(state["results"])), "WebEnv": "webenv", "QueryKey": "1"}
+
+    def efetch(retstart, retmax, **kwargs):
+        state["retstarts"].append(retstart)
+        return io.StringIO("".join(f"{pmid}\n" for pmid in state["results"][retstart:retstart + retmax]))
+
+    monkeypatch.setattr(getPMID_from_NCBI.Entrez, "esearch", esearch)
+    monkeypatch.setattr(getPMID_from_NCBI.Entrez, "read", read)
+    monkeypatch.setattr(getPMID_from_NCBI.Entrez, "efetch", efetch)
+    return state
+
+
+def test_saved_pmids_without_the_incomplete_line(tmp_path):
+    path = tmp_path / "pmids.txt"
+    path.write_text("".join(f"{pmid}\n" for pmid in range(100, 110)) + "11")
+
+    assert read_saved_pmids(str(path), tail=3) == (10, {"107", "108", "109"})
+    assert path.read_text().endswith("109\n")
+    assert read_saved_pmids(str(tmp_path / "missing.txt")) == (0, set())
+
+
+def test_resume_after_the_saved_pmids(pubmed, tmp_path):
+    path = tmp_path / "pmids.txt"
+    pubmed["results"] = [str(pmid) for pmid in range(1000, 1025)]
+    # Interrupted after 12 PMIDs, in the middle of a line
+    path.write_text("".join(f"{pmid}\n" for pmid in pubmed["results"][:12]) + "101")
+
+    # 3 papers published since: the resumed search starts with 3 saved PMIDs
+    pubmed["results"] = ["2000", "2001", "2002"] + pubmed["results"]
+    assert save_pmid_to_file("query", str(path), page_size=5, resume=True) == (28, 25)
+
+    assert path.read_text().split() == [str(pmid) for pmid in range(1000, 1025)]
+    # Paged from the saved count, not from the start
+    assert pubmed["retstarts"] == [12, 17, 22, 27]
+
+
+def test_new_search_overwrites_the_file(pubmed, tmp_path):
+    path = tmp_path / "pmids.txt"
+    path.write_text("1\n2\n")
+    pubmed["results"] = [str(pmid) for pmid in range(1000, 1007)]
+
+    assert save_pmid_to_file("query", str(path), page_size=5) == (7, 7)
+    assert path.read_text().split() == pubmed["results"]
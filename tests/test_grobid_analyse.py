@@ -0,0 +1,222 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+import grobid_analyse
+from grobid_analyse import FULLTEXT_PATH, ISALIVE_PATH, VERSION_PATH, GrobidClient, TeiManifest
+from tei_io import read_tei, write_tei
+
+TEI = "<TEI>processed</TEI>"
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(grobid_analyse, "BACKOFF", 0.01)
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = tmp_path / "a.pdf"
+    path.write_bytes(b"%PDF-1.4 test")
+    return str(path)
+
+
+def grobid_handler(fulltext=None, delay=0.0):
+    """
+    Handler of a stub Grobid server: alive, version 0.8.0, and processFulltextDocument
+    answered by `fulltext()` (200 with a TEI by default) after `delay` seconds.
+    """
+    lock = threading.Lock()
+    state = {"active": 0, "max_active": 0}
+
+    def handler(method, path, params, headers):
+        if path == ISALIVE_PATH:
+            return 200, "true"
+        if path == VERSION_PATH:
+            return 200, "0.8.0"
+        with lock:
+            state["active"] += 1
+            state["max_active"] = max(state["max_active"], state["active"])
+        time.sleep(delay)
+        with lock:
+            state["active"] -= 1
+        return fulltext() if fulltext else (200, TEI)
+
+    handler.state = state
+    return handler
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.02)
+
+
+def test_pdfs_go_to_the_server_with_fewest_in_flight(stub_server, pdf_path):
+    handlers = [grobid_handler(delay=0.1), grobid_handler(delay=0.1)]
+    servers = [stub_server(handler) for handler in handlers]
+
+    with GrobidClient([server.url for server in servers], concurrency=2) as client:
+        first, second, third = client.acquire(), client.acquire(), client.acquire()
+        assert [first, second, third] == [client.nodes[0], client.nodes[1], client.nodes[0]]
+        for node in (first, second, third):
+            client.release(node, None)
+
+        results = list(client.run([pdf_path] * 8))
+
+    assert all(text == TEI for _, text, _ in results)
+    assert sum(node.processed for node in client.nodes) == 8 and all(node.processed for node in client.nodes)
+    assert [handler.state["max_active"] for handler in handlers] == [2, 2]
+
+
+def test_unreachable_server_is_ejected(stub_server, pdf_path):
+    handler = grobid_handler()
+    stopped, alive = stub_server(handler), stub_server(handler)
+
+    # No health check during the test: the server is ejected on the connection error
+    with GrobidClient([stopped.url, alive.url], concurrency=1, health_interval=60) as client:
+        assert all(node.healthy for node in client.nodes)
+        stopped.close()
+
+        # The PDF sent to the stopped server is sent again to the other one
+        assert [client.process_fulltext(pdf_path) for _ in range(3)] == [(TEI, None)] * 3
+
+    assert not client.nodes[0].healthy and client.nodes[0].ejections == 1
+    assert [node.processed for node in client.nodes] == [0, 3]
+
+
+def test_stopped_server_is_readmitted_by_the_health_check(stub_server, pdf_path):
+    handler = grobid_handler()
+    alive, restarted = stub_server(handler), stub_server(handler)
+
+    with GrobidClient([alive.url, restarted.url], concurrency=1, health_interval=0.1) as client:
+        port = restarted.server.server_port
+        restarted.close()
+        wait_for(lambda: not client.nodes[1].healthy)
+
+        stub_server(handler, port)
+        wait_for(lambda: client.nodes[1].healthy)
+        # Used again: the other server is reserved, this one is free
+        client.acquire()
+        assert client.acquire() is client.nodes[1]
+
+    assert client.nodes[1].ejections == 1
+
+
+def test_no_server_available(stub_server, monkeypatch, pdf_path):
+    monkeypatch.setattr(grobid_analyse, "NODE_WAIT", 0.3)
+    server = stub_server(grobid_handler())
+    server.close()
+
+    with GrobidClient([server.url], health_interval=0.1) as client:
+        start = time.monotonic()
+        assert client.process_fulltext(pdf_path) == (None, "No Grobid server available")
+
+    assert time.monotonic() - start >= 0.3
+    assert not client.nodes[0].healthy
+
+
+def busy_handler(busy_replies):
+    """
+    Stub Grobid answering 503 to the first `busy_replies` PDFs, then 200.
+    """
+    replies = iter([(503, "busy")] * busy_replies)
+    return grobid_handler(lambda: next(replies, (200, TEI)))
+
+
+def test_busy_server_is_retried(stub_server, pdf_path):
+    server = stub_server(busy_handler(3))
+
+    with GrobidClient([server.url], max_retries=3) as client:
+        assert client.process_fulltext(pdf_path) == (TEI, None)
+
+    node = client.nodes[0]
+    assert (node.busy, node.processed, node.failed) == (3, 1, 0)
+    assert len([path for _, path, _ in server.requests if path == FULLTEXT_PATH]) == 4
+
+
+def test_busy_server_after_the_last_retry(stub_server, pdf_path):
+    server = stub_server(busy_handler(5))
+
+    with GrobidClient([server.url], max_retries=2) as client:
+        assert client.process_fulltext(pdf_path) == (None, "HTTP 503")
+
+    node = client.nodes[0]
+    assert (node.busy, node.processed, node.failed) == (3, 0, 0)
+    assert node.healthy
+
+
+def test_pdf_hash_is_reused_while_size_and_mtime_match(tmp_path, pdf_path):
+    tei_path = str(tmp_path / "a.tei.xml")
+    with TeiManifest(str(tmp_path / "manifest.sqlite")) as manifest:
+        sha256 = manifest.pdf_sha256(tei_path, pdf_path)
+        manifest.record(tei_path, pdf_path, sha256, "0.8.0", {})
+
+        # Same size and modification time: the PDF is not read again
+        stat = os.stat(pdf_path)
+        with open(pdf_path, "wb") as pdf_file:
+            pdf_file.write(b"%PDF-1.4 TEST")
+        os.utime(pdf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert manifest.pdf_sha256(tei_path, pdf_path) == sha256
+
+        os.utime(pdf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert manifest.pdf_sha256(tei_path, pdf_path) == hashlib.sha256(b"%PDF-1.4 TEST").hexdigest()
+
+
+def test_tei_is_current_for_the_same_pdf_version_and_params(tmp_path, pdf_path):
+    tei_path = str(tmp_path / "a.tei.xml")
+    manifest_path = str(tmp_path / "manifest.sqlite")
+    params = {"teiCoordinates": "figure", "consolidateHeader": "1"}
+    with TeiManifest(manifest_path) as manifest:
+        sha256 = manifest.pdf_sha256(tei_path, pdf_path)
+        manifest.record(tei_path, pdf_path, sha256, "0.8.0", params)
+        # Recorded, but the TEI file does not exist
+        assert not manifest.is_current(tei_path, sha256, "0.8.0", params)
+
+    write_tei(tei_path + ".gz", TEI)
+    with TeiManifest(manifest_path) as manifest:
+        # Read back from the database, whatever the order of the parameters and the compression
+        assert manifest.is_current(tei_path, sha256, "0.8.0", dict(reversed(params.items())))
+        assert not manifest.is_current(tei_path, "0" * 64, "0.8.0", params)
+        assert not manifest.is_current(tei_path, sha256, "0.8.1", params)
+        assert not manifest.is_current(tei_path, sha256, "0.8.0", {"teiCoordinates": "figure"})
+        assert not manifest.is_current(str(tmp_path / "b.tei.xml"), sha256, "0.8.0", params)
+
+
+def run_main(monkeypatch, tmp_path, server, *options):
+    monkeypatch.setattr(sys, "argv", ["grobid_analyse.py", "--pdf-dir", str(tmp_path / "pdf"),
+                                      "--output-dir", str(tmp_path / "tei"),
+                                      "--manifest", str(tmp_path / "manifest.sqlite"),
+                                      "--error-file", str(tmp_path / "errors.txt"),
+                                      "--summary-file", str(tmp_path / "summary.json"),
+                                      "--grobid-url", server.url, *options])
+    before = len([path for _, path, _ in server.requests if path == FULLTEXT_PATH])
+    grobid_analyse.main()
+    return len([path for _, path, _ in server.requests if path == FULLTEXT_PATH]) - before
+
+
+def test_only_outdated_pdfs_are_sent_again(stub_server, monkeypatch, tmp_path):
+    server = stub_server(grobid_handler())
+    (tmp_path / "pdf").mkdir()
+    for name in ("a", "b"):
+        (tmp_path / "pdf" / f"{name}.pdf").write_bytes(f"%PDF-1.4 {name}".encode())
+
+    assert run_main(monkeypatch, tmp_path, server) == 2
+    assert run_main(monkeypatch, tmp_path, server) == 0
+
+    # Up-to-date TEI files are compressed without Grobid
+    assert run_main(monkeypatch, tmp_path, server, "--compress", "gzip") == 0
+    assert sorted(os.listdir(tmp_path / "tei")) == ["a.tei.xml.gz", "b.tei.xml.gz"]
+    assert read_tei(str(tmp_path / "tei" / "a.tei.xml.gz")) == TEI
+
+    # A changed PDF, other parameters, or --force
+    (tmp_path / "pdf" / "a.pdf").write_bytes(b"%PDF-1.4 changed")
+    assert run_main(monkeypatch, tmp_path, server) == 1
+    assert run_main(monkeypatch, tmp_path, server, "--param", "teiCoordinates=figure") == 2
+    assert run_main(monkeypatch, tmp_path, server, "--param", "teiCoordinates=figure") == 0
+    assert run_main(monkeypatch, tmp_path, server, "--param", "teiCoordinates=figure", "--force") == 2
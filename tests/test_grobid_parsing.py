@@ -0,0 +1,102 @@
+import json
+import os
+
+import pytest
+
+from benchmark_grobid_parsing import baseline_tei_to_json, generate_tei
+from grobid_parsing import TEI, convert_file, parse_tei, remove_references, tei_to_json
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+
+def read_sample():
+    with open(os.path.join(DATA_DIR, "grobid_sample.tei.xml"), "r", encoding="utf-8") as tei_file:
+        return tei_file.read()
+
+
+def test_json_is_the_same_as_grobid_tei_xml():
+    pytest.importorskip("grobid_tei_xml")
+    pytest.importorskip("bs4")
+    # Figures, a table, references, an empty abstract, editors, ptr URL, acknowledgement and annex
+    xml_data = read_sample()
+
+    assert tei_to_json(xml_data) == baseline_tei_to_json(xml_data)
+    assert "abstract" not in json.loads(tei_to_json(xml_data))
+
+
+def test_generated_json_is_the_same_as_grobid_tei_xml():
+    pytest.importorskip("grobid_tei_xml")
+    pytest.importorskip("bs4")
+    for number in range(5):
+        xml_data = generate_tei(number)
+        assert tei_to_json(xml_data) == baseline_tei_to_json(xml_data)
+
+
+@pytest.mark.parametrize("sections", [False, True])
+def test_stream_gives_the_same_json_as_the_tree(tmp_path, sections):
+    # A large document: 2,000 sections, 400 figures, 1,000 references (about 7 MB)
+    tei_path = tmp_path / "large.tei.xml"
+    tei_path.write_text(generate_tei(sections=2000, figures=400, references=1000), encoding="utf-8")
+
+    tree = convert_file("large", str(tei_path), None, sections, stream_threshold=None, figure_cache=False)
+    stream = convert_file("large", str(tei_path), None, sections, stream_threshold=0, figure_cache=False)
+
+    assert tree[1] is None and stream[1] is None
+    assert stream[3] == tree[3]
+
+
+def test_stream_gives_the_same_figures_as_the_tree():
+    for xml_data in (read_sample(), generate_tei(sections=50, figures=20)):
+        tree_figures, stream_figures = [], []
+        assert tei_to_json(xml_data, True, False, tree_figures) == tei_to_json(xml_data, True, True, stream_figures)
+        assert stream_figures == tree_figures and tree_figures
+
+
+def unit_texts(xml_data):
+    """
+    Texts of the titles and paragraphs of the body, read from the TEI.
+    """
+    root = parse_tei(xml_data)
+    remove_references(root)
+    body = root.find(f".//{TEI}text/{TEI}body")
+    texts = []
+    for elem in body.iter(f"{TEI}head", f"{TEI}p"):
+        if elem.tag == f"{TEI}p" or elem.getparent().tag == f"{TEI}div":
+            text = " ".join(elem.itertext()).replace("\n", "").strip()
+            if text:
+                texts.append(text)
+    return texts
+
+
+# A title after a paragraph, a paragraph outside any section, a paragraph split by newlines,
+# and a paragraph repeating the text of the previous one
+UNUSUAL_BODY = """<TEI xmlns="http://www.tei-c.org/ns/1.0"><teiHeader><encodingDesc><appInfo>
+<application version="0.8.0" ident="GROBID" when="2024-01-01T00:00+0000"/></appInfo></encodingDesc></teiHeader>
+<text xml:lang="en"><body>
+  <p>Before the sections.</p>
+  <div><p>Above the title.</p><head n="1">Methods</head><p>Cells were
+    counted <ref type="bibr" target="#b0">(Satoh, 2003)</ref>  twice.</p><p>Methods</p></div>
+  <div><head>Empty</head><p> </p></div>
+</body></text></TEI>"""
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_section_offsets_give_the_paragraphs(stream):
+    for xml_data in (read_sample(), generate_tei(sections=20), UNUSUAL_BODY):
+        document = json.loads(tei_to_json(xml_data, sections=True, stream=stream))
+        body = document["body"]
+
+        located = []
+        for section in document["sections"]:
+            spans = list(section["paragraphs"])
+            if "head" in section:
+                assert body[slice(*section["head"])] == section["title"]
+                spans.append(section["head"])
+            located.extend((start, body[start:end]) for start, end in spans)
+        # Every title and paragraph, in document order
+        assert [text for _, text in sorted(located)] == unit_texts(xml_data)
+
+    assert document["sections"] == [{"paragraphs": [[0, 20]]},
+                                    {"title": "Methods", "n": "1", "head": [41, 48],
+                                     "paragraphs": [[24, 40], [49, 79], [80, 87]]},
+                                    {"title": "Empty", "head": [91, 96], "paragraphs": []}]
@@ -0,0 +1,80 @@
+import json
+import os
+
+import pytest
+
+import bern2jsontoPubtator
+import json_corpus
+from json_corpus import INDEX_FILE, CorpusReader, CorpusWriter, iter_json_documents, open_writer
+
+COMPRESSIONS = ["none", "gzip", pytest.param("zstd", marks=pytest.mark.skipif(
+    json_corpus.zstandard is None, reason="zstandard is not installed"))]
+
+
+def documents(count):
+    return [(f"10.1000%2F{number}", {"title": f"Article {number} é", "body": "text " * number,
+                                      "citations": [{"id": f"b{number}"}]})
+            for number in range(count)]
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_round_trip(tmp_path, monkeypatch, compression):
+    # Several shards, and several blocks per compressed shard
+    monkeypatch.setattr(json_corpus, "BLOCK_BYTES", 100)
+    docs = documents(7)
+    with CorpusWriter(str(tmp_path), compression, shard_records=3) as writer:
+        for doc_id, document in docs:
+            # As dict or as JSON (grobid_parsing.py)
+            writer.write(doc_id, document if len(doc_id) % 2 else json.dumps(document))
+
+    shards = sorted(filename for filename in os.listdir(tmp_path) if filename.startswith("part-"))
+    assert shards == [f"part-0000{number}{json_corpus.COMPRESSIONS[compression]}" for number in range(3)]
+    with open(tmp_path / INDEX_FILE, encoding="utf-8") as index_file:
+        assert len(index_file.readlines()) == 1 + len(docs)
+
+    with CorpusReader(str(tmp_path)) as reader:
+        assert list(reader) == docs
+        assert reader.ids() == [doc_id for doc_id, _ in docs]
+        # Random access, by identifier or by DOI, in any order
+        assert reader.get("10.1000/5") == docs[5][1]
+        for doc_id, document in reversed(docs):
+            assert reader.get(doc_id) == document
+        with pytest.raises(KeyError):
+            reader.get("10.1000/404")
+
+
+def test_document_with_an_id_field_is_rejected(tmp_path):
+    with CorpusWriter(str(tmp_path)) as writer:
+        with pytest.raises(ValueError):
+            writer.write("a", {"id": "other", "body": "text"})
+        with pytest.raises(ValueError):
+            writer.write("a", '{"body": "text", "id": "other"}')
+        writer.write("a", {"body": "text"})
+        with pytest.raises(ValueError):
+            writer.write("a", {"body": "again"})
+
+    assert list(iter_json_documents(str(tmp_path))) == [("a", {"body": "text"})]
+
+
+def bern2_result(number):
+    annotation = {"mention": "Brachyury", "obj": "gene", "id": ["NCBIGene:1"], "span": {"begin": 0, "end": 9}}
+    return {"abstract": {"text": f"Brachyury abstract {number}", "annotations": [annotation]},
+            "body": {"text": f"Brachyury body {number}", "annotations": [annotation]},
+            "figure_legends": []}
+
+
+def test_prefixed_identifiers_are_the_same_in_both_layouts(tmp_path):
+    for output_format in ("files", "jsonl"):
+        with open_writer(str(tmp_path / output_format), output_format, prefix="data_bern2_", indent=2) as writer:
+            for number in range(3):
+                writer.write(f"10.1000%2F{number}", bern2_result(number))
+
+    assert os.path.exists(tmp_path / "files" / "data_bern2_10.1000%2F0.json")
+    assert list(iter_json_documents(str(tmp_path / "jsonl"))) == list(iter_json_documents(str(tmp_path / "files")))
+
+    for output_format in ("files", "jsonl"):
+        bern2jsontoPubtator.process_corpus(str(tmp_path / output_format), None,
+                                           str(tmp_path / f"{output_format}.pubtator"))
+    pubtator = (tmp_path / "jsonl.pubtator").read_text()
+    assert pubtator == (tmp_path / "files.pubtator").read_text()
+    assert pubtator.startswith("data_bern2_10.1000%2F0|t|Brachyury abstract 0")
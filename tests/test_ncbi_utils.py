@@ -0,0 +1,133 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import ncbi_utils
+from id_cache import IdCache
+from ncbi_utils import NcbiClient, resolve_dois, resolve_pmcids
+
+
+def esummary(pmids):
+    result = {"uids": pmids}
+    for pmid in pmids:
+        result[pmid] = {"uid": pmid, "articleids": [{"idtype": "pubmed", "value": pmid},
+                                                    {"idtype": "doi", "value": f"10.1000/{pmid}"}]}
+    return json.dumps({"result": result})
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(ncbi_utils, "BACKOFF", 0.01)
+
+
+def run(coroutine_function, *args, rate=1000, **kwargs):
+    with NcbiClient(rate=rate, concurrency=4) as client:
+        return asyncio.run(coroutine_function(client, *args, **kwargs))
+
+
+def test_resolve_dois_in_batches(stub_server, monkeypatch):
+    server = stub_server(lambda method, path, params, headers: (200, esummary(params["id"].split(","))))
+    monkeypatch.setattr(ncbi_utils, "ESUMMARY_URL", server.url + "/esummary")
+
+    pmids = [str(pmid) for pmid in range(1, 8)]
+    dois = run(resolve_dois, pmids, 3)
+
+    assert dois == {pmid: f"10.1000/{pmid}" for pmid in pmids}
+    assert [method for method, _, _ in server.requests] == ["POST"] * 3
+
+
+def test_retry_on_server_error(stub_server, monkeypatch):
+    replies = iter([(503, "busy"), (429, "slow down", {"Retry-After": "0"})])
+    server = stub_server(lambda method, path, params, headers: next(replies, (200, esummary(params["id"].split(",")))))
+    monkeypatch.setattr(ncbi_utils, "ESUMMARY_URL", server.url + "/esummary")
+
+    assert run(resolve_dois, ["42"]) == {"42": "10.1000/42"}
+    assert len(server.requests) == 3
+
+
+def test_failed_batch_keeps_the_others(stub_server, monkeypatch):
+    def handler(method, path, params, headers):
+        pmids = params["id"].split(",")
+        if "4" in pmids:
+            return 400, "bad request"
+        if "7" in pmids:
+            return 200, "{not json"
+        return 200, esummary(pmids)
+
+    server = stub_server(handler)
+    monkeypatch.setattr(ncbi_utils, "ESUMMARY_URL", server.url + "/esummary")
+
+    failed = {}
+    dois = run(resolve_dois, [str(pmid) for pmid in range(1, 8)], 3, failed=failed)
+
+    assert dois == {"1": "10.1000/1", "2": "10.1000/2", "3": "10.1000/3"}
+    assert sorted(failed) == ["4", "5", "6", "7"]
+
+
+def test_write_dois_lists_failed_requests(stub_server, monkeypatch, tmp_path):
+    server = stub_server(lambda method, path, params, headers: (200, esummary(["1"])) if params["id"] == "1" else (404, ""))
+    monkeypatch.setattr(ncbi_utils, "ESUMMARY_URL", server.url + "/esummary")
+    output_file, error_file = tmp_path / "dois.txt", tmp_path / "errors.txt"
+
+    ncbi_utils.write_dois(["1", "2"], str(output_file), batch_size=1, error_file=str(error_file))
+
+    assert output_file.read_text() == "10.1000/1\n"
+    assert error_file.read_text().startswith("Request failed for PMID 2: HTTPError")
+
+
+def test_resolve_pmcids(stub_server, monkeypatch):
+    def handler(method, path, params, headers):
+        records = "".join(f'<record requested-id="{identifier}" pmcid="PMC{index}"/>'
+                          for index, identifier in enumerate(params["ids"].split(",")) if identifier != "3")
+        return 200, f"<pmcids>{records}</pmcids>"
+
+    server = stub_server(handler)
+    monkeypatch.setattr(ncbi_utils, "IDCONV_URL", server.url + "/idconv")
+
+    pmcids = run(resolve_pmcids, ["1", "3", "10.1000/X", "pmc77"])
+
+    # The PMCIDs are not sent to idconv
+    assert pmcids == {"1": "PMC0", "3": None, "10.1000/X": "PMC0", "pmc77": "PMC77"}
+    assert sorted(params["idtype"] for _, _, params in server.requests) == ["doi", "pmid"]
+
+
+def test_rate_limit(stub_server, monkeypatch):
+    started = []
+
+    def handler(method, path, params, headers):
+        started.append(time.monotonic())
+        return 200, esummary(params["id"].split(","))
+
+    server = stub_server(handler)
+    monkeypatch.setattr(ncbi_utils, "ESUMMARY_URL", server.url + "/esummary")
+
+    run(resolve_dois, [str(pmid) for pmid in range(25)], 1, rate=10)
+
+    # No burst: any 11 consecutive requests span at least one second (small margin for the network)
+    started.sort()
+    assert len(started) == 25
+    assert min(last - first for first, last in zip(started, started[10:])) > 0.95
+
+
+def test_only_answered_pmids_are_cached(stub_server, monkeypatch, tmp_path):
+    def handler(method, path, params, headers):
+        if params["id"] == "9":
+            return 200, json.dumps({"error": "API rate limit exceeded"})
+        result = json.loads(esummary(["1"]))["result"]
+        result["2"] = {"uid": "2", "articleids": [{"idtype": "pubmed", "value": "2"}]}
+        result["3"] = {"uid": "3", "error": "cannot get document summary"}
+        return 200, json.dumps({"result": result})
+
+    server = stub_server(handler)
+    monkeypatch.setattr(ncbi_utils, "ESUMMARY_URL", server.url + "/esummary")
+
+    with IdCache(str(tmp_path / "ids.sqlite")) as cache:
+        failed = {}
+        dois = run(resolve_dois, ["1", "2", "3", "4", "9"], 4, cache=cache, failed=failed)
+
+        assert dois == {"1": "10.1000/1", "2": None, "3": None}
+        assert list(failed) == ["9"]
+        # 4 is missing from the reply and 9 got an error body: neither is cached as not found
+        assert cache.get_many("pmid", "doi", ["1", "2", "3", "4", "9"]) == dois
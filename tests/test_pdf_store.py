@@ -0,0 +1,40 @@
+import errno
+import os
+
+from pdf_store import PdfStore
+
+PDF = b"%PDF-1.4\n1 0 obj << /Type /Pages /Count 1 >> endobj\n%%EOF\n"
+
+
+def add_twice(store, tmp_path):
+    for name in ("a", "b"):
+        part_path = tmp_path / f"{name}.part"
+        part_path.write_bytes(PDF)
+        assert store.add(str(part_path), str(tmp_path / "data_pdf" / f"{name}.pdf")) == (True, None)
+        assert not part_path.exists()
+
+
+def stored_files(store):
+    return [filename for _, _, files in os.walk(store.store_dir) for filename in files]
+
+
+def test_same_pdf_is_stored_once(tmp_path):
+    store = PdfStore(str(tmp_path / "data_pdf"))
+    add_twice(store, tmp_path)
+
+    assert os.path.samefile(tmp_path / "data_pdf" / "a.pdf", tmp_path / "data_pdf" / "b.pdf")
+    assert len(stored_files(store)) == 1
+
+
+def test_pdfs_are_saved_in_place_without_hard_links(tmp_path, monkeypatch):
+    def link(src, dst):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(os, "link", link)
+    store = PdfStore(str(tmp_path / "data_pdf"))
+    add_twice(store, tmp_path)
+
+    # No second copy in the store
+    assert (tmp_path / "data_pdf" / "a.pdf").read_bytes() == PDF
+    assert (tmp_path / "data_pdf" / "b.pdf").read_bytes() == PDF
+    assert stored_files(store) == []
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+from process_pool import run_tasks
+
+
+def double(value, crash_on=()):
+    if value in crash_on:
+        # As a segmentation fault: the worker process dies without an exception
+        os._exit(1)
+    return value * 2
+
+
+def crashed(value, crash_on=()):
+    return "crashed", value
+
+
+@pytest.mark.parametrize("chunksize", [1, 3])
+def test_crash_of_a_worker_only_affects_its_task(chunksize):
+    tasks = [(value, (3, 7)) for value in range(10)]
+
+    results = list(run_tasks(double, tasks, 2, crashed, chunksize))
+
+    assert results == [0, 2, 4, ("crashed", 3), 8, 10, 12, ("crashed", 7), 16, 18]
+
+
+def test_single_worker_runs_in_this_process():
+    assert list(run_tasks(os.getpid, [()] * 3, 1, crashed)) == [os.getpid()] * 3
+    assert os.getpid() not in run_tasks(os.getpid, [()] * 3, 2, crashed)
@@ -0,0 +1,75 @@
+import gzip
+import os
+
+import pytest
+
+import tei_io
+from tei_io import find_tei, list_tei, open_tei, read_tei, tei_filename, tei_size, write_tei
+
+TEI = '<?xml version="1.0" encoding="UTF-8"?>\n<TEI><text><body><p>Cellule é</p></body></text></TEI>\n' * 50
+
+COMPRESSIONS = ["none", "gzip", pytest.param("zstd", marks=pytest.mark.skipif(
+    tei_io.zstandard is None, reason="zstandard is not installed"))]
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_round_trip(tmp_path, compression):
+    path = str(tmp_path / tei_filename("10.1%2Fabc", compression))
+    write_tei(path, TEI)
+
+    assert read_tei(path) == TEI
+    with open_tei(path) as tei_file:
+        assert tei_file.read() == TEI.encode("utf-8")
+    assert find_tei(str(tmp_path), "10.1%2Fabc") == path
+    assert list_tei(str(tmp_path)) == [("10.1%2Fabc", path)]
+    # No temporary file left
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+    if compression != "none":
+        with open(path, "rb") as tei_file:
+            assert tei_file.read(2) != TEI[:2].encode()
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_other_forms_are_removed_on_write(tmp_path, compression):
+    for other in ("none", "gzip"):
+        write_tei(str(tmp_path / tei_filename("a", other)), "<TEI>old</TEI>")
+    write_tei(str(tmp_path / tei_filename("b")), "<TEI>other document</TEI>")
+
+    path = str(tmp_path / tei_filename("a", compression))
+    write_tei(path, TEI)
+
+    assert sorted(os.listdir(tmp_path)) == sorted([os.path.basename(path), "b.tei.xml"])
+    assert read_tei(find_tei(str(tmp_path), "a")) == TEI
+
+
+def test_tei_size_reads_the_gzip_trailer(tmp_path, monkeypatch):
+    path = str(tmp_path / tei_filename("a", "gzip"))
+    write_tei(path, TEI)
+    assert os.path.getsize(path) < len(TEI.encode("utf-8"))
+
+    # The size is read from the trailer, without decompressing the file
+    def no_decompression(*args, **kwargs):
+        raise AssertionError("decompressed")
+    monkeypatch.setattr(gzip, "open", no_decompression)
+    monkeypatch.setattr(gzip, "decompress", no_decompression)
+    assert tei_size(path) == len(TEI.encode("utf-8"))
+
+
+def test_tei_size_of_plain_and_zstd_files(tmp_path):
+    path = str(tmp_path / tei_filename("a"))
+    write_tei(path, TEI)
+    assert tei_size(path) == len(TEI.encode("utf-8"))
+
+    zstandard = pytest.importorskip("zstandard")
+    path = str(tmp_path / tei_filename("b", "zstd"))
+    with open(path, "wb") as tei_file:
+        # One-shot compression: the frame header gives the content size
+        tei_file.write(zstandard.ZstdCompressor().compress(TEI.encode("utf-8")))
+    assert tei_size(path) == len(TEI.encode("utf-8"))
+
+
+def test_gzip_written_elsewhere_is_read(tmp_path):
+    path = str(tmp_path / "a.tei.xml.gz")
+    with gzip.open(path, "wt", encoding="utf-8") as tei_file:
+        tei_file.write(TEI)
+    assert read_tei(path) == TEI and tei_size(path) == len(TEI.encode("utf-8"))